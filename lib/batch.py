@@ -0,0 +1,66 @@
+import math
+import numpy
+from lib.dynamics import ChainDynamics
+
+
+def build_chain(rods, position = (0.0, 0.0, 0.0), integrator = None):
+  """returns ChainDynamics for a list of (length, angle[, mass]) tuples,
+     angles given in degrees just like for RodsChain.push"""
+  rods = [tuple(rod) + (1.0,) * (3 - len(rod)) for rod in rods]
+  lengths = [rod[0] for rod in rods]
+  angles = [math.radians(rod[1]) for rod in rods]
+  masses = [rod[2] for rod in rods]
+  return ChainDynamics(lengths, angles, masses, position = position, integrator = integrator)
+
+
+class BatchRunner(object):
+  """This class runs a simulation without any graphics: it steps the chain
+     with a fixed time step and samples its trajectory."""
+
+  def __init__(self, dynamics, time_step = 1.0 / 60.0, steps = None, duration = None, every = 1):
+    """prepares a run of given number of steps or given duration in seconds"""
+    if steps is None:
+      if duration is None:
+        raise ValueError("either steps or duration has to be given")
+      steps = int(round(duration / time_step))
+    self.dynamics = dynamics
+    self.time_step = time_step
+    self.steps = steps
+    self.every = every
+
+  def run(self):
+    """performs the simulation and returns sampled times, angles and angular velocities"""
+    samples = self.steps // self.every + 1
+    time = numpy.empty(samples)
+    theta = numpy.empty((samples,) + self.dynamics.theta.shape)
+    omega = numpy.empty((samples,) + self.dynamics.theta.shape)
+    dynamics = self.dynamics
+    time[0], theta[0], omega[0] = dynamics.time, dynamics.theta, dynamics.omega
+    for step in range(1, self.steps + 1):
+      dynamics.step(self.time_step)
+      if step % self.every == 0:
+        sample = step // self.every
+        time[sample], theta[sample], omega[sample] = dynamics.time, dynamics.theta, dynamics.omega
+    self.trajectory = (time, theta, omega)
+    return self.trajectory
+
+  def stream(self, recorder):
+    """performs the simulation writing states straight to a TrajectoryRecorder instead of memory"""
+    recorder.sample(self.dynamics)
+    for step in range(self.steps):
+      self.dynamics.step(self.time_step)
+      recorder.record(self.dynamics)
+
+  def save(self, path):
+    """writes the trajectory to .npz (default) or .csv file"""
+    time, theta, omega = self.trajectory
+    if path.endswith(".csv"):
+      if theta.ndim > 2:
+        raise ValueError("only a single chain can be written as csv")
+      count = theta.shape[1]
+      header = ",".join(["time"] + ["theta%d" % i for i in range(count)] + ["omega%d" % i for i in range(count)])
+      numpy.savetxt(path, numpy.column_stack((time, theta, omega)), delimiter = ",", header = header, comments = "")
+    else:
+      numpy.savez(path, time = time, theta = theta, omega = omega,
+                  lengths = self.dynamics.lengths, masses = self.dynamics.masses,
+                  time_step = self.time_step)
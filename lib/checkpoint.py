@@ -0,0 +1,106 @@
+import random
+import numpy
+from lib.dynamics import ChainDynamics
+from lib.ensemble import ChainEnsemble
+from lib.elastic import ElasticChainDynamics
+from lib.integrators import INTEGRATORS
+
+
+VERSION = 1
+KINDS = {'chain': ChainDynamics, 'ensemble': ChainEnsemble, 'elastic': ElasticChainDynamics}
+SPRINGS = ("springs", "stiffness", "damping", "rest_lengths")
+
+
+def _kind(dynamics):
+  for kind, cls in KINDS.items():
+    if type(dynamics) is cls:
+      return kind
+  raise ValueError("cannot checkpoint %s" % type(dynamics).__name__)
+
+
+def _integrator(integrator):
+  for name, cls in INTEGRATORS.items():
+    if type(integrator) is cls:
+      return name
+  raise ValueError("cannot checkpoint %s integrator" % type(integrator).__name__)
+
+
+def generator_state(generator):
+  """returns state of a random.Random or numpy RandomState as a dict of arrays"""
+  if isinstance(generator, numpy.random.RandomState):
+    name, keys, position, has_gauss, gauss = generator.get_state()
+    return {"random.kind": "numpy", "random.keys": keys, "random.position": position,
+            "random.has_gauss": has_gauss, "random.gauss": gauss}
+  if isinstance(generator, random.Random):
+    version, internal, gauss = generator.getstate()
+    return {"random.kind": "python", "random.version": version,
+            "random.keys": numpy.array(internal, dtype = numpy.uint32),
+            "random.has_gauss": gauss is not None, "random.gauss": 0.0 if gauss is None else gauss}
+  raise ValueError("unsupported random generator %s" % type(generator).__name__)
+
+
+def set_generator_state(generator, state):
+  """puts a random generator back into a state stored by generator_state"""
+  kind = str(state["random.kind"])
+  if kind == "numpy" and isinstance(generator, numpy.random.RandomState):
+    generator.set_state(("MT19937", state["random.keys"], int(state["random.position"]),
+                         int(state["random.has_gauss"]), float(state["random.gauss"])))
+  elif kind == "python" and isinstance(generator, random.Random):
+    gauss = float(state["random.gauss"]) if bool(state["random.has_gauss"]) else None
+    generator.setstate((int(state["random.version"]), tuple(int(key) for key in state["random.keys"]), gauss))
+  else:
+    raise ValueError("checkpoint holds a %s generator state, got %s" % (kind, type(generator).__name__))
+
+
+def save_checkpoint(path, dynamics, generator = None):
+  """writes complete state of a ChainDynamics (or its ensemble or elastic kind) and its integrator
+     to an .npz file; state of an optional random generator is stored along"""
+  state = {"version": VERSION, "kind": _kind(dynamics), "lengths": dynamics.lengths,
+           "masses": dynamics.masses, "theta": dynamics.theta, "omega": dynamics.omega,
+           "position": dynamics.position, "gravity": dynamics.gravity,
+           "offsets": dynamics.offsets, "inertias": dynamics.inertias,
+           "time": dynamics.time, "steps": dynamics.steps,
+           "integrator": _integrator(dynamics.integrator)}
+  # integrators keep only numbers: tolerances, last step size and counters; private caches are rebuilt
+  for name, value in vars(dynamics.integrator).items():
+    if not name.startswith("_"):
+      state["integrator." + name] = value
+  if isinstance(dynamics, ElasticChainDynamics):
+    for name in SPRINGS:
+      state[name] = getattr(dynamics, name)
+  if generator is not None:
+    state.update(generator_state(generator))
+  with open(path, "wb") as output:
+    numpy.savez(output, **state)
+
+
+def load_checkpoint(path, generator = None):
+  """returns dynamics stored by save_checkpoint, continuing exactly where it stopped;
+     a given random generator is put back into the stored state"""
+  with numpy.load(path) as source:
+    state = dict((name, source[name]) for name in source.files)
+  if int(state["version"]) != VERSION:
+    raise ValueError("%s is a checkpoint of unsupported version %d" % (path, state["version"]))
+  integrator = INTEGRATORS[str(state["integrator"])]()
+  for name in vars(integrator):
+    if not name.startswith("_"):
+      setattr(integrator, name, state["integrator." + name].item())
+  position, gravity = tuple(state["position"].tolist()), state["gravity"].item()
+  kind = str(state["kind"])
+  if kind == "elastic":
+    count = len(state["lengths"])
+    dynamics = ElasticChainDynamics(state["lengths"], state["theta"][:count], state["masses"], state["omega"][:count],
+                                    position = position, gravity = gravity, integrator = integrator,
+                                    **dict((name, state[name]) for name in SPRINGS))
+    dynamics.theta, dynamics.omega = state["theta"], state["omega"]
+  else:
+    # checkpoints written before physical rods hold point masses only
+    dynamics = KINDS[kind](state["lengths"], state["theta"], state["masses"], state["omega"],
+                           position, gravity, integrator, state.get("offsets"), state.get("inertias"))
+  dynamics.time = state["time"].item()
+  dynamics.steps = int(state["steps"])
+  if generator is not None:
+    if "random.kind" not in state:
+      raise ValueError("%s holds no random generator state" % path)
+    set_generator_state(generator, state)
+  return dynamics
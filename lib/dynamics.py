@@ -0,0 +1,234 @@
+import numpy
+from lib.integrators import RungeKutta4
+from lib.links import _differences
+
+
+GRAVITY = 9.81
+
+
+def _links(values):
+  """returns per-link values of an array as a list, links being the last axis"""
+  if values.ndim == 1:
+    return values.tolist()
+  return list(numpy.moveaxis(values, -1, 0))
+
+
+def _below(values):
+  """returns sums of values over every link and all links below it"""
+  return numpy.cumsum(values[..., ::-1], axis = -1)[..., ::-1]
+
+
+def chain_accelerations(theta, omega, lengths, masses, gravity = GRAVITY, torques = None, armature = None,
+                        moments = None, joint_inertias = None):
+  """returns angular accelerations of a planar chain of links
+
+     Angles are absolute and measured from the downward vertical. Every
+     link is a rigid body hinged at the tip of the link above: moments are
+     its masses times distances of centres of mass from the hinge and
+     joint_inertias its moments of inertia about the hinge; by default
+     the whole mass hangs at the tip. The articulated-body recursion runs in
+     O(N): an inward pass folds the subchain below every joint into a 2x2
+     articulated inertia and a bias force, an outward pass propagates joint
+     accelerations back down the chain. Optional torques act on links,
+     optional armature is added to the inertia of every joint, solving
+     (M + diag(armature)) alpha = f for implicit integrators instead.
+     All arguments may carry leading batch axes, links are always the
+     last axis."""
+  if moments is None:
+    moments, joint_inertias = masses * lengths, masses * lengths * lengths
+  sin, cos = numpy.sin(theta), numpy.cos(theta)
+  weight = masses * gravity
+  torque = gravity * moments * sin
+  if torques is not None:
+    torque = torque - torques
+  # everything that does not depend on the recursion is computed at once
+  nx, ny = _links(cos), _links(sin)
+  ex, ey = ny, _links(-cos)
+  ml, mll = _links(moments * numpy.ones_like(theta)), _links(joint_inertias * numpy.ones_like(theta))
+  l, w, m = _links(lengths), _links(torque), _links(masses)
+  g, ww = _links(weight), _links(omega * omega)
+  count = len(l)
+  extra = _links(armature * numpy.ones_like(theta)) if armature is not None else [0.0] * count
+  hx, hy, d, u = [None] * count, [None] * count, [None] * count, [None] * count
+  # inward pass: articulated inertia (axx, axy, ayy) and bias (bx, by)
+  axx = axy = ayy = bx = by = 0.0
+  for k in range(count - 1, -1, -1):
+    lk = l[k]
+    nax, nay = axx * nx[k] + axy * ny[k], axy * nx[k] + ayy * ny[k]
+    eax, eay = axx * ex[k] + axy * ey[k], axy * ex[k] + ayy * ey[k]
+    hx[k], hy[k] = ml[k] * nx[k] + lk * nax, ml[k] * ny[k] + lk * nay
+    d[k] = mll[k] + lk * lk * (nx[k] * nax + ny[k] * nay) + extra[k]
+    u[k] = lk * (lk * ww[k] * (nx[k] * eax + ny[k] * eay) - nx[k] * bx - ny[k] * by) - w[k]
+    kx, ky = ml[k] * ex[k] + lk * eax, ml[k] * ey[k] + lk * eay
+    ud = u[k] / d[k]
+    axx, axy, ayy = (m[k] + axx - hx[k] * hx[k] / d[k], axy - hx[k] * hy[k] / d[k],
+                     m[k] + ayy - hy[k] * hy[k] / d[k])
+    bx, by = bx - ww[k] * kx + hx[k] * ud, by + g[k] - ww[k] * ky + hy[k] * ud
+  # outward pass: accelerations of joints starting from the fixed pivot
+  alpha = [None] * count
+  px = py = 0.0
+  for k in range(count):
+    alpha[k] = (u[k] - hx[k] * px - hy[k] * py) / d[k]
+    px, py = px + l[k] * (alpha[k] * nx[k] - ww[k] * ex[k]), py + l[k] * (alpha[k] * ny[k] - ww[k] * ey[k])
+  return numpy.moveaxis(numpy.array(alpha, dtype = float), 0, -1)
+
+
+def _momenta_below(theta, omega, lengths, masses, moments):
+  """returns velocities of hinges of links and momenta of all links below every link"""
+  sin, cos = numpy.sin(theta), numpy.cos(theta)
+  vx = numpy.cumsum(lengths * omega * cos, axis = -1) - lengths * omega * cos
+  vy = numpy.cumsum(lengths * omega * sin, axis = -1) - lengths * omega * sin
+  # a link moves with its hinge and turns about it
+  px, py = masses * vx + moments * omega * cos, masses * vy + moments * omega * sin
+  return vx, vy, _below(px) - px, _below(py) - py
+
+
+def chain_momenta(theta, omega, lengths, masses, moments = None, joint_inertias = None):
+  """returns generalized momenta conjugate to absolute angles, M(theta) omega, in O(N)"""
+  if moments is None:
+    moments, joint_inertias = masses * lengths, masses * lengths * lengths
+  sin, cos = numpy.sin(theta), numpy.cos(theta)
+  vx, vy, px, py = _momenta_below(theta, omega, lengths, masses, moments)
+  return lengths * (cos * px + sin * py) + moments * (cos * vx + sin * vy) + joint_inertias * omega
+
+
+def chain_velocities(theta, momenta, lengths, masses, armature = None, moments = None, joint_inertias = None):
+  """returns angular velocities for given momenta, M(theta)^-1 p, in O(N);
+     with armature it solves (M(theta) + diag(armature)) x = p instead"""
+  return chain_accelerations(theta, numpy.zeros_like(momenta), lengths, masses, 0.0, momenta, armature,
+                             moments, joint_inertias)
+
+
+def chain_forces(theta, omega, lengths, masses, gravity = GRAVITY, moments = None):
+  """returns partial derivatives of the Lagrangian over angles, the rate of change of momenta"""
+  if moments is None:
+    moments = masses * lengths
+  sin, cos = numpy.sin(theta), numpy.cos(theta)
+  vx, vy, px, py = _momenta_below(theta, omega, lengths, masses, moments)
+  below = _below(masses * numpy.ones_like(theta)) - masses
+  return (-omega * (lengths * (sin * px - cos * py) + moments * (sin * vx - cos * vy)) -
+          gravity * sin * (lengths * below + moments))
+
+
+class ChainDynamics(object):
+  """This class keeps the physical state of a planar chain of rods in
+     contiguous arrays and advances it in time. A link is a point mass at
+     the tip of its rod unless offsets of centres of mass from the hinge
+     and moments of inertia about them are given, making it a physical
+     pendulum; both are packed once into the arrays the kernels take."""
+
+  def __init__(self, lengths, angles, masses = None, velocities = None,
+               position = (0.0, 0.0, 0.0), gravity = GRAVITY, integrator = None, offsets = None, inertias = None):
+    """sets up a chain, angles are absolute, given in radians; RK4 is used unless other integrator is given"""
+    self.lengths = numpy.array(lengths, dtype = float)
+    self.theta = numpy.array(angles, dtype = float)
+    if masses is None:
+      masses = numpy.ones_like(self.lengths)
+    self.masses = numpy.array(masses, dtype = float)
+    if velocities is None:
+      velocities = numpy.zeros_like(self.theta)
+    self.omega = numpy.array(velocities, dtype = float)
+    if not self.lengths.shape == self.theta.shape == self.masses.shape == self.omega.shape:
+      raise ValueError("lengths, angles, masses and velocities differ in size")
+    if numpy.any(self.masses <= 0.0) or numpy.any(self.lengths <= 0.0):
+      raise ValueError("links need a positive length and mass")
+    self.offsets = self.lengths.copy() if offsets is None else numpy.array(offsets, dtype = float)
+    self.inertias = numpy.zeros_like(self.lengths) if inertias is None else numpy.array(inertias, dtype = float)
+    if not self.offsets.shape == self.inertias.shape == self.lengths.shape:
+      raise ValueError("offsets and inertias differ in size from lengths")
+    if numpy.any(self.inertias < 0.0):
+      raise ValueError("links need a non-negative moment of inertia")
+    self.pack()
+    self.position = tuple(position)
+    self.gravity = gravity
+    self.integrator = integrator or RungeKutta4()
+    self.time = 0.0
+    self.steps = 0
+
+  def __len__(self):
+    return len(self.lengths)
+
+  def pack(self):
+    """computes first moments of mass and moments of inertia of links about their hinges,
+       to be called whenever masses, offsets or inertias change"""
+    self.moments = self.masses * self.offsets
+    self.joint_inertias = self.moments * self.offsets + self.inertias
+    self.point_masses = bool(numpy.all(self.offsets == self.lengths) and numpy.all(self.inertias == 0.0))
+
+  def accelerations(self, theta = None, omega = None, armature = None, forces = None):
+    """returns angular accelerations for given (or current) state, optionally
+       with extra torques and armature for implicit steps"""
+    if theta is None:
+      theta, omega = self.theta, self.omega
+    return chain_accelerations(theta, omega, self.lengths, self.masses, self.gravity, forces, armature,
+                               self.moments, self.joint_inertias)
+
+  def stiff_terms(self, theta, omega):
+    """returns diagonals of stiffness and damping of angles: curvature of the potential of
+       weights hanging below every link, taken as zero for links above the pivot"""
+    below = _below(self.masses * numpy.ones_like(theta)) - self.masses
+    stiffness = self.gravity * (below * self.lengths + self.moments) * numpy.cos(theta)
+    return numpy.maximum(stiffness, 0.0), numpy.zeros_like(theta)
+
+  def rigid(self):
+    """returns a mask of links keeping their length, all of them"""
+    return numpy.ones(self.lengths.shape, dtype = bool)
+
+  def cartesian(self, theta, omega):
+    """returns positions and velocities of masses relative to the pivot as x, y, vx, vy arrays"""
+    if not self.point_masses:
+      raise ValueError("cartesian coordinates need every mass at the tip of its rod")
+    sin, cos = numpy.sin(theta), numpy.cos(theta)
+    return (numpy.cumsum(self.lengths * sin, axis = -1), numpy.cumsum(-self.lengths * cos, axis = -1),
+            numpy.cumsum(self.lengths * omega * cos, axis = -1), numpy.cumsum(self.lengths * omega * sin, axis = -1))
+
+  def coordinates(self, x, y, vx, vy, theta):
+    """returns angles and angular velocities of links for positions and velocities of masses,
+       angles are unwrapped to lie closest to given theta"""
+    dx, dy, dvx, dvy = _differences(x), _differences(y), _differences(vx), _differences(vy)
+    previous = theta[..., :dx.shape[-1]]
+    angles = previous + numpy.remainder(numpy.arctan2(dx, -dy) - previous + numpy.pi, 2.0 * numpy.pi) - numpy.pi
+    return angles, (dx * dvy - dy * dvx) / (dx * dx + dy * dy)
+
+  def cartesian_forces(self, x, y, vx, vy):
+    """returns forces acting on masses besides constraints of links, only weights"""
+    return numpy.zeros_like(x), -self.masses * self.gravity * numpy.ones_like(y)
+
+  def momenta(self, theta, omega):
+    """returns generalized momenta for given state"""
+    return chain_momenta(theta, omega, self.lengths, self.masses, self.moments, self.joint_inertias)
+
+  def velocities(self, theta, momenta, armature = None):
+    """returns angular velocities for given angles and momenta, optionally with armature"""
+    return chain_velocities(theta, momenta, self.lengths, self.masses, armature, self.moments, self.joint_inertias)
+
+  def forces(self, theta, omega):
+    """returns time derivatives of momenta for given state"""
+    return chain_forces(theta, omega, self.lengths, self.masses, self.gravity, self.moments)
+
+  def step(self, dt):
+    """advances the chain by dt"""
+    self.integrator.step(self, dt)
+    self.steps += 1
+
+  def tips(self, theta = None):
+    """returns an (N, 3) array with positions of all rod tips for given (or current) angles"""
+    if theta is None:
+      theta = self.theta
+    tips = numpy.empty(theta.shape + (3,))
+    tips[..., 0] = self.position[0] + numpy.cumsum(self.lengths * numpy.sin(theta), axis = -1)
+    tips[..., 1] = self.position[1] - numpy.cumsum(self.lengths * numpy.cos(theta), axis = -1)
+    tips[..., 2] = self.position[2]
+    return tips
+
+  def energy(self):
+    """returns total (kinetic and potential) energy of the chain"""
+    sin, cos = numpy.sin(self.theta), numpy.cos(self.theta)
+    # velocities and heights of hinges, every link turns about its own
+    vx = numpy.cumsum(self.lengths * self.omega * cos, axis = -1) - self.lengths * self.omega * cos
+    vy = numpy.cumsum(self.lengths * self.omega * sin, axis = -1) - self.lengths * self.omega * sin
+    height = self.tips()[..., 1] - self.position[1] + self.lengths * cos
+    kinetic = (0.5 * self.masses * (vx * vx + vy * vy) + self.moments * self.omega * (cos * vx + sin * vy) +
+               0.5 * self.joint_inertias * self.omega * self.omega)
+    potential = self.gravity * (self.masses * height - self.moments * cos)
+    return numpy.sum(kinetic + potential, axis = -1)
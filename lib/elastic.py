@@ -0,0 +1,252 @@
+import numpy
+from lib.dynamics import ChainDynamics, GRAVITY, _links, _below
+from lib.links import _differences
+
+
+def spring_lengths(lengths, theta, springs):
+  """returns lengths of all links, those of springs taken from generalized coordinates"""
+  count = lengths.shape[-1]
+  lengths = numpy.array(numpy.broadcast_to(lengths, theta.shape[:-1] + (count,)))
+  lengths[..., springs] = theta[..., count:]
+  return lengths
+
+
+def _spread(values, count, springs):
+  """returns per-link values of spring coordinates, zero for rods"""
+  spread = numpy.zeros(values.shape[:-1] + (count,))
+  spread[..., springs] = values
+  return spread
+
+
+def elastic_accelerations(theta, omega, lengths, masses, springs, gravity = GRAVITY,
+                          forces = None, armature = None):
+  """returns generalized accelerations of a planar chain of rods and springs
+
+     Generalized coordinates are absolute angles of all N links followed by
+     lengths of S springs (links listed in springs), theta and omega have
+     N + S entries. A rod joint moves its tip along one direction, a spring
+     joint along two, otherwise the articulated-body recursion is the one
+     of chain_accelerations. forces are generalized forces (spring tension
+     included) and armature is added to the joint inertia of every
+     coordinate, which turns the recursion into an O(N) solve of
+     (M + diag(armature)) a = f used by implicit integrators."""
+  count = lengths.shape[-1]
+  spring = numpy.zeros(count, dtype = bool)
+  spring[list(springs)] = True
+  angles = theta[..., :count]
+  length = spring_lengths(lengths, theta, springs)
+  sin, cos = numpy.sin(angles), numpy.cos(angles)
+  if forces is None:
+    forces = numpy.zeros_like(theta)
+  if armature is None:
+    armature = numpy.zeros_like(theta)
+  nx, ny = _links(cos), _links(sin)
+  ex, ey = ny, _links(-cos)
+  l, m, g = _links(length), _links(masses * numpy.ones_like(angles)), _links(masses * gravity * numpy.ones_like(angles))
+  w, rate = _links(omega[..., :count]), _links(_spread(omega[..., count:], count, springs))
+  qt, qr = _links(forces[..., :count]), _links(_spread(forces[..., count:], count, springs))
+  at, ar = _links(armature[..., :count]), _links(_spread(armature[..., count:], count, springs))
+  joints = [None] * count
+  # inward pass: articulated inertia (axx, axy, ayy) and bias (bx, by) seen at the joint
+  axx = axy = ayy = bx = by = 0.0
+  for k in range(count - 1, -1, -1):
+    # own mass joins the subchain, velocity product terms move with the tip
+    fxx, fxy, fyy = axx + m[k], axy, ayy + m[k]
+    cx = 2.0 * rate[k] * w[k] * nx[k] - l[k] * w[k] * w[k] * ex[k]
+    cy = 2.0 * rate[k] * w[k] * ny[k] - l[k] * w[k] * w[k] * ey[k]
+    gx, gy = bx + fxx * cx + fxy * cy, by + g[k] + fxy * cx + fyy * cy
+    sx, sy = l[k] * nx[k], l[k] * ny[k]
+    ux, uy = fxx * sx + fxy * sy, fxy * sx + fyy * sy
+    dtt = sx * ux + sy * uy + at[k]
+    ut = qt[k] - sx * gx - sy * gy
+    if spring[k]:
+      vx, vy = fxx * ex[k] + fxy * ey[k], fxy * ex[k] + fyy * ey[k]
+      dtr, drr = ex[k] * ux + ey[k] * uy, ex[k] * vx + ey[k] * vy + ar[k]
+      ur = qr[k] - ex[k] * gx - ey[k] * gy
+      det = dtt * drr - dtr * dtr
+      # rows of U D^-1 where columns of U are A s and A e
+      kxt, kxr = (drr * ux - dtr * vx) / det, (dtt * vx - dtr * ux) / det
+      kyt, kyr = (drr * uy - dtr * vy) / det, (dtt * vy - dtr * uy) / det
+      axx, axy, ayy = fxx - kxt * ux - kxr * vx, fxy - kxt * uy - kxr * vy, fyy - kyt * uy - kyr * vy
+      bx, by = gx + kxt * ut + kxr * ur, gy + kyt * ut + kyr * ur
+      joints[k] = (sx, sy, cx, cy, ux, uy, ut, dtt, vx, vy, ur, dtr, drr, det)
+    else:
+      axx, axy, ayy = fxx - ux * ux / dtt, fxy - ux * uy / dtt, fyy - uy * uy / dtt
+      bx, by = gx + ux * ut / dtt, gy + uy * ut / dtt
+      joints[k] = (sx, sy, cx, cy, ux, uy, ut, dtt)
+  # outward pass: accelerations of joints starting from the fixed pivot
+  alpha, stretch = [None] * count, []
+  px = py = 0.0
+  for k in range(count):
+    joint = joints[k]
+    sx, sy, cx, cy, ux, uy, ut, dtt = joint[:8]
+    yt = ut - ux * px - uy * py
+    if spring[k]:
+      vx, vy, ur, dtr, drr, det = joint[8:]
+      yr = ur - vx * px - vy * py
+      alpha[k] = (drr * yt - dtr * yr) / det
+      rr = (dtt * yr - dtr * yt) / det
+      stretch.append(rr)
+      px, py = px + sx * alpha[k] + ex[k] * rr + cx, py + sy * alpha[k] + ey[k] * rr + cy
+    else:
+      alpha[k] = yt / dtt
+      px, py = px + sx * alpha[k] + cx, py + sy * alpha[k] + cy
+  return numpy.moveaxis(numpy.array(alpha + stretch, dtype = float), 0, -1)
+
+
+class ElasticChainDynamics(ChainDynamics):
+  """This class is a chain mixing rigid rods and springs. Angles of all
+     links followed by current lengths of springs are its generalized
+     coordinates, kept in theta (and their rates in omega), so every
+     integrator works with it unchanged. A spring has a rest length,
+     stiffness and damping, its mass hangs at the tip like that of a rod."""
+
+  def __init__(self, lengths, angles, masses = None, velocities = None, springs = (), stiffness = (),
+               damping = None, rest_lengths = None, rates = None, position = (0.0, 0.0, 0.0),
+               gravity = GRAVITY, integrator = None):
+    """sets up a chain, springs are indices of links being springs, their initial lengths come from lengths"""
+    ChainDynamics.__init__(self, lengths, angles, masses, velocities, position, gravity, integrator)
+    self.springs = sorted(int(index) for index in springs)
+    if len(set(self.springs)) != len(self.springs) or not all(0 <= index < len(self) for index in self.springs):
+      raise ValueError("springs have to be distinct link indices")
+    count = len(self.springs)
+    self.stiffness = numpy.array(stiffness, dtype = float).reshape(count)
+    self.damping = numpy.zeros(count) if damping is None else numpy.array(damping, dtype = float).reshape(count)
+    if rest_lengths is None:
+      rest_lengths = self.lengths[self.springs]
+    self.rest_lengths = numpy.array(rest_lengths, dtype = float).reshape(count)
+    if numpy.any(self.stiffness <= 0.0) or numpy.any(self.damping < 0.0) or numpy.any(self.rest_lengths <= 0.0):
+      raise ValueError("springs need positive stiffness and rest length and non-negative damping")
+    rates = numpy.zeros(count) if rates is None else numpy.array(rates, dtype = float).reshape(count)
+    self.theta = numpy.concatenate((self.theta, self.lengths[self.springs]))
+    self.omega = numpy.concatenate((self.omega, rates))
+
+  def spring_forces(self, lengths, rates):
+    """returns minus tensions of springs of given lengths stretching at given rates"""
+    return -self.stiffness * (lengths - self.rest_lengths) - self.damping * rates
+
+  def tension(self, theta, omega):
+    """returns generalized forces of springs: minus tension on their lengths, zero on angles"""
+    count = len(self)
+    forces = numpy.zeros_like(theta)
+    forces[..., count:] = self.spring_forces(theta[..., count:], omega[..., count:])
+    return forces
+
+  def stiff_terms(self, theta, omega):
+    """returns diagonals of stiffness and damping of generalized coordinates: springs
+       and curvature of the potential of weights on angles"""
+    count = len(self)
+    length = spring_lengths(self.lengths, theta, self.springs)
+    below = _below(self.masses * numpy.ones_like(length))
+    stiffness, damping = numpy.zeros_like(theta), numpy.zeros_like(theta)
+    stiffness[..., :count] = numpy.maximum(self.gravity * below * length * numpy.cos(theta[..., :count]), 0.0)
+    stiffness[..., count:], damping[..., count:] = self.stiffness, self.damping
+    return stiffness, damping
+
+  def accelerations(self, theta = None, omega = None, armature = None, forces = None):
+    """returns generalized accelerations for given (or current) state, optionally
+       with extra generalized forces and armature for implicit steps"""
+    if theta is None:
+      theta, omega = self.theta, self.omega
+    total = self.tension(theta, omega)
+    if forces is not None:
+      total = total + forces
+    return elastic_accelerations(theta, omega, self.lengths, self.masses, self.springs, self.gravity,
+                                 total, armature)
+
+  def link_velocities(self, theta, omega):
+    """returns velocities of masses as two (N,) arrays"""
+    count = len(self)
+    length = spring_lengths(self.lengths, theta, self.springs)
+    rate = _spread(omega[..., count:], count, self.springs)
+    sin, cos = numpy.sin(theta[..., :count]), numpy.cos(theta[..., :count])
+    vx = numpy.cumsum(length * omega[..., :count] * cos + rate * sin, axis = -1)
+    vy = numpy.cumsum(length * omega[..., :count] * sin - rate * cos, axis = -1)
+    return vx, vy
+
+  def rigid(self):
+    """returns a mask of links keeping their length, those not being springs"""
+    rigid = ChainDynamics.rigid(self)
+    rigid[..., self.springs] = False
+    return rigid
+
+  def cartesian(self, theta, omega):
+    """returns positions and velocities of masses relative to the pivot as x, y, vx, vy arrays"""
+    count = len(self)
+    length = spring_lengths(self.lengths, theta, self.springs)
+    vx, vy = self.link_velocities(theta, omega)
+    return (numpy.cumsum(length * numpy.sin(theta[..., :count]), axis = -1),
+            numpy.cumsum(-length * numpy.cos(theta[..., :count]), axis = -1), vx, vy)
+
+  def coordinates(self, x, y, vx, vy, theta):
+    """returns generalized coordinates and velocities for positions and velocities of masses"""
+    angles, omega = ChainDynamics.coordinates(self, x, y, vx, vy, theta)
+    dx, dy = _differences(x)[..., self.springs], _differences(y)[..., self.springs]
+    dvx, dvy = _differences(vx)[..., self.springs], _differences(vy)[..., self.springs]
+    length = numpy.sqrt(dx * dx + dy * dy)
+    return (numpy.concatenate((angles, length), axis = -1),
+            numpy.concatenate((omega, (dx * dvx + dy * dvy) / length), axis = -1))
+
+  def cartesian_forces(self, x, y, vx, vy):
+    """returns forces acting on masses besides constraints of rods: weights and springs"""
+    fx, fy = ChainDynamics.cartesian_forces(self, x, y, vx, vy)
+    dx, dy = _differences(x)[..., self.springs], _differences(y)[..., self.springs]
+    dvx, dvy = _differences(vx)[..., self.springs], _differences(vy)[..., self.springs]
+    length = numpy.sqrt(dx * dx + dy * dy)
+    # a spring pulls its tip towards the joint and the mass above the other way
+    tension = -self.spring_forces(length, (dx * dvx + dy * dvy) / length) / length
+    for forces, along in ((fx, dx), (fy, dy)):
+      pull = _spread(tension * along, len(self), self.springs)
+      forces -= pull
+      forces[..., :-1] += pull[..., 1:]
+    return fx, fy
+
+  def momenta(self, theta, omega):
+    """returns generalized momenta M(theta) omega in O(N)"""
+    count = len(self)
+    length = spring_lengths(self.lengths, theta, self.springs)
+    sin, cos = numpy.sin(theta[..., :count]), numpy.cos(theta[..., :count])
+    vx, vy = self.link_velocities(theta, omega)
+    px, py = _below(self.masses * vx), _below(self.masses * vy)
+    return numpy.concatenate((length * (cos * px + sin * py), (sin * px - cos * py)[..., self.springs]), axis = -1)
+
+  def velocities(self, theta, momenta, armature = None):
+    """returns generalized velocities for given coordinates and momenta, optionally with armature"""
+    return elastic_accelerations(theta, numpy.zeros_like(momenta), self.lengths, self.masses, self.springs,
+                                 0.0, momenta, armature)
+
+  def forces(self, theta, omega):
+    """returns time derivatives of momenta: partial derivatives of the Lagrangian, spring damping included"""
+    count = len(self)
+    length = spring_lengths(self.lengths, theta, self.springs)
+    rate = _spread(omega[..., count:], count, self.springs)
+    sin, cos = numpy.sin(theta[..., :count]), numpy.cos(theta[..., :count])
+    vx, vy = self.link_velocities(theta, omega)
+    px, py = _below(self.masses * vx), _below(self.masses * vy)
+    below = _below(self.masses * numpy.ones_like(sin))
+    angular = omega[..., :count]
+    along = sin * px - cos * py
+    across = cos * px + sin * py
+    forces = numpy.concatenate((rate * across - length * angular * along - self.gravity * below * length * sin,
+                                (angular * across + self.gravity * below * cos)[..., self.springs]), axis = -1)
+    return forces + self.tension(theta, omega)
+
+  def tips(self, theta = None):
+    """returns an (N, 3) array with positions of all rod tips for given (or current) coordinates"""
+    if theta is None:
+      theta = self.theta
+    count = len(self)
+    length = spring_lengths(self.lengths, theta, self.springs)
+    tips = numpy.empty(theta.shape[:-1] + (count, 3))
+    tips[..., 0] = self.position[0] + numpy.cumsum(length * numpy.sin(theta[..., :count]), axis = -1)
+    tips[..., 1] = self.position[1] - numpy.cumsum(length * numpy.cos(theta[..., :count]), axis = -1)
+    tips[..., 2] = self.position[2]
+    return tips
+
+  def energy(self):
+    """returns total (kinetic, potential and elastic) energy of the chain"""
+    vx, vy = self.link_velocities(self.theta, self.omega)
+    height = self.tips()[..., 1] - self.position[1]
+    stretch = self.theta[..., len(self):] - self.rest_lengths
+    return (numpy.sum(self.masses * (0.5 * (vx * vx + vy * vy) + self.gravity * height), axis = -1) +
+            numpy.sum(0.5 * self.stiffness * stretch * stretch, axis = -1))
@@ -0,0 +1,58 @@
+import numpy
+from lib.dynamics import ChainDynamics, GRAVITY
+
+
+class ChainEnsemble(ChainDynamics):
+  """This class advances M chains with the same number of links N at once.
+     Their states are stacked into (M, N) arrays so one vectorized step of
+     any integrator moves the whole ensemble; lengths and masses may differ
+     between members."""
+
+  def __init__(self, lengths, angles, masses = None, velocities = None,
+               position = (0.0, 0.0, 0.0), gravity = GRAVITY, integrator = None, offsets = None, inertias = None):
+    """sets up an ensemble from (M, N) angles, lengths, masses, offsets and inertias are broadcast to that shape"""
+    angles = numpy.array(angles, dtype = float)
+    if angles.ndim != 2:
+      raise ValueError("ensemble angles have to be an (M, N) array")
+    lengths = numpy.broadcast_to(numpy.asarray(lengths, dtype = float), angles.shape)
+    if masses is not None:
+      masses = numpy.broadcast_to(numpy.asarray(masses, dtype = float), angles.shape)
+    if offsets is not None:
+      offsets = numpy.broadcast_to(numpy.asarray(offsets, dtype = float), angles.shape)
+    if inertias is not None:
+      inertias = numpy.broadcast_to(numpy.asarray(inertias, dtype = float), angles.shape)
+    ChainDynamics.__init__(self, lengths, angles, masses, velocities, position, gravity, integrator, offsets, inertias)
+
+  @classmethod
+  def from_chains(cls, chains, integrator = None):
+    """stacks states of ChainDynamics sharing link count, pivot and gravity"""
+    first = chains[0]
+    return cls(numpy.array([chain.lengths for chain in chains]),
+               numpy.array([chain.theta for chain in chains]),
+               numpy.array([chain.masses for chain in chains]),
+               numpy.array([chain.omega for chain in chains]),
+               first.position, first.gravity, integrator,
+               numpy.array([chain.offsets for chain in chains]),
+               numpy.array([chain.inertias for chain in chains]))
+
+  def __len__(self):
+    return self.theta.shape[0]
+
+  def links(self):
+    """returns number of links of every chain"""
+    return self.theta.shape[1]
+
+  def select(self, members):
+    """keeps only given members (a boolean mask or indices), dropping the rest from further steps"""
+    self.theta, self.omega = self.theta[members], self.omega[members]
+    self.lengths, self.masses = self.lengths[members], self.masses[members]
+    self.offsets, self.inertias = self.offsets[members], self.inertias[members]
+    self.pack()
+
+  def chain(self, index):
+    """returns a separate ChainDynamics with the current state of a member"""
+    chain = ChainDynamics(self.lengths[index], self.theta[index], self.masses[index],
+                          self.omega[index], self.position, self.gravity,
+                          offsets = self.offsets[index], inertias = self.inertias[index])
+    chain.time = self.time
+    return chain
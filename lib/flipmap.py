@@ -0,0 +1,35 @@
+import math
+import numpy
+from lib.ensemble import ChainEnsemble
+from lib.integrators import INTEGRATORS
+
+
+def flip_map(angles0, angles1, lengths = (1.0, 1.0), masses = (1.0, 1.0), duration = 10.0,
+             time_step = 0.01, integrator = "rk4"):
+  """returns times until any rod of a double pendulum flips over the top
+
+     Every cell [i, j] starts at rest with angles angles0[i] and angles1[j]
+     (absolute, in degrees, as given to RodsChain.push); cells that do not
+     flip within duration get NaN. All cells are advanced as one ensemble
+     and cells that flipped are dropped from it, so the work is spent only
+     on those still evolving."""
+  first, second = numpy.meshgrid(numpy.radians(angles0), numpy.radians(angles1), indexing = "ij")
+  times = numpy.full(first.shape, numpy.nan)
+  cells = numpy.arange(first.size)
+  ensemble = ChainEnsemble(lengths, numpy.column_stack((first.ravel(), second.ravel())), masses,
+                           integrator = INTEGRATORS[integrator]())
+  # cells starting above the pivot count as flipped at once
+  flipped = numpy.any(abs(ensemble.theta) > math.pi, axis = 1)
+  times.flat[cells[flipped]] = 0.0
+  ensemble.select(~flipped)
+  cells = cells[~flipped]
+  for _ in range(int(round(duration / time_step))):
+    if len(cells) == 0:
+      break
+    ensemble.step(time_step)
+    flipped = numpy.any(abs(ensemble.theta) > math.pi, axis = 1)
+    if flipped.any():
+      times.flat[cells[flipped]] = ensemble.time
+      ensemble.select(~flipped)
+      cells = cells[~flipped]
+  return times
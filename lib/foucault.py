@@ -0,0 +1,167 @@
+import math
+import numpy
+from lib.dynamics import GRAVITY
+
+
+EARTH_RATE = 7.2921159e-5
+# weights of the symmetric triple jump turning a second order step into a fourth order one
+OUTER = 1.0 / (2.0 - 2.0 ** (1.0 / 3.0))
+INNER = 1.0 - 2.0 * OUTER
+
+
+def swing_period(length, amplitude, gravity = GRAVITY):
+  """returns period of a planar pendulum swinging up to given amplitude (radians);
+     the complete elliptic integral comes from the arithmetic-geometric mean"""
+  a, b = 1.0, math.cos(0.5 * amplitude)
+  while abs(a - b) > 1e-15 * a:
+    a, b = 0.5 * (a + b), math.sqrt(a * b)
+  return 2.0 * math.pi * math.sqrt(length / gravity) / a
+
+
+class FoucaultPendulum(object):
+  """This class swings a single mass on a rod in the frame of the rotating
+     Earth (x east, y up, z south), its plane turning once every
+     24 h / sin(latitude)."""
+
+  def __init__(self, length, latitude, amplitude, azimuth = 0.0, mass = 1.0, position = (0.0, 0.0, 0.0),
+               gravity = GRAVITY, rate = EARTH_RATE, steps = 100):
+    """sets up a pendulum released at rest, angles are in radians and azimuth of
+       the swing plane is counted from east towards north; steps per swing period"""
+    if length <= 0.0 or mass <= 0.0:
+      raise ValueError("a pendulum needs a positive length and mass")
+    self.length = float(length)
+    self.latitude = latitude
+    self.mass = mass
+    self.position = tuple(position)
+    self.gravity = gravity
+    self.steps = steps
+    # angular velocity of the Earth has a vertical and a northern part
+    self.spin = (0.0, rate * math.sin(latitude), -rate * math.cos(latitude))
+    self.r = self.length * numpy.array([math.sin(amplitude) * math.cos(azimuth), -math.cos(amplitude),
+                                        -math.sin(amplitude) * math.sin(azimuth)])
+    self.v = numpy.zeros(3)
+    self.time = 0.0
+
+  def precession_period(self):
+    """returns time of a full turn of the swing plane, infinite at the equator"""
+    vertical = abs(self.spin[1])
+    return 2.0 * math.pi / vertical if vertical > 0.0 else float("inf")
+
+  def amplitude(self):
+    """returns the largest angle from the vertical reached with the current energy"""
+    energy = 0.5 * numpy.dot(self.v, self.v) + self.gravity * self.r[1]
+    return math.acos(min(1.0, max(-1.0, -energy / (self.gravity * self.length))))
+
+  def period(self):
+    """returns the swing period for the current energy"""
+    return swing_period(self.length, self.amplitude(), self.gravity)
+
+  def project(self, r, v):
+    """returns position put back on the sphere and velocity made tangent to it, as tuples"""
+    rx, ry, rz = r
+    vx, vy, vz = v
+    scale = self.length / math.sqrt(rx * rx + ry * ry + rz * rz)
+    rx, ry, rz = rx * scale, ry * scale, rz * scale
+    along = (vx * rx + vy * ry + vz * rz) / (self.length * self.length)
+    return (rx, ry, rz), (vx - along * rx, vy - along * ry, vz - along * rz)
+
+  def rotating(self, r, v, h):
+    """returns state after the exact flow of rotating-frame forces at fixed position"""
+    wx, wy, wz = self.spin
+    rx, ry, rz = r
+    vx, vy, vz = v
+    ax, ay, az = rx / self.length, ry / self.length, rz / self.length
+    # centrifugal force along the sphere kicks half before and half after the Coriolis rotation
+    square, projection = wx * wx + wy * wy + wz * wz, wx * rx + wy * ry + wz * rz
+    cx, cy, cz = square * rx - projection * wx, square * ry - projection * wy, square * rz - projection * wz
+    normal = cx * ax + cy * ay + cz * az
+    kx, ky, kz = 0.5 * h * (cx - normal * ax), 0.5 * h * (cy - normal * ay), 0.5 * h * (cz - normal * az)
+    vx, vy, vz = vx + kx, vy + ky, vz + kz
+    # only the Coriolis force across the rod acts, turning the velocity about it
+    angle = -2.0 * h * (wx * ax + wy * ay + wz * az)
+    cos, sin = math.cos(angle), math.sin(angle)
+    along = (ax * vx + ay * vy + az * vz) * (1.0 - cos)
+    return r, (vx * cos + (ay * vz - az * vy) * sin + ax * along + kx,
+               vy * cos + (az * vx - ax * vz) * sin + ay * along + ky,
+               vz * cos + (ax * vy - ay * vx) * sin + az * along + kz)
+
+  def swing(self, r, v, h):
+    """returns state after a RATTLE step under gravity, the rod tension solved exactly"""
+    square = self.length * self.length
+    rx, ry, rz = r
+    vx, vy, vz = v
+    fx, fy, fz = rx + h * vx, ry + h * vy - 0.5 * h * h * self.gravity, rz + h * vz
+    along, excess = fx * rx + fy * ry + fz * rz, fx * fx + fy * fy + fz * fz - square
+    tension = (math.sqrt(along * along - square * excess) - along) / square
+    nx, ny, nz = fx + tension * rx, fy + tension * ry, fz + tension * rz
+    vx, vy, vz = (nx - rx) / h, (ny - ry) / h - 0.5 * h * self.gravity, (nz - rz) / h
+    normal = (vx * nx + vy * ny + vz * nz) / square
+    return (nx, ny, nz), (vx - normal * nx, vy - normal * ny, vz - normal * nz)
+
+  def split(self, r, v, h):
+    """returns state after a fourth order step of length h"""
+    for weight in (OUTER, INNER, OUTER):
+      r, v = self.rotating(r, v, 0.5 * weight * h)
+      r, v = self.swing(r, v, weight * h)
+      r, v = self.rotating(r, v, 0.5 * weight * h)
+    return r, v
+
+  def step(self, dt):
+    """advances the pendulum by dt, which should be a small part of the swing period"""
+    r, v = self.split(tuple(self.r), tuple(self.v), dt)
+    self.r, self.v = numpy.array(r), numpy.array(v)
+    self.time += dt
+
+  def drift(self, state, period):
+    """returns rate of change of position and velocity seen once per period"""
+    ends = []
+    for h in (period / self.steps, -period / self.steps):
+      r, v = self.project(state[:3], state[3:])
+      for _ in range(self.steps):
+        r, v = self.split(r, v, h)
+      ends.append(numpy.array(r + v))
+    return (ends[0] - ends[1]) / (2.0 * period)
+
+  def advance(self, duration, periods = None):
+    """advances the pendulum by duration, whole swing periods with averaging in steps of
+       given number of periods (chosen from the Earth rate by default), the rest step by step"""
+    period = self.period()
+    count = int(duration // period)
+    rate = math.sqrt(sum(w * w for w in self.spin))
+    if periods is None:
+      periods = count if rate == 0.0 else max(1, int(0.1 / (rate * period)))
+    state = numpy.concatenate((self.r, self.v))
+    done = 0
+    while done < count:
+      h = min(periods, count - done) * period
+      k1 = self.drift(state, period)
+      k2 = self.drift(state + 0.5 * h * k1, period)
+      k3 = self.drift(state + 0.5 * h * k2, period)
+      k4 = self.drift(state + h * k3, period)
+      state = state + h / 6.0 * (k1 + 2.0 * k2 + 2.0 * k3 + k4)
+      done += min(periods, count - done)
+    r, v = self.project(state[:3], state[3:])
+    self.r, self.v = numpy.array(r), numpy.array(v)
+    self.time += count * period
+    rest = duration - count * period
+    substeps = int(math.ceil(rest * self.steps / period))
+    for _ in range(substeps):
+      self.step(rest / substeps)
+
+  def azimuth(self):
+    """returns direction of the swing plane counted from east towards north, in (-pi/2, pi/2]"""
+    east, north = self.r[0], -self.r[2]
+    square = self.length / self.gravity
+    xx = east * east + square * self.v[0] * self.v[0]
+    yy = north * north + square * self.v[2] * self.v[2]
+    xy = east * north - square * self.v[0] * self.v[2]
+    return 0.5 * math.atan2(2.0 * xy, xx - yy)
+
+  def energy(self):
+    """returns energy in the rotating frame (the Jacobi integral), kept by rotating-frame forces"""
+    spin = numpy.cross(self.spin, self.r)
+    return self.mass * (0.5 * numpy.dot(self.v, self.v) + self.gravity * self.r[1] - 0.5 * numpy.dot(spin, spin))
+
+  def tips(self):
+    """returns a (1, 3) array with position of the mass, as RodsChain.place takes it"""
+    return (numpy.array(self.position) + self.r)[None, :]
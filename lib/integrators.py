@@ -0,0 +1,336 @@
+import numpy
+from lib.links import _differences, _pull
+
+
+class RungeKutta4(object):
+  """This class advances a system with the classic fourth order Runge-Kutta
+     scheme and a fixed step. A system has theta, omega and time attributes
+     and an accelerations(theta, omega) method."""
+
+  def step(self, system, dt):
+    """advances system by dt"""
+    theta, omega = system.theta, system.omega
+    k1t, k1w = omega, system.accelerations(theta, omega)
+    k2t = omega + 0.5 * dt * k1w
+    k2w = system.accelerations(theta + 0.5 * dt * k1t, k2t)
+    k3t = omega + 0.5 * dt * k2w
+    k3w = system.accelerations(theta + 0.5 * dt * k2t, k3t)
+    k4t = omega + dt * k3w
+    k4w = system.accelerations(theta + dt * k3t, k4t)
+    system.theta = theta + dt / 6.0 * (k1t + 2.0 * k2t + 2.0 * k3t + k4t)
+    system.omega = omega + dt / 6.0 * (k1w + 2.0 * k2w + 2.0 * k3w + k4w)
+    system.time += dt
+
+
+class DormandPrince(object):
+  """This class advances a system with the embedded Dormand-Prince 5(4)
+     Runge-Kutta pair. Every step of length dt is covered by as many
+     internal steps as the local error estimate requires; the last
+     accepted internal step size is remembered for the next call."""
+
+  nodes = (0.0, 1.0 / 5.0, 3.0 / 10.0, 4.0 / 5.0, 8.0 / 9.0, 1.0, 1.0)
+  matrix = ((),
+            (1.0 / 5.0,),
+            (3.0 / 40.0, 9.0 / 40.0),
+            (44.0 / 45.0, -56.0 / 15.0, 32.0 / 9.0),
+            (19372.0 / 6561.0, -25360.0 / 2187.0, 64448.0 / 6561.0, -212.0 / 729.0),
+            (9017.0 / 3168.0, -355.0 / 33.0, 46732.0 / 5247.0, 49.0 / 176.0, -5103.0 / 18656.0),
+            (35.0 / 384.0, 0.0, 500.0 / 1113.0, 125.0 / 192.0, -2187.0 / 6784.0, 11.0 / 84.0))
+  # difference between fifth and fourth order weights
+  error = (71.0 / 57600.0, 0.0, -71.0 / 16695.0, 71.0 / 1920.0, -17253.0 / 339200.0, 22.0 / 525.0, -1.0 / 40.0)
+
+  def __init__(self, rtol = 1e-6, atol = 1e-9, initial_step = 1e-3, min_step = 1e-12):
+    """sets tolerances of local error"""
+    self.rtol = rtol
+    self.atol = atol
+    self.h = initial_step
+    self.min_step = min_step
+    self.accepted = 0
+    self.rejected = 0
+    # system, state and stage that the last accepted step ended with
+    self._last = None
+
+  def attempt(self, system, theta, omega, h, first = None):
+    """returns proposed state after step h, its scaled error norm and the last stage, which
+       is the first stage of the next step (given as first to save an evaluation)"""
+    if first is None:
+      first = (omega, system.accelerations(theta, omega))
+    stages = [first]
+    for row in self.matrix[1:]:
+      t, w = theta, omega
+      for a, (kt, kw) in zip(row, stages):
+        if a:
+          t, w = t + h * a * kt, w + h * a * kw
+      stages.append((w, system.accelerations(t, w)))
+    new_theta, new_omega = t, w
+    error_theta = h * sum(e * kt for e, (kt, kw) in zip(self.error, stages) if e)
+    error_omega = h * sum(e * kw for e, (kt, kw) in zip(self.error, stages) if e)
+    scale_theta = self.atol + self.rtol * numpy.maximum(abs(theta), abs(new_theta))
+    scale_omega = self.atol + self.rtol * numpy.maximum(abs(omega), abs(new_omega))
+    norm = numpy.sqrt(0.5 * (numpy.mean((error_theta / scale_theta) ** 2) + numpy.mean((error_omega / scale_omega) ** 2)))
+    return new_theta, new_omega, norm, stages[-1]
+
+  def step(self, system, dt):
+    """advances system by dt with error controlled internal steps"""
+    theta, omega = system.theta, system.omega
+    # the stage a step ended with starts the next one, unless the system has been changed since
+    last = self._last
+    if last is not None and last[0] is system and last[1] is theta and last[2] is omega:
+      first = last[3]
+    else:
+      first = (omega, system.accelerations(theta, omega))
+    remaining = dt
+    while remaining > 0.0:
+      h = min(self.h, remaining)
+      new_theta, new_omega, norm, last = self.attempt(system, theta, omega, h, first)
+      factor = 5.0 if norm == 0.0 else min(5.0, max(0.2, 0.9 * norm ** -0.2))
+      if norm <= 1.0:
+        theta, omega, first = new_theta, new_omega, last
+        remaining = 0.0 if h == remaining else remaining - h
+        self.accepted += 1
+        # a step shortened to land on dt says nothing about the next one
+        if h == self.h or factor < 1.0:
+          self.h = h * factor
+      else:
+        self.rejected += 1
+        self.h = h * factor
+        if self.h < self.min_step:
+          raise ArithmeticError("step size underflow, the system is too stiff for given tolerance")
+    system.theta, system.omega = theta, omega
+    system.time += dt
+    self._last = (system, theta, omega, first)
+
+
+class ImplicitMidpoint(object):
+  """This class advances a system with the symplectic implicit midpoint
+     rule, whose energy error stays bounded. The system also provides
+     momenta, velocities, forces and stiff_terms for O(N) Newton solves."""
+
+  def __init__(self, tolerance = 1e-12, max_iterations = 100):
+    """sets accuracy of Newton iterations solving every step"""
+    self.tolerance = tolerance
+    self.max_iterations = max_iterations
+    self.iterations = 0
+
+  def step(self, system, dt):
+    """advances system by dt"""
+    theta, omega = system.theta, system.omega
+    momenta = system.momenta(theta, omega)
+    half = 0.5 * dt
+    # midpoint state, starting from an explicit half step
+    middle_theta = theta + half * omega
+    middle_momenta = momenta + half * system.forces(theta, omega)
+    for iteration in range(self.max_iterations):
+      middle_omega = system.velocities(middle_theta, middle_momenta)
+      residual_theta = middle_theta - theta - half * middle_omega
+      residual_momenta = middle_momenta - momenta - half * system.forces(middle_theta, middle_omega)
+      stiffness, damping = system.stiff_terms(middle_theta, middle_omega)
+      solution = system.velocities(middle_theta, half * stiffness * residual_theta - residual_momenta,
+                                   half * damping + half * half * stiffness)
+      step_theta = half * solution - residual_theta
+      step_momenta = system.momenta(middle_theta, solution)
+      middle_theta, middle_momenta = middle_theta + step_theta, middle_momenta + step_momenta
+      change = max(numpy.max(abs(step_theta)), numpy.max(abs(step_momenta)))
+      if change <= self.tolerance * (1.0 + numpy.max(abs(middle_momenta))):
+        break
+    else:
+      raise ArithmeticError("implicit midpoint iteration did not converge, decrease the time step")
+    self.iterations += iteration + 1
+    system.theta = 2.0 * middle_theta - theta
+    system.omega = system.velocities(system.theta, 2.0 * middle_momenta - momenta)
+    system.time += dt
+
+
+class ImplicitEuler(object):
+  """This class advances a system with the backward Euler rule, stable
+     however stiff its springs are. The system also provides stiff_terms
+     for O(N) iterations."""
+
+  def __init__(self, tolerance = 1e-10, max_iterations = 50):
+    """sets accuracy of iterations solving every step"""
+    self.tolerance = tolerance
+    self.max_iterations = max_iterations
+    self.iterations = 0
+
+  def step(self, system, dt):
+    """advances system by dt"""
+    theta, omega = system.theta, system.omega
+    stiffness, damping = system.stiff_terms(theta, omega)
+    armature = dt * damping + dt * dt * stiffness
+    acceleration = numpy.zeros_like(omega)
+    for iteration in range(self.max_iterations):
+      new_omega = omega + dt * acceleration
+      update = system.accelerations(theta + dt * new_omega, new_omega, armature, armature * acceleration)
+      change = numpy.max(abs(update - acceleration))
+      acceleration = update
+      if dt * change <= self.tolerance * (1.0 + numpy.max(abs(omega))):
+        break
+    else:
+      raise ArithmeticError("implicit Euler iteration did not converge, decrease the time step")
+    self.iterations += iteration + 1
+    system.omega = omega + dt * acceleration
+    system.theta = theta + dt * system.omega
+    system.time += dt
+
+
+def _tridiagonal(lower, diagonal, upper, values):
+  """returns product of a tridiagonal matrix given by its diagonals and a vector"""
+  product = diagonal * values
+  product[..., 1:] += lower[..., 1:] * values[..., :-1]
+  product[..., :-1] += upper[..., :-1] * values[..., 1:]
+  return product
+
+
+def _solve_tridiagonal(lower, diagonal, upper, values):
+  """solves a tridiagonal system given by its diagonals in O(N) with the Thomas algorithm"""
+  lower, diagonal, upper, values = [list(numpy.moveaxis(array, -1, 0)) for array in (lower, diagonal, upper, values)]
+  count = len(diagonal)
+  ratios, solution = [None] * count, [None] * count
+  ratios[0], solution[0] = upper[0] / diagonal[0], values[0] / diagonal[0]
+  for k in range(1, count):
+    pivot = diagonal[k] - lower[k] * ratios[k - 1]
+    ratios[k] = upper[k] / pivot
+    solution[k] = (values[k] - lower[k] * solution[k - 1]) / pivot
+  for k in range(count - 2, -1, -1):
+    solution[k] = solution[k] - ratios[k] * solution[k + 1]
+  return numpy.moveaxis(numpy.array(solution, dtype = float), 0, -1)
+
+
+class Multirate(object):
+  """This class advances a chain of rods and springs with spring lengths
+     sub-stepped between half kicks of slower forces. The system provides
+     spring_forces, tension and velocities."""
+
+  def __init__(self, substeps = 10):
+    """sets number of spring sub-steps within every step"""
+    self.substeps = substeps
+
+  def coupling(self, system, theta):
+    """returns diagonals (lower, diagonal, upper) of M^-1 restricted to spring lengths"""
+    count = system.lengths.shape[-1]
+    springs = theta.shape[-1] - count
+    lower, diagonal, upper = [numpy.zeros(theta.shape[:-1] + (springs,)) for _ in range(3)]
+    # every third spring is pulled at once, responses of neighbours do not overlap
+    for color in range(3):
+      unit = numpy.zeros_like(theta)
+      unit[..., count + color::3] = 1.0
+      response = system.velocities(theta, unit)[..., count:]
+      diagonal[..., color::3] = response[..., color::3]
+      upper[..., (color - 1) % 3::3] = response[..., (color - 1) % 3::3]
+      lower[..., (color + 1) % 3::3] = response[..., (color + 1) % 3::3]
+    return lower, diagonal, upper
+
+  def slow(self, system, theta, omega, springs):
+    """returns accelerations due to all forces but those of springs"""
+    if springs:
+      return system.accelerations(theta, omega, forces = -system.tension(theta, omega))
+    return system.accelerations(theta, omega)
+
+  def step(self, system, dt):
+    """advances system by dt, springs in sub-steps of dt / substeps"""
+    theta, omega = system.theta, system.omega
+    count = system.lengths.shape[-1]
+    springs = theta.shape[-1] - count
+    omega = omega + 0.5 * dt * self.slow(system, theta, omega, springs)
+    new_theta, new_omega = theta + dt * omega, omega
+    if springs:
+      # the mass matrix is frozen in the middle of the step to keep it symmetric
+      middle = theta + 0.5 * dt * omega
+      lower, diagonal, upper = self.coupling(system, middle)
+      h = dt / self.substeps
+      lengths, rates = theta[..., count:], omega[..., count:]
+      impulse, moment = numpy.zeros_like(theta), numpy.zeros_like(theta)
+      for i in range(self.substeps):
+        # velocity Verlet sub-step, kicks move positions during the remaining drifts
+        force = system.spring_forces(lengths, rates)
+        rates = rates + 0.5 * h * _tridiagonal(lower, diagonal, upper, force)
+        lengths = lengths + h * rates
+        closing = system.spring_forces(lengths, rates)
+        rates = rates + 0.5 * h * _tridiagonal(lower, diagonal, upper, closing)
+        impulse[..., count:] += 0.5 * h * (force + closing)
+        moment[..., count:] += 0.5 * h * h * ((self.substeps - i) * force + (self.substeps - i - 1) * closing)
+      new_omega = omega + system.velocities(middle, impulse)
+      new_theta = new_theta + system.velocities(middle, moment)
+      new_theta[..., count:], new_omega[..., count:] = lengths, rates
+    # slow forces depend on velocities, the closing kick is predicted and corrected
+    predicted = new_omega + 0.5 * dt * self.slow(system, new_theta, new_omega, springs)
+    system.theta = new_theta
+    system.omega = new_omega + 0.5 * dt * self.slow(system, new_theta, predicted, springs)
+    system.time += dt
+
+
+class Rattle(object):
+  """This class advances a chain in cartesian coordinates with the RATTLE
+     scheme, keeping rod lengths exact. It does not converge on 1000 links
+     of 1 mm even at dt = 1e-3; ImplicitEuler steps such chains instead.
+     The system provides cartesian, coordinates, cartesian_forces and rigid."""
+
+  def __init__(self, tolerance = 1e-12, max_iterations = 50):
+    """sets accuracy of rod lengths relative to the lengths"""
+    self.tolerance = tolerance
+    self.max_iterations = max_iterations
+    self.iterations = 0
+
+  def tensions(self, x, y, system):
+    """returns x and y of link vectors of rods, zero for springs"""
+    rigid = system.rigid()
+    return numpy.where(rigid, _differences(x), 0.0), numpy.where(rigid, _differences(y), 0.0)
+
+  def matrix(self, ax, ay, bx, by, inverse, scale):
+    """returns diagonals of the tridiagonal matrix of link changes a over tensions along links b"""
+    above = numpy.concatenate((numpy.zeros_like(inverse[..., :1]), inverse[..., :-1]), axis = -1)
+    diagonal = scale * (ax * bx + ay * by) * (inverse + above)
+    lower, upper = numpy.zeros_like(diagonal), numpy.zeros_like(diagonal)
+    lower[..., 1:] = -scale * (ax[..., 1:] * bx[..., :-1] + ay[..., 1:] * by[..., :-1]) * inverse[..., :-1]
+    upper[..., :-1] = -scale * (ax[..., :-1] * bx[..., 1:] + ay[..., :-1] * by[..., 1:]) * inverse[..., :-1]
+    return lower, diagonal, upper
+
+  def step(self, system, dt):
+    """advances system by dt"""
+    half = 0.5 * dt
+    rigid = system.rigid()
+    # springs get an identity row, their tensions stay zero
+    free = numpy.where(rigid, 0.0, 1.0)
+    inverse = 1.0 / system.masses * numpy.ones_like(free)
+    lengths = numpy.where(rigid, system.lengths, 1.0)
+    x, y, vx, vy = system.cartesian(system.theta, system.omega)
+    fx, fy = system.cartesian_forces(x, y, vx, vy)
+    bx, by = self.tensions(x, y, system)
+    # positions after an unconstrained step, then tensions along rods pull them back
+    px, py = x + dt * (vx + half * inverse * fx), y + dt * (vy + half * inverse * fy)
+    new_x, new_y = px, py
+    multipliers = numpy.zeros_like(free)
+    for iteration in range(self.max_iterations):
+      ax, ay = _differences(new_x), _differences(new_y)
+      residual = numpy.where(rigid, 0.5 * (ax * ax + ay * ay - lengths * lengths), 0.0)
+      if numpy.max(abs(residual) / (lengths * lengths)) <= self.tolerance:
+        break
+      lower, diagonal, upper = self.matrix(ax, ay, bx, by, inverse, dt * half)
+      multipliers = multipliers - _solve_tridiagonal(lower * rigid, diagonal * rigid + free, upper * rigid, residual)
+      pull_x, pull_y = _pull(multipliers * bx), _pull(multipliers * by)
+      new_x, new_y = px + dt * half * inverse * pull_x, py + dt * half * inverse * pull_y
+    else:
+      raise ArithmeticError("rattle iteration did not converge, decrease the time step")
+    self.iterations += iteration + 1
+    # velocities at the end of the step are kept along rods
+    vx, vy = (new_x - x) / dt, (new_y - y) / dt
+    fx, fy = system.cartesian_forces(new_x, new_y, vx, vy)
+    vx, vy = vx + half * inverse * fx, vy + half * inverse * fy
+    ax, ay = self.tensions(new_x, new_y, system)
+    lower, diagonal, upper = self.matrix(ax, ay, ax, ay, inverse, half)
+    speed = numpy.where(rigid, ax * _differences(vx) + ay * _differences(vy), 0.0)
+    multipliers = _solve_tridiagonal(lower * rigid, diagonal * rigid + free, upper * rigid, -speed)
+    vx = vx + half * inverse * _pull(multipliers * ax)
+    vy = vy + half * inverse * _pull(multipliers * ay)
+    system.theta, system.omega = system.coordinates(new_x, new_y, vx, vy, system.theta)
+    system.time += dt
+
+
+INTEGRATORS = {
+  'rk4': RungeKutta4,
+  'dopri5': DormandPrince,
+  'midpoint': ImplicitMidpoint,
+  'implicit': ImplicitEuler,
+  'multirate': Multirate,
+  'rattle': Rattle,
+}
@@ -0,0 +1,15 @@
+import numpy
+
+
+def _differences(values):
+  """returns differences of values between every link and the one above it, the first against zero"""
+  differences = numpy.array(values, dtype = float)
+  differences[..., 1:] -= values[..., :-1]
+  return differences
+
+
+def _pull(forces):
+  """returns forces on masses of tensions along links, a link pulls its tip and pushes the mass above"""
+  pull = numpy.array(forces, dtype = float)
+  pull[..., :-1] -= forces[..., 1:]
+  return pull
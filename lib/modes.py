@@ -0,0 +1,80 @@
+import numpy
+from lib.dynamics import GRAVITY, _below
+
+
+class NormalModes(object):
+  """This class solves a chain of rods linearized about hanging straight
+     down. Its mass matrix M_ij = l_i l_j (masses below both links) and
+     diagonal stiffness K_ii = g l_i (masses below link i), both for point
+     masses at rod tips unless offsets and inertias are given, are decomposed
+     once into normal modes, K^-1/2 M K^-1/2 being symmetric; afterwards
+     the state at any time is a sum of harmonic oscillations: amplitudes
+     of all modes take O(N) and angles follow from a single matrix-vector
+     product, with no stepping at all. It is accurate for small angles
+     only, as the harmonic approximation of the report."""
+
+  def __init__(self, lengths, masses = None, gravity = GRAVITY, offsets = None, inertias = None):
+    """decomposes the chain, angles start at rest hanging down; offsets of centres of mass
+       from hinges and moments of inertia about them are as taken by ChainDynamics"""
+    self.lengths = numpy.array(lengths, dtype = float)
+    if masses is None:
+      masses = numpy.ones_like(self.lengths)
+    self.masses = numpy.array(masses, dtype = float)
+    if self.lengths.ndim != 1 or self.lengths.shape != self.masses.shape:
+      raise ValueError("normal modes need lengths and masses of a single chain")
+    if gravity <= 0.0:
+      raise ValueError("a chain without gravity has no normal modes")
+    self.gravity = gravity
+    offsets = self.lengths if offsets is None else numpy.asarray(offsets, dtype = float)
+    inertias = numpy.zeros_like(self.lengths) if inertias is None else numpy.asarray(inertias, dtype = float)
+    moments = self.masses * offsets
+    # masses of links strictly below every link hang at its tip
+    below = _below(self.masses) - self.masses
+    links = numpy.arange(len(self.lengths))
+    upper, lower = numpy.minimum.outer(links, links), numpy.maximum.outer(links, links)
+    mass = self.lengths[upper] * (self.lengths[lower] * below[lower] + moments[lower])
+    mass[links, links] = self.lengths * self.lengths * below + moments * offsets + inertias
+    self.stiffness = gravity * (self.lengths * below + moments)
+    scale = 1.0 / numpy.sqrt(self.stiffness)
+    # eigenvalues of K^-1/2 M K^-1/2 are squared periods over 4 pi^2
+    inverse, vectors = numpy.linalg.eigh(scale[:, None] * mass * scale[None, :])
+    self.frequencies = 1.0 / numpy.sqrt(inverse[::-1])
+    # shapes are K-orthonormal columns, the slowest mode first
+    self.shapes = scale[:, None] * vectors[:, ::-1]
+    self.start(numpy.zeros_like(self.lengths))
+
+  @classmethod
+  def from_dynamics(cls, dynamics):
+    """returns modes of a chain of rigid rods starting from its current state and time"""
+    if dynamics.theta.shape != dynamics.lengths.shape or dynamics.lengths.ndim != 1:
+      raise ValueError("normal modes need a single chain of rigid rods")
+    modes = cls(dynamics.lengths, dynamics.masses, dynamics.gravity, dynamics.offsets, dynamics.inertias)
+    modes.start(dynamics.theta, dynamics.omega, dynamics.time)
+    return modes
+
+  def __len__(self):
+    return len(self.lengths)
+
+  def start(self, theta, omega = None, time = 0.0):
+    """sets angles and angular velocities at given time"""
+    if omega is None:
+      omega = numpy.zeros_like(theta)
+    self.time = time
+    self.cosines = numpy.dot(self.shapes.T, self.stiffness * numpy.asarray(theta, dtype = float))
+    self.sines = numpy.dot(self.shapes.T, self.stiffness * numpy.asarray(omega, dtype = float)) / self.frequencies
+
+  def amplitudes(self, time):
+    """returns coordinates of all modes and their rates at given time (or an array of times along the first axis)"""
+    phase = numpy.multiply.outer(numpy.asarray(time, dtype = float) - self.time, self.frequencies)
+    cos, sin = numpy.cos(phase), numpy.sin(phase)
+    return (self.cosines * cos + self.sines * sin,
+            self.frequencies * (self.sines * cos - self.cosines * sin))
+
+  def state(self, time):
+    """returns angles and angular velocities at given time (or an array of times along the first axis)"""
+    coordinates, rates = self.amplitudes(time)
+    return numpy.dot(coordinates, self.shapes.T), numpy.dot(rates, self.shapes.T)
+
+  def energy(self):
+    """returns energy of the linearized chain, constant in time"""
+    return 0.5 * numpy.sum(self.cosines * self.cosines + self.sines * self.sines)
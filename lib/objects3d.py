@@ -1,63 +1,269 @@
 import pygame
 import math
+import numpy
+import collections
+import functools
+import threading
 from OpenGL.GL import *
 from OpenGL.GLU import *
+from OpenGL.arrays import vbo
+from OpenGL.GL import shaders
+from OpenGL import error
 from pygame.locals import *
 from lib.vector3 import *
 from lib.matrix44 import *
+from lib.quaternion import Quaternion, quaternion_normalize
+from lib.dynamics import ChainDynamics
+from lib.elastic import ElasticChainDynamics
+from lib.modes import NormalModes
+from lib.spherical import SphericalChain, SphericalTree
+from lib.util import lerp
 
 
 class Camera(object):
+  """This class is an orbit camera. Its orientation is kept as a unit
+     quaternion, the placement matrix is generated only when needed."""
 
-  def __init__(self, clock, distance):
+  def __init__(self, distance):
     """sets up the OpenGL camera looking at point (0.0, 0.0, 0.0) and being at some distance from this point"""
-    self.clock = clock
     self.distance = distance
-    self.camera_matrix = Matrix44()
-    self.camera_matrix.translate = (0.0, 0.0, distance)
+    self.orientation = Quaternion()
     self.rotation_speed = radians(90.0)
     self.move_speed = 3.0
+    self.matrix = None
+    self.dirty = True
 
-  def rotate(self, direction):
+  @property
+  def camera_matrix(self):
+    """returns camera placement: rotated axes and position on the orbit"""
+    if self.matrix is None:
+      forward = Vector3(self.orientation.rotate((0.0, 0.0, 1.0)))
+      self.matrix = self.orientation.to_matrix44(forward.unit() * self.distance)
+    return self.matrix
+
+  def rotate(self, direction, time_passed_seconds):
     """rotates camera arount the point due to rotation direction"""
     rotation_direction = Vector3(direction)
-    time_passed_seconds = self.clock.tick() / 1000.0
-    rotation = rotation_direction * self.rotation_speed * time_passed_seconds
-    rotation_matrix = Matrix44.xyz_rotation(*rotation)
-    self.camera_matrix *= rotation_matrix
-    new_position = Vector3(self.camera_matrix.forward).unit() * self.distance
-    self.camera_matrix.translate = new_position
-    glLoadMatrixd(self.camera_matrix.get_inverse().to_opengl())
-
-  def move(self, direction):
+    angle = rotation_direction.length * self.rotation_speed * time_passed_seconds
+    self.orientation = (self.orientation * Quaternion.from_axis_angle(direction, angle)).normalize()
+    self.matrix = None
+    self.dirty = True
+
+  def move(self, direction, time_passed_seconds):
     """changes a camera distance from the base point"""
-    time_passed_seconds = self.clock.tick() / 1000.0
     self.distance += direction * time_passed_seconds * self.move_speed
     if self.distance < 2.0:
       self.distance = 2.0
     elif self.distance > 8.0:
       self.distance = 8.0
-    new_position = Vector3(self.camera_matrix.forward).unit() * self.distance
-    self.camera_matrix.translate = new_position
-    glLoadMatrixd(self.camera_matrix.get_inverse().to_opengl())
+    self.matrix = None
+    self.dirty = True
+
+  def view_matrix(self):
+    """returns the view matrix, an inverse of camera placement"""
+    return self.camera_matrix.get_inverse_rot_trans()
+
+  def apply(self):
+    """loads the view matrix into OpenGL if the camera moved since the last upload"""
+    if not self.dirty:
+      return False
+    glLoadMatrixd(self.view_matrix().to_opengl())
+    self.dirty = False
+    return True
+
+
+class RodsBuffer(object):
+  """This class keeps geometry of many rods in contiguous arrays: endpoints,
+     colors, masses, mass distribution of physical rods and spring
+     parameters of entries being springs. Lengths, angles, tilts out of
+     the XY plane, unit directions and angles in degrees are derived from
+     endpoints lazily: moving a rod only marks it stale and the derived
+     arrays are refreshed at once on the next read. Rods are only views
+     into it."""
+
+  def __init__(self, capacity = 16):
+    """allocates space for capacity rods, it grows when needed"""
+    self.count = 0
+    self.starts = numpy.zeros((capacity, 3))
+    self.tips = numpy.zeros((capacity, 3))
+    self.lengths = numpy.zeros(capacity)
+    self.angles = numpy.zeros(capacity)
+    self.tilts = numpy.zeros(capacity)
+    self.directions = numpy.zeros((capacity, 3))
+    self.degrees = numpy.zeros(capacity)
+    self.stale = numpy.zeros(capacity, dtype = bool)
+    self.any_stale = False
+    self.version = 0
+    self.colors = numpy.zeros((capacity, 3))
+    self.masses = numpy.zeros(capacity)
+    self.springs = numpy.zeros(capacity, dtype = bool)
+    self.stiffness = numpy.zeros(capacity)
+    self.damping = numpy.zeros(capacity)
+    self.rest_lengths = numpy.zeros(capacity)
+    self.physical = numpy.zeros(capacity, dtype = bool)
+    self.offsets = numpy.zeros(capacity)
+    self.inertias = numpy.zeros(capacity)
+
+  def __len__(self):
+    return self.count
+
+  def grow(self, capacity):
+    """reallocates all arrays to hold capacity rods"""
+    for name in ("starts", "tips", "lengths", "angles", "tilts", "directions", "degrees", "stale", "colors", "masses",
+                 "springs", "stiffness", "damping", "rest_lengths", "physical", "offsets", "inertias"):
+      old = getattr(self, name)
+      new = numpy.zeros((capacity,) + old.shape[1:], dtype = old.dtype)
+      new[:self.count] = old[:self.count]
+      setattr(self, name, new)
+
+  def append(self, start, tip, color, mass):
+    """stores a new rod and returns its index"""
+    if self.count == len(self.lengths):
+      self.grow(max(2 * self.count, 1))
+    index = self.count
+    self.count += 1
+    self.starts[index], self.tips[index] = start, tip
+    self.colors[index], self.masses[index] = color, mass
+    self.springs[index] = self.physical[index] = False
+    self.offsets[index] = self.inertias[index] = 0.0
+    self.invalidate(index)
+    return index
+
+  def make_spring(self, index, stiffness, damping, rest_length):
+    """turns an entry into a spring"""
+    self.springs[index] = True
+    self.stiffness[index], self.damping[index], self.rest_lengths[index] = stiffness, damping, rest_length
+    self.version += 1
+
+  def rods(self):
+    """returns indices of entries drawn as boxes, all but springs"""
+    return numpy.flatnonzero(~self.springs[:self.count])
+
+  def make_physical(self, index, thickness):
+    """turns an entry into a uniform bar of given half thickness, its centre of mass and
+       moment of inertia are computed from the current geometry once"""
+    self.derive()
+    length, width = self.lengths[index], 2.0 * thickness
+    self.physical[index] = True
+    self.offsets[index] = 0.5 * length
+    self.inertias[index] = self.masses[index] * (length * length + width * width) / 12.0
+
+  def pop(self):
+    """forgets the last rod"""
+    self.count -= 1
+    self.version += 1
+
+  def invalidate(self, index = None):
+    """marks derived geometry of a single rod (or all of them) as outdated"""
+    if index is None:
+      self.stale[:self.count] = True
+    else:
+      self.stale[index] = True
+    self.any_stale = True
+    self.version += 1
+
+  def set_endpoints(self, starts, tips):
+    """moves all rods at once"""
+    self.starts[:self.count], self.tips[:self.count] = starts, tips
+    self.invalidate()
+
+  def derive(self):
+    """recomputes lengths, angles, tilts, directions and degrees of stale rods"""
+    if not self.any_stale:
+      return
+    if self.stale[:self.count].all():
+      stale = slice(0, self.count)
+    else:
+      stale = numpy.flatnonzero(self.stale[:self.count])
+    vectors = self.tips[stale] - self.starts[stale]
+    x, y, z = vectors[:, 0], vectors[:, 1], vectors[:, 2]
+    lengths = numpy.sqrt(x * x + y * y + z * z)
+    angles = numpy.arctan2(x, -y)
+    self.lengths[stale], self.angles[stale] = lengths, angles
+    self.degrees[stale] = numpy.degrees(angles)
+    with numpy.errstate(invalid = 'ignore', divide = 'ignore'):
+      self.directions[stale] = numpy.where(lengths[:, None] > 0.0, vectors / lengths[:, None], 0.0)
+    # a rod turned by its angle about Z after being tilted about X points along its direction
+    self.tilts[stale] = numpy.arcsin(numpy.clip(-self.directions[stale, 2], -1.0, 1.0))
+    self.stale[stale] = False
+    self.any_stale = False
 
 
 class Rod(object):
-  """This class allows to render a basic Pendulum object - Rod. A Rods can be at different place, has a different length and color."""
+  """This class allows to render a basic Pendulum object - Rod. A Rods can be at different place, has a different length and color.
+     A rod is a lightweight view of a single entry of RodsBuffer."""
 
-  thickness = 0.1
+  width = 0.1
   scale = 0.3
+  __slots__ = ('buffer', 'index')
+
+  def __init__(self, start, end, color = (255.0, 0.0, 0.0), mass = 1.0, physical = False):
+    """sets a position and length, the mass hangs at the tip unless the rod is physical:
+       a uniform bar with the mass spread along it"""
+    self.buffer = RodsBuffer(1)
+    self.index = self.buffer.append(start, end, color, mass)
+    if physical:
+      self.buffer.make_physical(self.index, self.thickness)
+
+  @classmethod
+  def view(cls, buffer, index):
+    """returns a rod backed by an entry of existing buffer"""
+    rod = cls.__new__(cls)
+    rod.buffer, rod.index = buffer, index
+    return rod
+
+  @property
+  def thickness(self):
+    return self.width * self.scale
+
+  def _get_position(self):
+    return tuple(self.buffer.starts[self.index].tolist())
+
+  def _set_position(self, position):
+    self.buffer.starts[self.index] = position
+    self.buffer.invalidate(self.index)
+
+  def _get_tip(self):
+    return tuple(self.buffer.tips[self.index].tolist())
+
+  def _set_tip(self, tip):
+    self.buffer.tips[self.index] = tip
+    self.buffer.invalidate(self.index)
+
+  position = property(_get_position, _set_position, None, "Starting point")
+  tip = property(_get_tip, _set_tip, None, "Ending point")
+
+  @property
+  def color(self):
+    return tuple(self.buffer.colors[self.index].tolist())
 
-  def __init__(self, start, end, color = (255.0, 0.0, 0.0)):
-    """sets a position and length"""
-    self.position = start
-    self.tip = end
-    self.thickness *= self.scale
-    self.color = color
+  @property
+  def mass(self):
+    return float(self.buffer.masses[self.index])
+
+  @property
+  def physical(self):
+    return bool(self.buffer.physical[self.index])
+
+  def offset(self):
+    """returns distance of the centre of mass from the starting point"""
+    if self.physical:
+      return float(self.buffer.offsets[self.index])
+    return self.length()
+
+  def inertia(self):
+    """returns moment of inertia about the centre of mass"""
+    return float(self.buffer.inertias[self.index])
 
   def length(self):
     """returns a length of rod"""
-    return self.to_vector3().length
+    self.buffer.derive()
+    return float(self.buffer.lengths[self.index])
+
+  def direction(self):
+    """returns a unit vector pointing from position to tip"""
+    self.buffer.derive()
+    return tuple(self.buffer.directions[self.index].tolist())
 
   def to_vector3(self):
     """returns a Vector3 representing rod"""
@@ -65,70 +271,635 @@ class Rod(object):
 
   def angle(self):
     """returns angle, of which the rod is rotated from a vertical direction around Z-axis"""
-    x, y = self.to_vector3()._get_0(), self.to_vector3()._get_1()
-    return math.copysign(1, x) * math.acos(-y / math.sqrt(x * x + y * y))
+    self.buffer.derive()
+    return float(self.buffer.angles[self.index])
+
+  def degrees(self):
+    """returns angle of the rod in degrees"""
+    self.buffer.derive()
+    return float(self.buffer.degrees[self.index])
+
+  def tilt(self):
+    """returns angle, of which the rod is rotated out of the XY plane around X-axis before turning by its angle"""
+    self.buffer.derive()
+    return float(self.buffer.tilts[self.index])
 
   def to_string(self):
     """returns info about rod"""
-    return "len_" + str(self.length()) + "__ang_" + str(math.degrees(self.angle()))
+    return "len_" + str(self.length()) + "__ang_" + str(self.degrees())
 
   def render(self):
     """renders an object"""
+    x, y, z = self.position
+    degrees, t, l = self.degrees(), self.thickness, -self.length()
+    tilt = math.degrees(self.tilt())
     glColor(self.color)
-    glTranslate(self.position[0], self.position[1], self.position[2])
-    glRotate(math.degrees(self.angle()), 0.0, 0.0, 1.0)
+    glPushMatrix()
+    glTranslate(x, y, z)
+    glRotate(degrees, 0.0, 0.0, 1.0)
+    glRotate(tilt, 1.0, 0.0, 0.0)
     glBegin(GL_QUADS)
-    glVertex(-self.thickness, 0.0,  self.thickness)
-    glVertex( self.thickness, 0.0,  self.thickness)
-    glVertex( self.thickness, -self.length(),  self.thickness)
-    glVertex(-self.thickness, -self.length(),  self.thickness)
+    glVertex(-t, 0.0,  t)
+    glVertex( t, 0.0,  t)
+    glVertex( t, l,  t)
+    glVertex(-t, l,  t)
     glEnd()
     glBegin(GL_QUADS)
-    glVertex( self.thickness, 0.0,  self.thickness)
-    glVertex( self.thickness, 0.0, -self.thickness)
-    glVertex( self.thickness, -self.length(), -self.thickness)
-    glVertex( self.thickness, -self.length(),  self.thickness)
+    glVertex( t, 0.0,  t)
+    glVertex( t, 0.0, -t)
+    glVertex( t, l, -t)
+    glVertex( t, l,  t)
     glEnd()
     glBegin(GL_QUADS)
-    glVertex( self.thickness, 0.0, -self.thickness)
-    glVertex(-self.thickness, 0.0, -self.thickness)
-    glVertex(-self.thickness, -self.length(), -self.thickness)
-    glVertex( self.thickness, -self.length(), -self.thickness)
+    glVertex( t, 0.0, -t)
+    glVertex(-t, 0.0, -t)
+    glVertex(-t, l, -t)
+    glVertex( t, l, -t)
     glEnd()
     glBegin(GL_QUADS)
-    glVertex(-self.thickness, 0.0, -self.thickness)
-    glVertex(-self.thickness, 0.0, self.thickness)
-    glVertex(-self.thickness, -self.length(),  self.thickness)
-    glVertex(-self.thickness, -self.length(), -self.thickness)
+    glVertex(-t, 0.0, -t)
+    glVertex(-t, 0.0, t)
+    glVertex(-t, l,  t)
+    glVertex(-t, l, -t)
+    glEnd()
+    glPopMatrix()
+
+
+class Spring(Rod):
+  """This class is a metal spring: a Rod whose length changes, pulled back
+     to its rest length with given stiffness and damping."""
+
+  coils = 8
+  __slots__ = ()
+
+  def __init__(self, start, end, stiffness, damping = 0.0, rest_length = None, color = (0.0, 128.0, 255.0), mass = 1.0):
+    """sets a position and length, the rest length defaults to the current one"""
+    Rod.__init__(self, start, end, color, mass)
+    if rest_length is None:
+      rest_length = self.length()
+    self.buffer.make_spring(self.index, stiffness, damping, rest_length)
+
+  @property
+  def stiffness(self):
+    return float(self.buffer.stiffness[self.index])
+
+  @property
+  def damping(self):
+    return float(self.buffer.damping[self.index])
+
+  @property
+  def rest_length(self):
+    return float(self.buffer.rest_lengths[self.index])
+
+  def to_string(self):
+    """returns info about spring"""
+    return Rod.to_string(self) + "__k_" + str(self.stiffness)
+
+  def render(self):
+    """renders a spring as a zigzag line"""
+    x, y, z = self.position
+    degrees, t, l = self.degrees(), self.thickness, -self.length()
+    tilt = math.degrees(self.tilt())
+    glColor(self.color)
+    glPushMatrix()
+    glTranslate(x, y, z)
+    glRotate(degrees, 0.0, 0.0, 1.0)
+    glRotate(tilt, 1.0, 0.0, 0.0)
+    glBegin(GL_LINE_STRIP)
+    glVertex(0.0, 0.0, 0.0)
+    for i in range(2 * self.coils):
+      glVertex(t if i % 2 == 0 else -t, l * (i + 0.5) / (2 * self.coils), 0.0)
+    glVertex(0.0, l, 0.0)
     glEnd()
-    glRotate(-math.degrees(self.angle()), 0.0, 0.0, 1.0)
-    glTranslate(-self.position[0], -self.position[1], -self.position[2])
+    glPopMatrix()
+
+
+class RodsView(collections.Sequence):
+  """This class presents rods of a chain as a sequence, creating views on demand."""
+
+  def __init__(self, buffer):
+    self.buffer = buffer
+
+  def __len__(self):
+    return self.buffer.count
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self[i] for i in range(*index.indices(len(self)))]
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError("rod index out of range")
+    if self.buffer.springs[index]:
+      return Spring.view(self.buffer, index)
+    return Rod.view(self.buffer, index)
+
+
+class RodsMesh(object):
+  """This class draws all rods of a buffer in retained mode: vertices,
+     normals and colors of every box are packed into one interleaved
+     vertex buffer which is rebuilt in bulk only when rods move and drawn
+     with a single call."""
+
+  # four side quads of a box in rod coordinates: x and z are multiplied by
+  # thickness, y by the negated length
+  corners = numpy.array([(-1, 0,  1), ( 1, 0,  1), ( 1, 1,  1), (-1, 1,  1),
+                         ( 1, 0,  1), ( 1, 0, -1), ( 1, 1, -1), ( 1, 1,  1),
+                         ( 1, 0, -1), (-1, 0, -1), (-1, 1, -1), ( 1, 1, -1),
+                         (-1, 0, -1), (-1, 0,  1), (-1, 1,  1), (-1, 1, -1)], dtype = float)
+  normals = numpy.repeat([(0, 0, 1), (1, 0, 0), (0, 0, -1), (-1, 0, 0)], 4, axis = 0).astype(float)
+  stride = 9 * 4
+
+  def __init__(self, buffer):
+    self.buffer = buffer
+    self.version = None
+    self.vertices = numpy.zeros((0, 9), dtype = numpy.float32)
+    self.vbo = None
+
+  def build(self):
+    """returns an (N * 16, 9) array of interleaved positions, normals and colors of rods, springs left out"""
+    buffer = self.buffer
+    buffer.derive()
+    rods = buffer.rods()
+    count = len(rods)
+    starts = buffer.starts[rods, None, :]
+    cos = numpy.cos(buffer.angles[rods])[:, None]
+    sin = numpy.sin(buffer.angles[rods])[:, None]
+    tilt_cos = numpy.cos(buffer.tilts[rods])[:, None]
+    tilt_sin = numpy.sin(buffer.tilts[rods])[:, None]
+    x = self.corners[:, 0] * Rod.width * Rod.scale
+    # boxes are tilted about X first, then turned about Z
+    length = -self.corners[:, 1] * buffer.lengths[rods, None]
+    width = self.corners[:, 2] * Rod.width * Rod.scale
+    y, z = tilt_cos * length - tilt_sin * width, tilt_sin * length + tilt_cos * width
+    ny, nz = -tilt_sin * self.normals[:, 2], tilt_cos * self.normals[:, 2]
+    vertices = numpy.empty((count, len(self.corners), 9), dtype = numpy.float32)
+    vertices[:, :, 0] = starts[:, :, 0] + cos * x - sin * y
+    vertices[:, :, 1] = starts[:, :, 1] + sin * x + cos * y
+    vertices[:, :, 2] = starts[:, :, 2] + z
+    vertices[:, :, 3] = cos * self.normals[:, 0] - sin * ny
+    vertices[:, :, 4] = sin * self.normals[:, 0] + cos * ny
+    vertices[:, :, 5] = nz
+    vertices[:, :, 6:9] = buffer.colors[rods, None, :] / 255.0
+    return vertices.reshape(-1, 9)
+
+  def update(self):
+    """rebuilds vertex data if rods changed since the last build"""
+    if self.version == self.buffer.version:
+      return False
+    self.vertices = self.build()
+    self.version = self.buffer.version
+    if self.vbo is not None:
+      self.vbo.set_array(self.vertices)
+    return True
+
+  def render(self):
+    """draws all rods with one call"""
+    self.update()
+    if len(self.vertices) == 0:
+      return
+    if self.vbo is None:
+      self.vbo = vbo.VBO(self.vertices)
+    self.vbo.bind()
+    try:
+      glEnableClientState(GL_VERTEX_ARRAY)
+      glEnableClientState(GL_NORMAL_ARRAY)
+      glEnableClientState(GL_COLOR_ARRAY)
+      glVertexPointer(3, GL_FLOAT, self.stride, self.vbo)
+      glNormalPointer(GL_FLOAT, self.stride, self.vbo + 12)
+      glColorPointer(3, GL_FLOAT, self.stride, self.vbo + 24)
+      glDrawArrays(GL_QUADS, 0, len(self.vertices))
+    finally:
+      glDisableClientState(GL_COLOR_ARRAY)
+      glDisableClientState(GL_NORMAL_ARRAY)
+      glDisableClientState(GL_VERTEX_ARRAY)
+      self.vbo.unbind()
+
+  def release(self, current = True):
+    """frees the vertex buffer if its OpenGL context is still current and forgets it,
+       the next render creates a new one"""
+    if self.vbo is not None and current:
+      self.vbo.delete()
+    self.vbo = None
+
+
+class RodsInstances(object):
+  """This class draws rods of one or more buffers as instances of a single
+     unit box uploaded once. Per frame only an (N, 9) array of instance
+     data (start, angle, length, color and tilt of every rod) is written,
+     the box is placed, rotated and stretched in a vertex shader."""
+
+  vertex_shader = """
+    #version 120
+    attribute vec3 corner;
+    attribute vec3 normal;
+    attribute vec4 placement;
+    attribute vec4 shape;
+    attribute float tilt;
+    uniform float thickness;
+    varying vec3 color;
+    void main() {
+      float c = cos(placement.w), s = sin(placement.w), tc = cos(tilt), ts = sin(tilt);
+      vec3 local = vec3(corner.x * thickness, -corner.y * shape.x, corner.z * thickness);
+      local = vec3(local.x, tc * local.y - ts * local.z, ts * local.y + tc * local.z);
+      vec3 world = placement.xyz + vec3(c * local.x - s * local.y, s * local.x + c * local.y, local.z);
+      vec3 tilted = vec3(normal.x, tc * normal.y - ts * normal.z, ts * normal.y + tc * normal.z);
+      vec3 turned = vec3(c * tilted.x - s * tilted.y, s * tilted.x + c * tilted.y, tilted.z);
+      float diffuse = max(dot(normalize(gl_NormalMatrix * turned), normalize(gl_LightSource[0].position.xyz)), 0.0);
+      color = shape.yzw * (0.1 + diffuse);
+      gl_Position = gl_ModelViewProjectionMatrix * vec4(world, 1.0);
+    }"""
+  fragment_shader = """
+    #version 120
+    varying vec3 color;
+    void main() {
+      gl_FragColor = vec4(color, 1.0);
+    }"""
+
+  def __init__(self, *buffers):
+    self.buffers = buffers
+    self.versions = None
+    self.instances = numpy.zeros((0, 9), dtype = numpy.float32)
+    self.program = None
+    self.available = None
+
+  def build(self):
+    """returns an (N, 9) array of rod starts, angles, lengths, colors and tilts, springs left out"""
+    parts = []
+    for buffer in self.buffers:
+      buffer.derive()
+      rods = buffer.rods()
+      count = len(rods)
+      part = numpy.empty((count, 9), dtype = numpy.float32)
+      part[:, 0:3] = buffer.starts[rods]
+      part[:, 3] = buffer.angles[rods]
+      part[:, 4] = buffer.lengths[rods]
+      part[:, 5:8] = buffer.colors[rods] / 255.0
+      part[:, 8] = buffer.tilts[rods]
+      parts.append(part)
+    return numpy.concatenate(parts)
+
+  def update(self):
+    """rewrites instance data if any of buffers changed"""
+    versions = tuple(buffer.version for buffer in self.buffers)
+    if versions == self.versions:
+      return False
+    self.instances = self.build()
+    self.versions = versions
+    if self.available:
+      self.instance_vbo.set_array(self.instances)
+    return True
+
+  def supported(self):
+    """checks (once, with a current OpenGL context) whether instancing works"""
+    if self.available is None:
+      try:
+        self.program = shaders.compileProgram(shaders.compileShader(self.vertex_shader, GL_VERTEX_SHADER),
+                                              shaders.compileShader(self.fragment_shader, GL_FRAGMENT_SHADER))
+        self.available = bool(glVertexAttribDivisor) and bool(glDrawArraysInstanced)
+      except (RuntimeError, error.Error):
+        self.program, self.available = None, False
+      if self.available:
+        box = numpy.hstack((RodsMesh.corners, RodsMesh.normals)).astype(numpy.float32)
+        self.box_vbo = vbo.VBO(box)
+        self.instance_vbo = vbo.VBO(self.instances)
+        self.versions = None
+    return self.available
+
+  def attribute(self, name, size, stride, pointer, divisor):
+    """points a shader attribute at a bound vertex buffer"""
+    location = glGetAttribLocation(self.program, name)
+    glEnableVertexAttribArray(location)
+    glVertexAttribPointer(location, size, GL_FLOAT, GL_FALSE, stride, pointer)
+    glVertexAttribDivisor(location, divisor)
+    return location
+
+  def render(self):
+    """draws all rods with one instanced call"""
+    self.update()
+    if len(self.instances) == 0:
+      return
+    glUseProgram(self.program)
+    glUniform1f(glGetUniformLocation(self.program, "thickness"), Rod.width * Rod.scale)
+    locations = []
+    try:
+      self.box_vbo.bind()
+      locations.append(self.attribute("corner", 3, 24, self.box_vbo, 0))
+      locations.append(self.attribute("normal", 3, 24, self.box_vbo + 12, 0))
+      self.instance_vbo.bind()
+      locations.append(self.attribute("placement", 4, 36, self.instance_vbo, 1))
+      locations.append(self.attribute("shape", 4, 36, self.instance_vbo + 16, 1))
+      locations.append(self.attribute("tilt", 1, 36, self.instance_vbo + 32, 1))
+      glDrawArraysInstanced(GL_QUADS, 0, len(RodsMesh.corners), len(self.instances))
+    finally:
+      for location in locations:
+        glVertexAttribDivisor(location, 0)
+        glDisableVertexAttribArray(location)
+      self.instance_vbo.unbind()
+      glUseProgram(0)
+
+  def release(self, current = True):
+    """frees the program and vertex buffers if their OpenGL context is still current and forgets
+       them, support of instancing is checked again in the next context"""
+    if self.available and current:
+      self.box_vbo.delete()
+      self.instance_vbo.delete()
+      glDeleteProgram(self.program)
+    self.program = self.available = None
+    self.box_vbo = self.instance_vbo = None
+
+
+def _locked(method):
+  """makes a method of a chain hold its lock, the GUI and the simulation runner take turns"""
+  @functools.wraps(method)
+  def locked(self, *args, **kwargs):
+    with self.lock:
+      return method(self, *args, **kwargs)
+  return locked
 
 
 class RodsChain(object):
   """This class provides possibility of managing a chain of
-     Rods."""
+     Rods. A chain lying in the XY plane swings in it, once any rod
+     points out of the plane the joints become spherical. Methods
+     changing rods or dynamics hold the chain lock, which the simulation
+     runner holds over every frame."""
 
-  def __init__(self, position = (0.0, 0.0, 0.0)):
-    """initializes a new rods chain"""
+  instanced = True
+
+  def __init__(self, position = (0.0, 0.0, 0.0), integrator = None):
+    """initializes a new rods chain, integrator defaults to RK4"""
     self.position = position
-    self.rods = []
+    self.integrator = integrator
+    self.buffer = RodsBuffer()
+    self.rods = RodsView(self.buffer)
+    self.mesh = RodsMesh(self.buffer)
+    self.instances = RodsInstances(self.buffer)
+    self.dynamics = None
+    self.previous = None
+    self.lock = threading.RLock()
 
-  def push(self, length, angle):
-    """appends a new rod with specific length and rotated by angle"""
-    if len(self.rods) == 0:
-      new_position = (self.position[0] + length * math.sin(math.radians(angle)), self.position[1] - length * math.cos(math.radians(angle)) , 0.0)
-      self.rods.append(Rod(self.position, new_position))
+  @_locked
+  def push(self, length, angle, mass = 1.0, color = (255.0, 0.0, 0.0), physical = False, azimuth = 0.0):
+    """appends a new rod with specific length and rotated by angle from the vertical, a physical one
+       has its mass spread along it instead of hanging at the tip; azimuth (degrees) turns the rod
+       about the vertical out of the XY plane, towards negative Z"""
+    self.dynamics = None
+    if len(self.buffer) == 0:
+      start = self.position
     else:
-      last = self.rods[-1]
-      new_position = (last.tip[0] + length * math.sin(math.radians(angle)), last.tip[1] - length * math.cos(math.radians(angle)) , 0.0)
-      self.rods.append(Rod(last.tip, new_position))
+      start = self.buffer.tips[len(self.buffer) - 1].tolist()
+    index = self.buffer.append(start, self.hanging(start, length, angle, azimuth), color, mass)
+    if physical:
+      self.buffer.make_physical(index, Rod.width * Rod.scale)
+    return index
+
+  @staticmethod
+  def hanging(start, length, angle, azimuth):
+    """returns tip of a rod hanging from start, rotated by angle from the vertical and by azimuth about it (degrees)"""
+    swing, turn = math.radians(angle), math.radians(azimuth)
+    return (start[0] + length * math.sin(swing) * math.cos(turn), start[1] - length * math.cos(swing),
+            start[2] - length * math.sin(swing) * math.sin(turn))
+
+  @_locked
+  def push_spring(self, length, angle, stiffness, damping = 0.0, rest_length = None, mass = 1.0,
+                  color = (0.0, 128.0, 255.0)):
+    """appends a new spring of current length rotated by angle, resting at rest_length (length by default)"""
+    index = self.push(length, angle, mass, color)
+    self.buffer.make_spring(index, stiffness, damping, length if rest_length is None else rest_length)
 
+  @_locked
   def pop(self):
     """remove a last rod"""
-    return self.rods.pop()
+    self.dynamics = None
+    last = self.rods[-1]
+    if isinstance(last, Spring):
+      rod = Spring(last.position, last.tip, last.stiffness, last.damping, last.rest_length, last.color, last.mass)
+    else:
+      rod = Rod(last.position, last.tip, last.color, last.mass, last.physical)
+    self.buffer.pop()
+    return rod
+
+  def positions(self):
+    """returns an (N, 3) array of rod starting points"""
+    return self.buffer.starts[:len(self.buffer)]
+
+  def tips(self):
+    """returns an (N, 3) array of rod tips"""
+    return self.buffer.tips[:len(self.buffer)]
+
+  def lengths(self):
+    """returns an array of rod lengths"""
+    self.buffer.derive()
+    return self.buffer.lengths[:len(self.buffer)]
+
+  def angles(self):
+    """returns an array of rod angles (radians)"""
+    self.buffer.derive()
+    return self.buffer.angles[:len(self.buffer)]
+
+  def tilts(self):
+    """returns an array of rod tilts out of the XY plane (radians)"""
+    self.buffer.derive()
+    return self.buffer.tilts[:len(self.buffer)]
+
+  def directions(self):
+    """returns an (N, 3) array of unit vectors along rods"""
+    self.buffer.derive()
+    return self.buffer.directions[:len(self.buffer)]
+
+  def spherical(self):
+    """checks whether any rod points out of the XY plane, which needs spherical joints"""
+    return bool(numpy.any(self.directions()[:, 2] != 0.0))
+
+  def _state(self):
+    """returns a copy of the coordinates the dynamics advances, angles or quaternions"""
+    if isinstance(self.dynamics, SphericalChain):
+      return self.dynamics.orientations.copy()
+    return self.dynamics.theta.copy()
+
+  def masses(self):
+    """returns an array of masses of rods"""
+    return self.buffer.masses[:len(self.buffer)]
+
+  def offsets(self):
+    """returns an array of distances of centres of mass from rod starts, lengths for point masses"""
+    count = len(self.buffer)
+    return numpy.where(self.buffer.physical[:count], self.buffer.offsets[:count], self.lengths())
+
+  def inertias(self):
+    """returns an array of moments of inertia of rods about their centres of mass"""
+    return self.buffer.inertias[:len(self.buffer)]
+
+  def build_dynamics(self):
+    """returns dynamics starting from the current placement of rods"""
+    springs = numpy.flatnonzero(self.buffer.springs[:len(self.buffer)])
+    if self.spherical():
+      if len(springs) or numpy.any(self.buffer.physical[:len(self.buffer)]):
+        raise ValueError("only point masses on rigid rods swing in three dimensions")
+      return SphericalChain.from_directions(self.lengths(), self.directions(), self.masses(),
+                                            position = self.position, integrator = self.integrator)
+    if len(springs):
+      buffer = self.buffer
+      if numpy.any(buffer.physical[:len(buffer)]):
+        raise ValueError("physical rods cannot be mixed with springs")
+      return ElasticChainDynamics(self.lengths(), self.angles(), self.masses(), springs = springs,
+                                  stiffness = buffer.stiffness[springs], damping = buffer.damping[springs],
+                                  rest_lengths = buffer.rest_lengths[springs], position = self.position,
+                                  integrator = self.integrator)
+    return ChainDynamics(self.lengths(), self.angles(), self.masses(), position = self.position,
+                         integrator = self.integrator, offsets = self.offsets(), inertias = self.inertias())
+
+  @_locked
+  def step(self, dt):
+    """advances the chain in time by dt seconds, rods stay where they are until interpolated"""
+    if len(self.buffer) == 0:
+      return
+    if self.dynamics is None:
+      self.dynamics = self.build_dynamics()
+    self.previous = self._state()
+    self.dynamics.step(dt)
+
+  @_locked
+  def interpolate(self, alpha = 1.0):
+    """moves rods to a state lying alpha of a step between the previous and the current one"""
+    if self.dynamics is None:
+      return
+    if isinstance(self.dynamics, SphericalChain):
+      # quaternions are blended linearly and normalized back
+      tips = self.dynamics.tips(quaternion_normalize(lerp(self.previous, self.dynamics.orientations, alpha)))
+    else:
+      tips = self.dynamics.tips(lerp(self.previous, self.dynamics.theta, alpha))
+    self.buffer.set_endpoints(self.starts(tips), tips)
+
+  def starts(self, tips):
+    """returns starting points of rods ending at given (N, 3) tips"""
+    starts = numpy.empty_like(tips)
+    starts[0], starts[1:] = self.position, tips[:-1]
+    return starts
+
+  @_locked
+  def place(self, tips):
+    """moves rods so that they end at given (N, 3) tips, adding or removing rods to match"""
+    while len(self.buffer) > len(tips):
+      self.buffer.pop()
+    while len(self.buffer) < len(tips):
+      self.buffer.append(self.position, self.position, (255.0, 0.0, 0.0), 1.0)
+    self.buffer.set_endpoints(self.starts(tips), tips)
+    self.dynamics = None
+
+  @_locked
+  def resume(self, dynamics):
+    """continues simulation from given ChainDynamics, e.g. one loaded from a checkpoint"""
+    self.position = dynamics.position
+    self.integrator = dynamics.integrator
+    self.place(dynamics.tips())
+    count = len(self.buffer)
+    self.buffer.masses[:count] = dynamics.masses
+    self.buffer.physical[:count] = (dynamics.offsets != dynamics.lengths) | (dynamics.inertias != 0.0)
+    self.buffer.offsets[:count], self.buffer.inertias[:count] = dynamics.offsets, dynamics.inertias
+    self.buffer.springs[:] = False
+    if isinstance(dynamics, ElasticChainDynamics):
+      for index, stiffness, damping, rest_length in zip(dynamics.springs, dynamics.stiffness,
+                                                        dynamics.damping, dynamics.rest_lengths):
+        self.buffer.make_spring(index, stiffness, damping, rest_length)
+    self.dynamics = dynamics
+    self.previous = dynamics.theta.copy()
+
+  def normal_modes(self):
+    """returns NormalModes of the chain linearized about hanging down, starting from its current state"""
+    if isinstance(self.dynamics, SphericalChain) or (self.dynamics is None and self.spherical()):
+      raise ValueError("normal modes need a planar chain")
+    if self.dynamics is not None:
+      return NormalModes.from_dynamics(self.dynamics)
+    if numpy.any(self.buffer.springs[:len(self.buffer)]):
+      raise ValueError("normal modes need a chain of rigid rods")
+    modes = NormalModes(self.lengths(), self.masses(), offsets = self.offsets(), inertias = self.inertias())
+    modes.start(self.angles())
+    return modes
+
+  def release(self, current = True):
+    """frees OpenGL objects of the chain if their context is still current and forgets them,
+       to be called whenever the context goes away since the chain outlives it"""
+    self.mesh.release(current)
+    self.instances.release(current)
 
   def render(self):
-    """draws a rods chain"""
-    for rod in self.rods:
-      rod.render()
+    """draws a rods chain, instanced when the graphics card allows it; springs are
+       left out of the batch and drawn as zigzag lines afterwards"""
+    if self.instanced and self.instances.supported():
+      self.instances.render()
+    else:
+      self.mesh.render()
+    for index in numpy.flatnonzero(self.buffer.springs[:len(self.buffer)]):
+      Spring.view(self.buffer, index).render()
+
+
+class RodsTree(RodsChain):
+  """This class manages rods hanging from one another in a tree: any rod
+     may carry several others, as in mobiles or multi-arm pendulums. Rods
+     are kept in the order they were pushed, so every rod comes after the
+     one it hangs from and their parents form a topologically sorted
+     array. All joints are spherical, the dynamics is a SphericalTree."""
+
+  def __init__(self, position = (0.0, 0.0, 0.0), integrator = None):
+    """initializes a new rods tree, integrator defaults to RK4"""
+    RodsChain.__init__(self, position, integrator)
+    self.parents = []
+
+  @_locked
+  def push(self, length, angle, mass = 1.0, color = (255.0, 0.0, 0.0), physical = False, azimuth = 0.0, parent = -1):
+    """appends a new rod hanging from the tip of rod parent (the pivot for -1), rotated by angle
+       and azimuth as in RodsChain.push; returns its index. Rods of a tree are never physical"""
+    if physical:
+      raise ValueError("a rods tree holds point masses only")
+    if not -1 <= parent < len(self.buffer):
+      raise IndexError("no rod %d to hang from" % parent)
+    self.dynamics = None
+    start = self.position if parent < 0 else self.buffer.tips[parent].tolist()
+    index = self.buffer.append(start, self.hanging(start, length, angle, azimuth), color, mass)
+    self.parents.append(parent)
+    return index
+
+  def push_spring(self, *args, **kwargs):
+    """refuses springs, a tree swings on rigid rods only"""
+    raise ValueError("a rods tree holds rigid rods only")
+
+  @_locked
+  def pop(self):
+    """remove a last rod, which never carries others"""
+    rod = RodsChain.pop(self)
+    self.parents.pop()
+    return rod
+
+  def children(self, index):
+    """returns indices of rods hanging from given rod, or from the pivot for -1"""
+    return [child for child, parent in enumerate(self.parents) if parent == index]
+
+  def build_dynamics(self):
+    """returns a SphericalTree starting from the current placement of rods"""
+    count = len(self.buffer)
+    if numpy.any(self.buffer.springs[:count]) or numpy.any(self.buffer.physical[:count]):
+      raise ValueError("only point masses on rigid rods hang in a tree")
+    return SphericalTree.from_directions(self.lengths(), self.directions(), self.masses(), position = self.position,
+                                         integrator = self.integrator, parents = self.parents)
+
+  def starts(self, tips):
+    """returns starting points of rods ending at given (N, 3) tips, tips of their parents"""
+    parents = numpy.array(self.parents, dtype = int)
+    return numpy.where(parents[:, None] < 0, numpy.array(self.position, dtype = float), tips[parents])
+
+  @_locked
+  def place(self, tips):
+    """moves rods so that they end at given (N, 3) tips, one for every rod of the tree"""
+    if len(tips) != len(self.buffer):
+      raise ValueError("a rods tree is placed with a tip for every rod")
+    RodsChain.place(self, tips)
+
+  def resume(self, dynamics):
+    """refuses dynamics of chains, which cannot describe branches"""
+    raise ValueError("a rods tree cannot resume chain dynamics")
+
+  def normal_modes(self):
+    """refuses to linearize, normal modes are computed for planar chains only"""
+    raise ValueError("normal modes need a planar chain")
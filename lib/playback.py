@@ -0,0 +1,85 @@
+import bisect
+import numpy
+from lib.util import lerp
+
+
+class TrajectoryPlayer(object):
+  """This class replays a recorded TrajectoryFile. It keeps its own clock
+     which can be paused, sped up or moved anywhere; states between stored
+     samples are interpolated. Seeking uses the even spacing of samples and
+     falls back to a sparse keyframe index (time of every n-th record), so
+     it never scans the recording."""
+
+  def __init__(self, trajectory, keyframe_interval = 1024):
+    """prepares playback of a trajectory, starting paused at its beginning"""
+    if len(trajectory) == 0:
+      raise ValueError("%s holds no states" % trajectory.path)
+    self.trajectory = trajectory
+    self.keyframe_interval = keyframe_interval
+    self.keyframes = numpy.array(trajectory.time[::keyframe_interval]).tolist()
+    self.start = float(trajectory.time[0])
+    self.end = float(trajectory.time[-1])
+    self.spacing = trajectory.time_step * trajectory.every
+    # rod lengths follow from tips of any record and the pivot
+    tips = numpy.array(trajectory.tips[0])
+    starts = numpy.vstack((trajectory.position, tips[:-1]))
+    self.lengths = numpy.sqrt(numpy.sum((tips - starts) ** 2, axis = 1))
+    self.time = self.start
+    self.speed = 1.0
+    self.playing = False
+
+  def play(self):
+    if self.time >= self.end:
+      self.time = self.start
+    self.playing = True
+
+  def pause(self):
+    self.playing = False
+
+  def toggle(self):
+    """switches between playing and paused"""
+    if self.playing:
+      self.pause()
+    else:
+      self.play()
+
+  def seek(self, time):
+    """moves playback clock to given time, clamped to the recording"""
+    self.time = min(max(time, self.start), self.end)
+
+  def advance(self, frame_time):
+    """moves the clock by frame time scaled by speed when playing, pauses at either end"""
+    if self.playing:
+      self.seek(self.time + frame_time * self.speed)
+      if (self.speed > 0.0 and self.time == self.end) or (self.speed < 0.0 and self.time == self.start):
+        self.playing = False
+    return self.time
+
+  def locate(self, time):
+    """returns index of the last record not later than time"""
+    times = self.trajectory.time
+    last = len(times) - 1
+    guess = min(max(int((time - self.start) / self.spacing), 0), last) if self.spacing > 0.0 else 0
+    if times[guess] <= time and (guess == last or time < times[guess + 1]):
+      return guess
+    block = max(bisect.bisect_right(self.keyframes, time) - 1, 0)
+    first = block * self.keyframe_interval
+    window = times[first:first + self.keyframe_interval + 1]
+    return min(max(first + int(numpy.searchsorted(window, time, side = "right")) - 1, 0), last)
+
+  def state(self, time = None):
+    """returns interpolated angles and tips at given (or current) time"""
+    if time is None:
+      time = self.time
+    index = self.locate(time)
+    records = self.trajectory.records
+    theta = numpy.array(records[index]["theta"], dtype = float)
+    if index + 1 < len(records):
+      before, after = float(records[index]["time"]), float(records[index + 1]["time"])
+      if after > before:
+        theta = lerp(theta, numpy.array(records[index + 1]["theta"], dtype = float), (time - before) / (after - before))
+    tips = numpy.empty((len(theta), 3))
+    tips[:, 0] = self.trajectory.position[0] + numpy.cumsum(self.lengths * numpy.sin(theta))
+    tips[:, 1] = self.trajectory.position[1] - numpy.cumsum(self.lengths * numpy.cos(theta))
+    tips[:, 2] = self.trajectory.position[2]
+    return theta, tips
@@ -0,0 +1,114 @@
+import math
+import numpy
+from lib.matrix44 import Matrix44
+
+
+class Quaternion(object):
+  """This class represents a rotation as a unit quaternion (w, x, y, z)."""
+
+  __slots__ = ('w', 'x', 'y', 'z')
+
+  def __init__(self, w = 1.0, x = 0.0, y = 0.0, z = 0.0):
+    """sets components, no arguments give an identity rotation"""
+    self.w, self.x, self.y, self.z = float(w), float(x), float(y), float(z)
+
+  @classmethod
+  def from_axis_angle(cls, axis, angle):
+    """returns a rotation by angle (radians) around axis"""
+    x, y, z = axis
+    length = math.sqrt(x * x + y * y + z * z)
+    if length == 0.0:
+      return cls()
+    s = math.sin(angle / 2.0) / length
+    return cls(math.cos(angle / 2.0), x * s, y * s, z * s)
+
+  def __iter__(self):
+    return iter((self.w, self.x, self.y, self.z))
+
+  def __repr__(self):
+    return "Quaternion(%r, %r, %r, %r)" % (self.w, self.x, self.y, self.z)
+
+  def __mul__(self, other):
+    """returns a composition: rotation by other followed by rotation by self"""
+    aw, ax, ay, az = self
+    bw, bx, by, bz = other
+    return Quaternion(aw * bw - ax * bx - ay * by - az * bz,
+                      aw * bx + ax * bw + ay * bz - az * by,
+                      aw * by - ax * bz + ay * bw + az * bx,
+                      aw * bz + ax * by - ay * bx + az * bw)
+
+  def length(self):
+    """returns a norm of quaternion"""
+    return math.sqrt(self.w * self.w + self.x * self.x + self.y * self.y + self.z * self.z)
+
+  def normalize(self):
+    """scales quaternion back to unit length, removing rounding drift"""
+    length = self.length()
+    self.w, self.x, self.y, self.z = self.w / length, self.x / length, self.y / length, self.z / length
+    return self
+
+  def rotate(self, vector):
+    """returns vector rotated by quaternion"""
+    w, x, y, z = self
+    vx, vy, vz = vector
+    # t = 2 * (q x v), v' = v + w * t + q x t
+    tx, ty, tz = 2.0 * (y * vz - z * vy), 2.0 * (z * vx - x * vz), 2.0 * (x * vy - y * vx)
+    return (vx + w * tx + y * tz - z * ty, vy + w * ty + z * tx - x * tz, vz + w * tz + x * ty - y * tx)
+
+  def to_matrix44(self, translate = (0.0, 0.0, 0.0)):
+    """returns a Matrix44 with rows being rotated axes, and given translation"""
+    w, x, y, z = self
+    return Matrix44((1.0 - 2.0 * (y * y + z * z), 2.0 * (x * y + w * z), 2.0 * (x * z - w * y)),
+                    (2.0 * (x * y - w * z), 1.0 - 2.0 * (x * x + z * z), 2.0 * (y * z + w * x)),
+                    (2.0 * (x * z + w * y), 2.0 * (y * z - w * x), 1.0 - 2.0 * (x * x + y * y)),
+                    translate)
+
+
+def quaternion_product(a, b):
+  """returns products of quaternions stored as (..., 4) arrays of (w, x, y, z), rotations by b followed by a"""
+  aw, ax, ay, az = numpy.moveaxis(numpy.asarray(a, dtype = float), -1, 0)
+  bw, bx, by, bz = numpy.moveaxis(numpy.asarray(b, dtype = float), -1, 0)
+  return numpy.stack((aw * bw - ax * bx - ay * by - az * bz,
+                      aw * bx + ax * bw + ay * bz - az * by,
+                      aw * by - ax * bz + ay * bw + az * bx,
+                      aw * bz + ax * by - ay * bx + az * bw), axis = -1)
+
+
+def quaternion_rotate(quaternions, vectors):
+  """returns (..., 3) vectors rotated by (..., 4) quaternions, all at once"""
+  quaternions, vectors = numpy.asarray(quaternions, dtype = float), numpy.asarray(vectors, dtype = float)
+  w, axis = quaternions[..., :1], quaternions[..., 1:]
+  # t = 2 * (q x v), v' = v + w * t + q x t
+  twice = 2.0 * numpy.cross(axis, vectors)
+  return vectors + w * twice + numpy.cross(axis, twice)
+
+
+def quaternion_normalize(quaternions):
+  """returns (..., 4) quaternions scaled back to unit length"""
+  quaternions = numpy.asarray(quaternions, dtype = float)
+  return quaternions / numpy.sqrt(numpy.sum(quaternions * quaternions, axis = -1))[..., None]
+
+
+def quaternion_from_rotations(vectors):
+  """returns unit quaternions of (..., 3) rotation vectors, axes scaled by angles"""
+  vectors = numpy.asarray(vectors, dtype = float)
+  angle = numpy.sqrt(numpy.sum(vectors * vectors, axis = -1))[..., None]
+  with numpy.errstate(invalid = 'ignore', divide = 'ignore'):
+    # sin(angle / 2) / angle tends to a half for small angles
+    scale = numpy.where(angle > 1e-8, numpy.sin(0.5 * angle) / angle, 0.5 - angle * angle / 48.0)
+  return numpy.concatenate((numpy.cos(0.5 * angle), vectors * scale), axis = -1)
+
+
+def quaternion_between(start, end):
+  """returns unit quaternions turning (..., 3) unit vectors start into end along the shortest arc;
+     opposite vectors are turned by half a turn about any axis across them"""
+  start, end = numpy.broadcast_arrays(numpy.asarray(start, dtype = float), numpy.asarray(end, dtype = float))
+  axis = numpy.cross(start, end)
+  w = 1.0 + numpy.sum(start * end, axis = -1)
+  opposite = w < 1e-12
+  if numpy.any(opposite):
+    across = numpy.cross(start, [1.0, 0.0, 0.0])
+    across = numpy.where(numpy.sum(across * across, axis = -1)[..., None] < 1e-12, numpy.cross(start, [0.0, 0.0, 1.0]), across)
+    axis = numpy.where(opposite[..., None], across, axis)
+    w = numpy.where(opposite, 0.0, w)
+  return quaternion_normalize(numpy.concatenate((w[..., None], axis), axis = -1))
@@ -0,0 +1,148 @@
+import os
+import struct
+import numpy
+
+
+MAGIC = b"PENDTRAJ"
+VERSION = 2
+# magic, version, link count, time step, every, dtype, record count, pivot
+HEADER = struct.Struct("<8sIIdI8sQ3d")
+HEADER_SIZE = 128
+# version 1 files have no pivot and a shorter header, they hang from the origin
+HEADERS = {1: (struct.Struct("<8sIIdI8sQ"), 64), VERSION: (HEADER, HEADER_SIZE)}
+
+
+def record_dtype(links, dtype = "<f8"):
+  """returns a structured dtype of a single record of a chain with given number of links"""
+  return numpy.dtype([("time", dtype), ("theta", dtype, (links,)), ("omega", dtype, (links,)),
+                      ("tips", dtype, (links, 3))])
+
+
+class TrajectoryRecorder(object):
+  """This class streams states of a chain into an append-only binary file
+     of fixed size records behind a small header (link count, time step,
+     sampling interval, dtype, number of records, pivot position). Only a
+     window of chunk records is memory mapped at a time, so memory use
+     stays flat however long the run is."""
+
+  def __init__(self, path, links, time_step, every = 1, dtype = "<f8", chunk = 4096,
+               position = (0.0, 0.0, 0.0)):
+    """creates the file, every says how many steps pass between stored states"""
+    self.path = path
+    self.position = tuple(position)
+    self.links = links
+    self.time_step = time_step
+    self.every = every
+    self.dtype = numpy.dtype(dtype).str
+    self.layout = record_dtype(links, self.dtype)
+    self.chunk = chunk
+    self.count = 0
+    self.steps = 0
+    self.window = None
+    self.window_start = 0
+    with open(path, "wb") as output:
+      output.write(self.header())
+
+  def header(self):
+    header = HEADER.pack(MAGIC, VERSION, self.links, self.time_step, self.every, self.dtype.encode("ascii"),
+                         self.count, *self.position)
+    return header + b"\0" * (HEADER_SIZE - len(header))
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exception):
+    self.close()
+
+  def map_window(self):
+    """flushes the current window and maps the next chunk of records, growing the file"""
+    self.flush()
+    self.window = None
+    with open(self.path, "r+b") as output:
+      output.truncate(HEADER_SIZE + (self.count + self.chunk) * self.layout.itemsize)
+    self.window = numpy.memmap(self.path, dtype = self.layout, mode = "r+",
+                               offset = HEADER_SIZE + self.count * self.layout.itemsize, shape = (self.chunk,))
+    self.window_start = self.count
+
+  def write(self, time, theta, omega, tips):
+    """appends a single state"""
+    if self.window is None or self.count - self.window_start == self.chunk:
+      self.map_window()
+    self.window[self.count - self.window_start] = (time, theta, omega, tips)
+    self.count += 1
+
+  def sample(self, dynamics):
+    """appends the current state of a ChainDynamics"""
+    if dynamics.theta.shape != (self.links,):
+      raise ValueError("recorder expects a single chain of %d links" % self.links)
+    self.write(dynamics.time, dynamics.theta, dynamics.omega, dynamics.tips())
+
+  def record(self, dynamics):
+    """to be called after every step, appends every n-th state"""
+    self.steps += 1
+    if self.steps % self.every == 0:
+      self.sample(dynamics)
+
+  def flush(self):
+    """pushes mapped records to the file and updates the record count in the header"""
+    if self.window is not None:
+      self.window.flush()
+    with open(self.path, "r+b") as output:
+      output.write(self.header())
+
+  def close(self):
+    """flushes records and cuts the unused part of the last chunk"""
+    self.flush()
+    self.window = None
+    with open(self.path, "r+b") as output:
+      output.truncate(HEADER_SIZE + self.count * self.layout.itemsize)
+
+
+class TrajectoryFile(object):
+  """This class opens a recorded trajectory; records are memory mapped
+     read-only and exposed as time, theta, omega and tips arrays. Files
+     of older versions are read too."""
+
+  def __init__(self, path):
+    with open(path, "rb") as source:
+      data = source.read(HEADER_SIZE)
+    if len(data) < 12 or data[:8] != MAGIC:
+      raise ValueError("%s is not a pendulum trajectory" % path)
+    version = struct.unpack("<I", data[8:12])[0]
+    if version not in HEADERS:
+      raise ValueError("%s is a trajectory of unsupported version %d" % (path, version))
+    layout, size = HEADERS[version]
+    header = layout.unpack(data[:layout.size])
+    magic, version, links, time_step, every, dtype, count = header[:7]
+    self.path = path
+    self.links = links
+    self.time_step = time_step
+    self.every = every
+    self.position = header[7:] or (0.0, 0.0, 0.0)
+    self.dtype = dtype.rstrip(b"\0").decode("ascii")
+    record = record_dtype(links, self.dtype)
+    # a file cut by a crash holds fewer records than a stale header may say
+    count = min(count, (os.path.getsize(path) - size) // record.itemsize)
+    if count > 0:
+      self.records = numpy.memmap(path, dtype = record, mode = "r", offset = size, shape = (count,))
+    else:
+      self.records = numpy.zeros(0, dtype = record)
+
+  def __len__(self):
+    return len(self.records)
+
+  @property
+  def time(self):
+    return self.records["time"]
+
+  @property
+  def theta(self):
+    return self.records["theta"]
+
+  @property
+  def omega(self):
+    return self.records["omega"]
+
+  @property
+  def tips(self):
+    return self.records["tips"]
@@ -6,6 +6,7 @@ try:
   from OpenGL.GLU import *
   from pygame.locals import *
   from lib.objects3d import *
+  from lib.timestep import FixedTimestep
 except:
   print '''pendulum: simulation error: failed to load libraries'''
   sys.exit()
@@ -14,10 +15,17 @@ except:
 class SimulationRunner(threading.Thread):
 
   screen_size = (500, 500)
+  time_step = 1.0 / 60.0
+  seek_step = 10.0
   killed = False
 
-  def __init__(self, chain):
+  def __init__(self, chain, player = None, pendulum = None, speed = 600.0):
+    """runs a simulation of chain, or replays a recording when a TrajectoryPlayer is given, or
+       swings a FoucaultPendulum placed on the chain with its time sped up by speed"""
     self.chain = chain
+    self.player = player
+    self.pendulum = pendulum
+    self.speed = speed
     threading.Thread.__init__(self)
 
   # OpenGL window on_resize event handling
@@ -31,6 +39,8 @@ class SimulationRunner(threading.Thread):
 
   # OpenGL gaphics initialization
   def init_graphics(self):
+    # objects left by a previous window belong to its lost context
+    self.chain.release(current = False)
     pygame.init()
     screen = pygame.display.set_mode(self.screen_size, HWSURFACE|OPENGL|DOUBLEBUF)
     self.__resize(*self.screen_size)
@@ -45,31 +55,77 @@ class SimulationRunner(threading.Thread):
   def kill(self):
     self.killed = True
 
+  # playback keys: space pauses, +/- change speed, [ and ] seek, home rewinds
+  def control_playback(self, key):
+    player = self.player
+    if key == K_SPACE:
+      player.toggle()
+    elif key in (K_PLUS, K_EQUALS, K_KP_PLUS):
+      player.speed *= 2.0
+    elif key in (K_MINUS, K_KP_MINUS):
+      player.speed /= 2.0
+    elif key == K_RIGHTBRACKET:
+      player.seek(player.time + self.seek_step)
+    elif key == K_LEFTBRACKET:
+      player.seek(player.time - self.seek_step)
+    elif key == K_HOME:
+      player.seek(player.start)
+
+  # pendulum keys: +/- change speed of the Earth clock
+  def control_pendulum(self, key):
+    if key in (K_PLUS, K_EQUALS, K_KP_PLUS):
+      self.speed *= 2.0
+    elif key in (K_MINUS, K_KP_MINUS):
+      self.speed /= 2.0
+
   # thread body
   def run(self):
     self.init_graphics()
-    clock = pygame.time.Clock()
-    glMaterial(GL_FRONT, GL_AMBIENT, (0.1, 0.1, 0.1, 1.0))
-    glMaterial(GL_FRONT, GL_DIFFUSE, (1.0, 1.0, 1.0, 1.0))
-    camera = Camera(clock, 5.0)
-    while not self.killed:
-      for event in pygame.event.get():
-        if event.type == QUIT:
-          return
-      glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT);
-      pressed = pygame.key.get_pressed()
-      if pressed[K_LEFT]:
-        camera.rotate((0.0, -1.0, 0.0))
-      elif pressed[K_RIGHT]:
-        camera.rotate((0.0, +1.0, 0.0))
-      if pressed[K_UP]:
-        camera.rotate((-1.0, 0.0, 0.0))
-      elif pressed[K_DOWN]:
-        camera.rotate((+1.0, 0.0, 0.0))
-      if pressed[K_q]:
-        camera.move(-1.0)
-      elif pressed[K_a]:
-        camera.move(+1.0)
-      camera.rotate((0.0, 0.0, 0.0))
-      self.chain.render()
-      pygame.display.flip()
+    try:
+      clock = pygame.time.Clock()
+      glMaterial(GL_FRONT, GL_AMBIENT, (0.1, 0.1, 0.1, 1.0))
+      glMaterial(GL_FRONT, GL_DIFFUSE, (1.0, 1.0, 1.0, 1.0))
+      camera = Camera(5.0)
+      timestep = FixedTimestep(self.time_step)
+      while not self.killed:
+        frame_time = clock.tick() / 1000.0
+        for event in pygame.event.get():
+          if event.type == QUIT:
+            return
+          if event.type == KEYDOWN and self.player is not None:
+            self.control_playback(event.key)
+          elif event.type == KEYDOWN and self.pendulum is not None:
+            self.control_pendulum(event.key)
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT);
+        pressed = pygame.key.get_pressed()
+        if pressed[K_LEFT]:
+          camera.rotate((0.0, -1.0, 0.0), frame_time)
+        elif pressed[K_RIGHT]:
+          camera.rotate((0.0, +1.0, 0.0), frame_time)
+        if pressed[K_UP]:
+          camera.rotate((-1.0, 0.0, 0.0), frame_time)
+        elif pressed[K_DOWN]:
+          camera.rotate((+1.0, 0.0, 0.0), frame_time)
+        if pressed[K_q]:
+          camera.move(-1.0, frame_time)
+        elif pressed[K_a]:
+          camera.move(+1.0, frame_time)
+        camera.apply()
+        # rods added or removed in the GUI wait for the frame to finish
+        with self.chain.lock:
+          if self.pendulum is not None:
+            # long frames are averaged over whole swings, the plane turns visibly
+            self.pendulum.advance(frame_time * self.speed)
+            self.chain.place(self.pendulum.tips())
+          elif self.player is None:
+            for _ in range(timestep.advance(frame_time)):
+              self.chain.step(self.time_step)
+            self.chain.interpolate(timestep.alpha())
+          else:
+            self.player.advance(frame_time)
+            self.chain.place(self.player.state()[1])
+          self.chain.render()
+        pygame.display.flip()
+    finally:
+      # frees OpenGL objects of the chain while the window still exists
+      self.chain.release()
@@ -0,0 +1,225 @@
+import numpy
+from lib.dynamics import GRAVITY, _links
+from lib.integrators import RungeKutta4
+from lib.quaternion import quaternion_product, quaternion_rotate, quaternion_normalize, quaternion_between
+
+
+# direction of every link at rest, hanging straight down
+REST = numpy.array([0.0, -1.0, 0.0])
+
+
+def _components(vectors):
+  """returns x, y and z of per-link vectors as lists, links being the second to last axis"""
+  if vectors.ndim == 2:
+    return [vectors[:, 0].tolist(), vectors[:, 1].tolist(), vectors[:, 2].tolist()]
+  return [list(numpy.moveaxis(vectors[..., axis], -1, 0)) for axis in range(3)]
+
+
+def spherical_accelerations(directions, omega, lengths, masses, gravity = GRAVITY, parents = None):
+  """returns (..., N, 3) angular accelerations of links joined by spherical joints
+
+     Every link is a massless rod with a point mass at its tip, hinged at
+     the tip of its parent link (the pivot for parent -1, by default the
+     link above in a chain) and free to turn in any direction, so its rod
+     only pulls or pushes along itself. Parents have to come before their
+     children. The articulated-body recursion runs in O(N) for chains and
+     trees alike: the subtree below every mass, seen through its rod, is
+     a 3x3 articulated inertia of rank one and a bias force along the rod;
+     the inward pass adds those of all children to the mass and inverts
+     the 3x3 sum, the outward pass finds the rod forces and accelerations
+     of masses starting from the fixed pivot. Angular velocities are in
+     world axes and across the rods; angular accelerations come out
+     across them too. All arguments may carry leading batch axes."""
+  count = directions.shape[-2]
+  parents = range(-1, count - 1) if parents is None else [int(parent) for parent in parents]
+  dx, dy, dz = _components(directions)
+  across = numpy.cross(omega, directions)
+  # centripetal accelerations of masses relative to their hinges
+  spin = _links(-lengths * numpy.sum(across * across, axis = -1) * numpy.ones(directions.shape[:-1]))
+  m, l = _links(masses * numpy.ones(directions.shape[:-1])), _links(lengths * numpy.ones(directions.shape[:-1]))
+  wx, wy, wz, zx, zy, zz, s, e = [[None] * count for _ in range(8)]
+  # articulated inertias (axx, axy, axz, ayy, ayz, azz) and biases (bx, by, bz) start with masses and weights
+  axx, ayy, azz, by = list(m), list(m), list(m), [mk * gravity for mk in m]
+  axy, axz, ayz, bx, bz = [[0.0] * count for _ in range(5)]
+  # inward pass: rank one inertia (d d^T / s) and bias (e d) of the subtree below every rod
+  for k in range(count - 1, -1, -1):
+    # the symmetric 3x3 articulated inertia is inverted by cofactors
+    cxx, cxy, cxz = ayy[k] * azz[k] - ayz[k] * ayz[k], axz[k] * ayz[k] - axy[k] * azz[k], axy[k] * ayz[k] - axz[k] * ayy[k]
+    cyy, cyz, czz = axx[k] * azz[k] - axz[k] * axz[k], axy[k] * axz[k] - axx[k] * ayz[k], axx[k] * ayy[k] - axy[k] * axy[k]
+    inverse = 1.0 / (axx[k] * cxx + axy[k] * cxy + axz[k] * cxz)
+    wx[k] = inverse * (cxx * dx[k] + cxy * dy[k] + cxz * dz[k])
+    wy[k] = inverse * (cxy * dx[k] + cyy * dy[k] + cyz * dz[k])
+    wz[k] = inverse * (cxz * dx[k] + cyz * dy[k] + czz * dz[k])
+    zx[k] = inverse * (cxx * bx[k] + cxy * by[k] + cxz * bz[k])
+    zy[k] = inverse * (cxy * bx[k] + cyy * by[k] + cyz * bz[k])
+    zz[k] = inverse * (cxz * bx[k] + cyz * by[k] + czz * bz[k])
+    s[k] = dx[k] * wx[k] + dy[k] * wy[k] + dz[k] * wz[k]
+    e[k] = (spin[k] + dx[k] * zx[k] + dy[k] * zy[k] + dz[k] * zz[k]) / s[k]
+    j = parents[k]
+    if j >= 0:
+      c = 1.0 / s[k]
+      axx[j], axy[j], axz[j] = axx[j] + c * dx[k] * dx[k], axy[j] + c * dx[k] * dy[k], axz[j] + c * dx[k] * dz[k]
+      ayy[j], ayz[j], azz[j] = ayy[j] + c * dy[k] * dy[k], ayz[j] + c * dy[k] * dz[k], azz[j] + c * dz[k] * dz[k]
+      bx[j], by[j], bz[j] = bx[j] + e[k] * dx[k], by[j] + e[k] * dy[k], bz[j] + e[k] * dz[k]
+  # outward pass: rod forces and accelerations of masses starting from the fixed pivot
+  alpha, accelerations = [None] * count, [None] * count
+  for k in range(count):
+    j = parents[k]
+    px, py, pz = (0.0, 0.0, 0.0) if j < 0 else accelerations[j]
+    pull = (dx[k] * px + dy[k] * py + dz[k] * pz) / s[k] + e[k]
+    ax, ay, az = pull * wx[k] - zx[k], pull * wy[k] - zy[k], pull * wz[k] - zz[k]
+    # only the part of relative acceleration across the rod turns it
+    rx, ry, rz = (ax - px) / l[k], (ay - py) / l[k], (az - pz) / l[k]
+    alpha[k] = (dy[k] * rz - dz[k] * ry, dz[k] * rx - dx[k] * rz, dx[k] * ry - dy[k] * rx)
+    accelerations[k] = ax, ay, az
+  return numpy.moveaxis(numpy.array(alpha, dtype = float), (0, 1), (-2, -1))
+
+
+class SphericalChain(object):
+  """This class keeps the state of a chain of rods joined by spherical
+     joints, free to swing in three dimensions. Orientations of links
+     are an (N, 4) array of unit quaternions turning the downward rest
+     direction into the rod, angular velocities an (N, 3) array in world
+     axes; masses hang at rod tips. Forward kinematics of all links is a
+     single vectorized pass: every quaternion rotates the rest direction
+     at once and a cumulative sum places the tips.
+
+     Integrators of lib.integrators add velocities to angles, which does
+     not keep quaternions on the unit sphere, so steps are taken by RK4
+     with quaternions renormalized and angular velocities made
+     perpendicular to rods afterwards."""
+
+  parents = None
+
+  def __init__(self, lengths, orientations, masses = None, velocities = None,
+               position = (0.0, 0.0, 0.0), gravity = GRAVITY, integrator = None):
+    """sets up a chain from (N, 4) unit quaternions and optional (N, 3) angular velocities"""
+    self.lengths = numpy.array(lengths, dtype = float)
+    self.orientations = quaternion_normalize(orientations)
+    if masses is None:
+      masses = numpy.ones_like(self.lengths)
+    self.masses = numpy.array(masses, dtype = float)
+    if velocities is None:
+      velocities = numpy.zeros(self.lengths.shape + (3,))
+    self.omega = numpy.array(velocities, dtype = float)
+    if not (self.lengths.shape == self.masses.shape == self.orientations.shape[:-1] == self.omega.shape[:-1]):
+      raise ValueError("lengths, orientations, masses and velocities differ in size")
+    if numpy.any(self.masses <= 0.0) or numpy.any(self.lengths <= 0.0):
+      raise ValueError("links need a positive length and mass")
+    if integrator is not None and type(integrator) is not RungeKutta4:
+      raise ValueError("spherical chains take RK4 steps on quaternions only")
+    self.position = tuple(position)
+    self.gravity = gravity
+    self.integrator = integrator or RungeKutta4()
+    self.time = 0.0
+    self.steps = 0
+
+  @classmethod
+  def from_directions(cls, lengths, directions, masses = None, velocities = None, **kwargs):
+    """sets up a chain from (N, 3) unit vectors along rods"""
+    return cls(lengths, quaternion_between(REST, directions), masses, velocities, **kwargs)
+
+  @classmethod
+  def from_angles(cls, lengths, angles, masses = None, velocities = None, **kwargs):
+    """sets up a chain of a planar state, angles from the downward vertical turning about Z"""
+    angles = numpy.asarray(angles, dtype = float)
+    orientations = numpy.zeros(angles.shape + (4,))
+    orientations[..., 0], orientations[..., 3] = numpy.cos(0.5 * angles), numpy.sin(0.5 * angles)
+    omega = numpy.zeros(angles.shape + (3,))
+    if velocities is not None:
+      omega[..., 2] = velocities
+    return cls(lengths, orientations, masses, omega, **kwargs)
+
+  def __len__(self):
+    return len(self.lengths)
+
+  def directions(self, orientations = None):
+    """returns (N, 3) unit vectors along rods for given (or current) orientations"""
+    if orientations is None:
+      orientations = self.orientations
+    return quaternion_rotate(orientations, REST)
+
+  def accelerations(self, orientations = None, omega = None):
+    """returns angular accelerations for given (or current) state"""
+    if orientations is None:
+      orientations, omega = self.orientations, self.omega
+    return spherical_accelerations(self.directions(orientations), omega, self.lengths, self.masses, self.gravity,
+                                   self.parents)
+
+  def rates(self, orientations, omega):
+    """returns time derivatives of quaternions and angular velocities"""
+    orientations = quaternion_normalize(orientations)
+    turning = numpy.concatenate((numpy.zeros(omega.shape[:-1] + (1,)), omega), axis = -1)
+    return 0.5 * quaternion_product(turning, orientations), self.accelerations(orientations, omega)
+
+  def step(self, dt):
+    """advances the chain by dt"""
+    q, w = self.orientations, self.omega
+    k1q, k1w = self.rates(q, w)
+    k2q, k2w = self.rates(q + 0.5 * dt * k1q, w + 0.5 * dt * k1w)
+    k3q, k3w = self.rates(q + 0.5 * dt * k2q, w + 0.5 * dt * k2w)
+    k4q, k4w = self.rates(q + dt * k3q, w + dt * k3w)
+    self.orientations = quaternion_normalize(q + dt / 6.0 * (k1q + 2.0 * k2q + 2.0 * k3q + k4q))
+    omega = w + dt / 6.0 * (k1w + 2.0 * k2w + 2.0 * k3w + k4w)
+    directions = self.directions()
+    self.omega = omega - numpy.sum(omega * directions, axis = -1)[..., None] * directions
+    self.time += dt
+    self.steps += 1
+
+  def accumulate(self, offsets):
+    """returns sums of (N, 3) per-link offsets over every link and all links above it"""
+    return numpy.cumsum(offsets, axis = -2)
+
+  def tips(self, orientations = None):
+    """returns an (N, 3) array with positions of all rod tips for given (or current) orientations"""
+    return numpy.array(self.position) + self.accumulate(self.lengths[..., None] * self.directions(orientations))
+
+  def velocities(self):
+    """returns an (N, 3) array with velocities of all rod tips"""
+    across = numpy.cross(self.omega, self.directions())
+    return self.accumulate(self.lengths[..., None] * across)
+
+  def energy(self):
+    """returns total (kinetic and potential) energy of the chain"""
+    velocities = self.velocities()
+    height = self.tips()[..., 1] - self.position[1]
+    kinetic = 0.5 * self.masses * numpy.sum(velocities * velocities, axis = -1)
+    return numpy.sum(kinetic + self.gravity * self.masses * height, axis = -1)
+
+
+class SphericalTree(SphericalChain):
+  """This class is a SphericalChain whose links may branch: every link
+     hangs from the tip of the link given by a topologically sorted array
+     of parent indices, -1 standing for the pivot. Accelerations take the
+     same O(N) articulated-body passes over that array; tips are placed
+     one depth level at a time, all links of a level at once."""
+
+  def __init__(self, lengths, orientations, masses = None, velocities = None,
+               position = (0.0, 0.0, 0.0), gravity = GRAVITY, integrator = None, parents = None):
+    """sets up a tree of links hanging from given parents, a single chain by default"""
+    SphericalChain.__init__(self, lengths, orientations, masses, velocities, position, gravity, integrator)
+    count = len(self.lengths)
+    self.parents = numpy.arange(-1, count - 1) if parents is None else numpy.array(parents, dtype = int)
+    if self.lengths.ndim != 1 or self.parents.shape != self.lengths.shape:
+      raise ValueError("a tree needs a parent for every link")
+    if numpy.any(self.parents < -1) or numpy.any(self.parents >= numpy.arange(count)):
+      raise ValueError("parents have to come before their children")
+    depths = numpy.zeros(count, dtype = int)
+    for link, parent in enumerate(self.parents.tolist()):
+      if parent >= 0:
+        depths[link] = depths[parent] + 1
+    order = numpy.argsort(depths, kind = 'mergesort')
+    self.levels = numpy.split(order, numpy.cumsum(numpy.bincount(depths))[:-1])
+
+  def children(self, link):
+    """returns indices of links hanging from given link, or from the pivot for -1"""
+    return numpy.flatnonzero(self.parents == link)
+
+  def accumulate(self, offsets):
+    """returns sums of (N, 3) per-link offsets over every link and all its ancestors"""
+    totals = numpy.empty_like(offsets)
+    if len(self.levels[0]):
+      totals[self.levels[0]] = offsets[self.levels[0]]
+    for level in self.levels[1:]:
+      totals[level] = totals[self.parents[level]] + offsets[level]
+    return totals
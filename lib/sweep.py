@@ -0,0 +1,152 @@
+import os
+import math
+import random
+import itertools
+import multiprocessing
+import numpy
+from concurrent import futures
+from lib.ensemble import ChainEnsemble
+from lib.integrators import INTEGRATORS
+
+
+PARAMETERS = ("length", "angle", "mass")
+METRICS = ("max_excursion", "energy_drift", "flip_time")
+
+
+def parameter(name):
+  """returns (kind, rod index) of a parameter name like angle0 or length2"""
+  kind = name.rstrip("0123456789")
+  if kind not in PARAMETERS or kind == name:
+    raise ValueError("unknown parameter %s, expected one of %s followed by a rod number" % (name, ", ".join(PARAMETERS)))
+  return kind, int(name[len(kind):])
+
+
+def grid(axes):
+  """yields every combination of values given as a list of (name, values) pairs"""
+  names = [name for name, values in axes]
+  for combination in itertools.product(*[values for name, values in axes]):
+    yield dict(zip(names, combination))
+
+
+def random_sample(ranges, count, seed = 0):
+  """yields count cases with values drawn uniformly from (name, (low, high)) ranges"""
+  generator = random.Random(seed)
+  for _ in range(count):
+    yield dict((name, generator.uniform(low, high)) for name, (low, high) in ranges)
+
+
+def configure(base, values):
+  """returns rods (length, angle, mass) of base chain with parameter values applied"""
+  rods = [list(rod) + [1.0] * (3 - len(rod)) for rod in base]
+  for name, value in values.items():
+    kind, index = parameter(name)
+    rods[index][PARAMETERS.index(kind)] = value
+  return rods
+
+
+def run_shard(base, shard, duration, time_step, integrator):
+  """simulates a shard of (index, values) cases as one ensemble and returns result rows"""
+  rods = numpy.array([configure(base, values) for index, values in shard], dtype = float)
+  ensemble = ChainEnsemble(rods[:, :, 0], numpy.radians(rods[:, :, 1]), rods[:, :, 2],
+                           integrator = INTEGRATORS[integrator]())
+  # tips of the last rods when the chains hang straight down
+  rest = numpy.empty((len(shard), 2))
+  rest[:, 0] = ensemble.position[0]
+  rest[:, 1] = ensemble.position[1] - ensemble.lengths.sum(axis = 1)
+  energy = ensemble.energy()
+  excursion = numpy.zeros(len(shard))
+  drift = numpy.zeros(len(shard))
+  flip = numpy.full(len(shard), numpy.nan)
+  for _ in range(int(round(duration / time_step))):
+    ensemble.step(time_step)
+    tip = ensemble.tips()[:, -1, :2]
+    excursion = numpy.maximum(excursion, numpy.sqrt(numpy.sum((tip - rest) ** 2, axis = 1)))
+    drift = numpy.maximum(drift, abs(ensemble.energy() - energy))
+    flipped = numpy.isnan(flip) & numpy.any(abs(ensemble.theta) > math.pi, axis = 1)
+    flip[flipped] = ensemble.time
+  return [(index, values, (excursion[i], drift[i], flip[i])) for i, (index, values) in enumerate(shard)]
+
+
+class Sweep(object):
+  """This class runs many configurations of a chain in a pool of processes.
+     Cases are generated lazily, grouped into shards simulated as
+     ensembles, and at most a few shards per worker are in flight, so
+     memory does not depend on the number of cases. Every finished shard
+     is appended to a csv table right away; running a sweep again with
+     the same table skips cases that are already there."""
+
+  def __init__(self, base, names, cases, duration, time_step = 1.0 / 60.0,
+               integrator = "rk4", shard_size = 64, workers = None):
+    """prepares a sweep of cases (dicts of parameter values) around base rods (length, angle[, mass])"""
+    for name in names:
+      parameter(name)
+    self.base = [tuple(rod) for rod in base]
+    self.names = list(names)
+    self.cases = cases
+    self.duration = duration
+    self.time_step = time_step
+    self.integrator = integrator
+    self.shard_size = shard_size
+    self.workers = workers
+
+  def header(self):
+    return ",".join(["index"] + self.names + list(METRICS))
+
+  def finished(self, path):
+    """returns indices of cases already stored in the table, a row cut by an interrupted run is dropped"""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+      return set()
+    with open(path, "r+") as table:
+      if table.readline().strip() != self.header():
+        raise ValueError("%s holds results of a different sweep" % path)
+      done, complete = set(), table.tell()
+      for line in iter(table.readline, ""):
+        if not line.endswith("\n"):
+          break
+        done.add(int(line.split(",", 1)[0]))
+        complete = table.tell()
+      table.truncate(complete)
+    return done
+
+  def shards(self, done):
+    """yields shards of pending (index, values) cases"""
+    pending = ((index, values) for index, values in enumerate(self.cases) if index not in done)
+    while True:
+      shard = list(itertools.islice(pending, self.shard_size))
+      if not shard:
+        return
+      yield shard
+
+  def write(self, table, rows):
+    for index, values, metrics in rows:
+      table.write(",".join([str(index)] + [repr(float(values[name])) for name in self.names] +
+                           [repr(float(metric)) for metric in metrics]) + "\n")
+    table.flush()
+
+  def run(self, path):
+    """runs all pending cases and appends their metrics to the csv table at path"""
+    done = self.finished(path)
+    fresh = not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, "a") as table:
+      if fresh:
+        table.write(self.header() + "\n")
+      workers = self.workers or multiprocessing.cpu_count()
+      executor = futures.ProcessPoolExecutor(workers)
+      try:
+        limit = 2 * workers
+        running = set()
+        for shard in self.shards(done):
+          if len(running) >= limit:
+            finished, running = futures.wait(running, return_when = futures.FIRST_COMPLETED)
+            for future in finished:
+              self.write(table, future.result())
+          running.add(executor.submit(run_shard, self.base, shard, self.duration, self.time_step, self.integrator))
+        for future in futures.as_completed(running):
+          self.write(table, future.result())
+      finally:
+        executor.shutdown()
+
+
+def load_results(path):
+  """returns the table of a sweep as a numpy record array"""
+  return numpy.genfromtxt(path, delimiter = ",", names = True)
@@ -0,0 +1,22 @@
+
+class FixedTimestep(object):
+  """This class schedules physics steps of a fixed length independently of
+     frame rate. Frame times are accumulated and consumed in whole steps,
+     the remainder tells how far between two physics states a frame is."""
+
+  def __init__(self, time_step, max_frame_time = 0.25):
+    """sets up the scheduler, frames longer than max_frame_time are clamped"""
+    self.time_step = time_step
+    self.max_frame_time = max_frame_time
+    self.accumulator = 0.0
+
+  def advance(self, frame_time):
+    """adds time of a frame and returns number of physics steps to be done"""
+    self.accumulator += min(frame_time, self.max_frame_time)
+    steps = int(self.accumulator / self.time_step)
+    self.accumulator -= steps * self.time_step
+    return steps
+
+  def alpha(self):
+    """returns a fraction of a step that passed since the last physics state"""
+    return self.accumulator / self.time_step
@@ -5,9 +5,13 @@
 # by placek@ragnarson.com
 #
 import sys
+import math
 import itertools
 from lib.simulation import SimulationRunner
 from lib.objects3d import *
+from lib.recorder import TrajectoryFile
+from lib.playback import TrajectoryPlayer
+from lib.foucault import FoucaultPendulum
 from Tkinter import *
 
 class PendulumApp(Frame):
@@ -16,6 +20,7 @@ class PendulumApp(Frame):
     Frame.__init__(self, master)
     self.grid()
     self.chain = RodsChain()
+    self.recording = sys.argv[1] if len(sys.argv) > 1 else None
     self.create_widgets()
 
   def create_widgets(self):
@@ -48,18 +53,43 @@ class PendulumApp(Frame):
     for _ in itertools.repeat(None, 359):
       self.angle.invoke("buttonup")
     self.angle.grid()
+    self.azimuth_label = Label(self.left_frame, text = "azimuth", anchor = W)
+    self.azimuth_label.grid()
+    self.azimuth = Spinbox(self.left_frame, from_ = -180, to = 180, increment = 5, width = 5, wrap = True)
+    for _ in itertools.repeat(None, 36):
+      self.azimuth.invoke("buttonup")
+    self.azimuth.grid()
     self.length_label = Label(self.left_frame, text = "lenght", anchor = W)
     self.length_label.grid()
     self.length = Spinbox(self.left_frame, from_ = 0.1, to = 4, increment = 0.1, width = 5)
     for _ in itertools.repeat(None, 9):
       self.length.invoke("buttonup")
     self.length.grid()
+    self.stiffness_label = Label(self.left_frame, text = "stiffness", anchor = W)
+    self.stiffness_label.grid()
+    self.stiffness = Spinbox(self.left_frame, from_ = 10, to = 100000, increment = 10, width = 5)
+    self.stiffness.grid()
+    self.latitude_label = Label(self.left_frame, text = "latitude", anchor = W)
+    self.latitude_label.grid()
+    self.latitude = Spinbox(self.left_frame, from_ = -90, to = 90, increment = 5, width = 5)
+    for _ in itertools.repeat(None, 27):
+      self.latitude.invoke("buttonup")
+    self.latitude.grid()
+    self.physical = IntVar()
+    self.physical_check = Checkbutton(self.left_frame, text = "physical", variable = self.physical)
+    self.physical_check.grid()
     # add_rod_button
     self.add_rod_button = Button(self.left_frame, text = "add rod", command = self.add_rod)
     self.add_rod_button.grid()
+    # add_spring_button
+    self.add_spring_button = Button(self.left_frame, text = "add spring", command = self.add_spring)
+    self.add_spring_button.grid()
     # remove_rod_button
     self.remove_rod_button = Button(self.left_frame, text = "remove rod", command = self.remove_rod)
     self.remove_rod_button.grid()
+    # foucault_button
+    self.foucault_button = Button(self.left_frame, text = "foucault", command = self.foucault)
+    self.foucault_button.grid()
     # sumulation_button
     self.simulation_started = False
     self.simulation_button = Button(self.right_frame, text = "start", command = self.simulation)
@@ -77,7 +107,15 @@ class PendulumApp(Frame):
 
   def simulation(self):
     if self.simulation_started == False:
-      self.simulation_thread = SimulationRunner(self.chain)
+      chain, player = self.chain, None
+      # a recording given on the command line is replayed once, on a chain of its own
+      if self.recording is not None:
+        trajectory = TrajectoryFile(self.recording)
+        self.recording = None
+        chain = RodsChain(trajectory.position)
+        player = TrajectoryPlayer(trajectory)
+        player.play()
+      self.simulation_thread = SimulationRunner(chain, player)
       self.simulation_thread.start()
       self.simulation_button.configure(text = "stop")
       self.simulation_started = True
@@ -86,12 +124,36 @@ class PendulumApp(Frame):
       self.simulation_button.configure(text = "start")
       self.simulation_started = False
 
+  # a Foucault pendulum of the current length swings from the current angle on a chain of its own
+  def foucault(self):
+    if self.simulation_started:
+      self.simulation()
+      self.simulation_thread.join()
+    pendulum = FoucaultPendulum(float(self.length.get()), math.radians(float(self.latitude.get())),
+                                math.radians(float(self.angle.get())))
+    self.simulation_thread = SimulationRunner(RodsChain(), pendulum = pendulum)
+    self.simulation_thread.start()
+    self.simulation_button.configure(text = "stop")
+    self.simulation_started = True
+
   def add_rod(self):
-    self.chain.push(float(self.length.get()), float(self.angle.get()))
-    self.list_values.set(" ".join([n.to_string() for n in self.chain.rods]))
+    with self.chain.lock:
+      self.chain.push(float(self.length.get()), float(self.angle.get()), physical = bool(self.physical.get()),
+                      azimuth = float(self.azimuth.get()))
+      self.list_rods()
+
+  def add_spring(self):
+    with self.chain.lock:
+      self.chain.push_spring(float(self.length.get()), float(self.angle.get()), float(self.stiffness.get()))
+      self.list_rods()
 
   def remove_rod(self):
-    self.chain.pop()
+    with self.chain.lock:
+      self.chain.pop()
+      self.list_rods()
+
+  # rods are read under the chain lock, a running simulation moves them
+  def list_rods(self):
     self.list_values.set(" ".join([n.to_string() for n in self.chain.rods]))
 
 app = PendulumApp()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+#
+# Headless simulation of complex pendulum, no display needed.
+#
+# by placek@ragnarson.com
+#
+import argparse
+from lib.batch import BatchRunner, build_chain
+from lib.integrators import INTEGRATORS
+from lib.recorder import TrajectoryRecorder
+from lib.checkpoint import save_checkpoint, load_checkpoint
+
+
+def parse_arguments():
+  parser = argparse.ArgumentParser(description = "simulates a rods chain without graphics and writes its trajectory")
+  parser.add_argument("-r", "--rod", nargs = "+", type = float, action = "append",
+                      metavar = "VALUE", help = "rod given as LENGTH ANGLE [MASS], angle in degrees; repeat for every rod")
+  parser.add_argument("--dt", type = float, default = 1.0 / 60.0, help = "time step in seconds")
+  parser.add_argument("-i", "--integrator", choices = sorted(INTEGRATORS), default = "rk4", help = "integration scheme")
+  group = parser.add_mutually_exclusive_group(required = True)
+  group.add_argument("-n", "--steps", type = int, help = "number of steps to simulate")
+  group.add_argument("-t", "--duration", type = float, help = "simulated time in seconds")
+  parser.add_argument("-e", "--every", type = int, default = 1, help = "store every n-th state only")
+  parser.add_argument("-o", "--output", default = "trajectory.npz",
+                      help = "output file, .npz or .csv, or .traj streamed to disk for long runs")
+  parser.add_argument("--resume", metavar = "CHECKPOINT", help = "continue a run saved with --checkpoint instead of starting from rods")
+  parser.add_argument("--checkpoint", metavar = "CHECKPOINT", help = "save complete state at the end of the run")
+  arguments = parser.parse_args()
+  if (arguments.rod is None) == (arguments.resume is None):
+    parser.error("either rods or a checkpoint to resume has to be given")
+  for rod in arguments.rod or []:
+    if not 2 <= len(rod) <= 3:
+      parser.error("a rod needs LENGTH ANGLE and optionally MASS")
+  return arguments
+
+
+def main():
+  arguments = parse_arguments()
+  if arguments.resume:
+    dynamics = load_checkpoint(arguments.resume)
+  else:
+    dynamics = build_chain(arguments.rod, integrator = INTEGRATORS[arguments.integrator]())
+  runner = BatchRunner(dynamics, arguments.dt, arguments.steps,
+                       arguments.duration, arguments.every)
+  if arguments.output.endswith(".traj"):
+    with TrajectoryRecorder(arguments.output, len(dynamics), arguments.dt, arguments.every,
+                            position = dynamics.position) as recorder:
+      runner.stream(recorder)
+  else:
+    runner.run()
+    runner.save(arguments.output)
+  if arguments.checkpoint:
+    save_checkpoint(arguments.checkpoint, dynamics)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+#
+# Time-to-flip map of double pendulum.
+#
+# by placek@ragnarson.com
+#
+import argparse
+import numpy
+from lib.flipmap import flip_map
+from lib.integrators import INTEGRATORS
+
+
+def parse_arguments():
+  parser = argparse.ArgumentParser(description = "computes how long a double pendulum takes to flip for a grid of starting angles")
+  parser.add_argument("-n", "--size", type = int, default = 200, help = "number of angles along each axis")
+  parser.add_argument("-l", "--lengths", nargs = 2, type = float, default = [1.0, 1.0], help = "lengths of both rods")
+  parser.add_argument("-m", "--masses", nargs = 2, type = float, default = [1.0, 1.0], help = "masses of both rods")
+  parser.add_argument("-t", "--duration", type = float, default = 10.0, help = "simulated time in seconds")
+  parser.add_argument("--dt", type = float, default = 0.01, help = "time step in seconds")
+  parser.add_argument("-i", "--integrator", choices = sorted(INTEGRATORS), default = "rk4", help = "integration scheme")
+  parser.add_argument("-o", "--output", default = "flipmap.npy", help = "output file, .npy or .png")
+  return parser.parse_args()
+
+
+def save_image(times, duration, path):
+  """writes flip times as a grayscale image, quick flips are bright, cells that never flipped black"""
+  import pygame
+  shade = numpy.where(numpy.isnan(times), 0.0, 1.0 - numpy.log1p(numpy.nan_to_num(times)) / numpy.log1p(duration))
+  pixels = (255 * shade).astype(numpy.uint8)
+  pygame.image.save(pygame.surfarray.make_surface(numpy.dstack((pixels, pixels, pixels))), path)
+
+
+def main():
+  arguments = parse_arguments()
+  angles = numpy.linspace(-180.0, 180.0, arguments.size)
+  times = flip_map(angles, angles, arguments.lengths, arguments.masses, arguments.duration,
+                   arguments.dt, arguments.integrator)
+  if arguments.output.endswith(".png"):
+    save_image(times, arguments.duration, arguments.output)
+  else:
+    numpy.save(arguments.output, times)
+
+if __name__ == '__main__':
+  main()
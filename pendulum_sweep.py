@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+#
+# Parameter sweep over configurations of complex pendulum.
+#
+# by placek@ragnarson.com
+#
+import argparse
+import numpy
+from lib.sweep import Sweep, grid, random_sample
+from lib.integrators import INTEGRATORS
+
+
+def parse_range(text, parser):
+  try:
+    name, values = text.split("=")
+    return name, [float(value) for value in values.split(":")]
+  except ValueError:
+    parser.error("cannot parse %s" % text)
+
+
+def parse_arguments():
+  parser = argparse.ArgumentParser(description = "simulates many configurations of a rods chain in parallel and tabulates their metrics")
+  parser.add_argument("-r", "--rod", nargs = "+", type = float, action = "append", required = True,
+                      metavar = "VALUE", help = "base rod given as LENGTH ANGLE [MASS], angle in degrees; repeat for every rod")
+  parser.add_argument("--vary", action = "append", default = [], metavar = "NAME=START:STOP:COUNT",
+                      help = "grid axis over a parameter, e.g. angle0=-180:180:100")
+  parser.add_argument("--random", action = "append", default = [], metavar = "NAME=LOW:HIGH",
+                      help = "range of a randomly sampled parameter, e.g. length1=0.5:2")
+  parser.add_argument("--samples", type = int, default = 1000, help = "number of random cases")
+  parser.add_argument("--seed", type = int, default = 0, help = "seed of random sampling")
+  parser.add_argument("-t", "--duration", type = float, required = True, help = "simulated time in seconds")
+  parser.add_argument("--dt", type = float, default = 1.0 / 60.0, help = "time step in seconds")
+  parser.add_argument("-i", "--integrator", choices = sorted(INTEGRATORS), default = "rk4", help = "integration scheme")
+  parser.add_argument("-j", "--workers", type = int, help = "number of processes, all cores by default")
+  parser.add_argument("--shard-size", type = int, default = 64, help = "cases simulated together by one process")
+  parser.add_argument("-o", "--output", default = "sweep.csv", help = "csv table, an existing one is resumed")
+  arguments = parser.parse_args()
+  if bool(arguments.vary) == bool(arguments.random):
+    parser.error("give either --vary or --random axes")
+  arguments.vary = [parse_range(text, parser) for text in arguments.vary]
+  arguments.random = [parse_range(text, parser) for text in arguments.random]
+  for name, values in arguments.vary:
+    if len(values) != 3:
+      parser.error("%s needs START:STOP:COUNT" % name)
+  for name, values in arguments.random:
+    if len(values) != 2:
+      parser.error("%s needs LOW:HIGH" % name)
+  return arguments
+
+
+def main():
+  arguments = parse_arguments()
+  if arguments.vary:
+    names = [name for name, values in arguments.vary]
+    cases = grid([(name, numpy.linspace(start, stop, int(count)).tolist()) for name, (start, stop, count) in arguments.vary])
+  else:
+    names = [name for name, values in arguments.random]
+    cases = random_sample(arguments.random, arguments.samples, arguments.seed)
+  sweep = Sweep(arguments.rod, names, cases, arguments.duration, arguments.dt,
+                arguments.integrator, arguments.shard_size, arguments.workers)
+  sweep.run(arguments.output)
+
+if __name__ == '__main__':
+  main()
@@ -1,13 +1,34 @@
 import unittest
 import pygame
 import math
+import numpy
 from lib.objects3d import *
+from lib.dynamics import *
+from lib.batch import *
+from lib.timestep import *
+from lib.quaternion import *
+from lib.integrators import *
+from lib.integrators import _solve_tridiagonal
+from lib.ensemble import *
+from lib.sweep import *
+from lib.flipmap import *
+from lib.recorder import *
+from lib.playback import *
+from lib.checkpoint import *
+from lib.elastic import *
+from lib.modes import *
+from lib.foucault import *
+from lib.spherical import *
+import random
+import os
+import tempfile
+import struct
+import threading
 
 class TestCamera(unittest.TestCase):
 
   def setUp(self):
-    clock = pygame.time.Clock()
-    self.camera = Camera(clock, 5.0)
+    self.camera = Camera(5.0)
 
   def test_instance_variables(self):
     self.assertEqual(self.camera.distance, 5.0)
@@ -15,6 +36,69 @@ class TestCamera(unittest.TestCase):
     self.assertEqual(self.camera.rotation_speed, radians(90.0))
     self.assertEqual(self.camera.move_speed, 3.0)
 
+  def test_view_matrix_is_inverse_of_placement(self):
+    self.camera.rotate((0.0, 1.0, 0.0), 0.5)
+    self.assertTrue(self.camera.dirty)
+    product = self.camera.camera_matrix * self.camera.view_matrix()
+    for got, expected in zip(product.to_opengl(), Matrix44.identity().to_opengl()):
+      self.assertAlmostEqual(got, expected)
+
+  def test_rotation_matches_matrix_rotation(self):
+    expected = Matrix44()
+    expected.translate = (0.0, 0.0, 5.0)
+    for direction in ((0.0, 1.0, 0.0), (-1.0, 0.0, 0.0), (0.0, 1.0, 0.0)):
+      self.camera.rotate(direction, 0.3)
+      expected *= Matrix44.xyz_rotation(*(Vector3(direction) * self.camera.rotation_speed * 0.3))
+      expected.translate = Vector3(expected.forward).unit() * 5.0
+    for got, value in zip(self.camera.camera_matrix.to_opengl(), expected.to_opengl()):
+      self.assertAlmostEqual(got, value)
+
+  def test_orientation_stays_orthonormal(self):
+    for _ in range(10000):
+      self.camera.rotate((1.0, 1.0, 0.0), 0.0123)
+    matrix = self.camera.camera_matrix
+    for i, j in ((0, 0), (1, 1), (2, 2), (0, 1), (1, 2), (0, 2)):
+      dot = Vector3(matrix.get_row(i)).dot(Vector3(matrix.get_row(j)))
+      self.assertAlmostEqual(dot, 1.0 if i == j else 0.0, 12)
+
+  def test_move_keeps_distance_within_limits(self):
+    self.camera.move(10.0, 1.0)
+    self.assertEqual(self.camera.distance, 8.0)
+    self.assertAlmostEqual(Vector3(self.camera.camera_matrix.translate).length, 8.0)
+
+
+class TestQuaternion(unittest.TestCase):
+
+  def test_rotates_like_matrix(self):
+    quaternion = Quaternion.from_axis_angle((0.0, 0.0, 1.0), 0.3)
+    for got, expected in zip(quaternion.rotate((1.0, 2.0, 3.0)), Matrix44.z_rotation(0.3).transform((1.0, 2.0, 3.0))):
+      self.assertAlmostEqual(got, expected)
+    for got, expected in zip(quaternion.to_matrix44().to_opengl(), Matrix44.z_rotation(0.3).to_opengl()):
+      self.assertAlmostEqual(got, expected)
+
+  def test_composition_and_normalization(self):
+    a = Quaternion.from_axis_angle((1.0, 0.0, 0.0), 0.4)
+    b = Quaternion.from_axis_angle((0.0, 1.0, 0.0), 0.7)
+    product = Matrix44.x_rotation(0.4) * Matrix44.y_rotation(0.7)
+    for got, expected in zip((a * b).to_matrix44().to_opengl(), product.to_opengl()):
+      self.assertAlmostEqual(got, expected)
+    self.assertAlmostEqual(Quaternion(2.0, 0.0, 0.0, 0.0).normalize().w, 1.0)
+
+  def test_arrays_of_quaternions_match_scalar_ones(self):
+    axes, angles = numpy.random.RandomState(3).randn(5, 3), numpy.linspace(-3.0, 3.0, 5)
+    scalar = [Quaternion.from_axis_angle(axis, angle) for axis, angle in zip(axes, angles)]
+    array = numpy.array([(q.w, q.x, q.y, q.z) for q in scalar])
+    numpy.testing.assert_allclose(quaternion_rotate(array, (1.0, 2.0, 3.0)), [q.rotate((1.0, 2.0, 3.0)) for q in scalar])
+    products = [scalar[0] * q for q in scalar]
+    numpy.testing.assert_allclose(quaternion_product(array[0], array), [(q.w, q.x, q.y, q.z) for q in products])
+    normalized = axes / numpy.sqrt(numpy.sum(axes * axes, axis = 1))[:, None]
+    numpy.testing.assert_allclose(quaternion_from_rotations(normalized * angles[:, None]), array)
+
+  def test_quaternions_between_vectors(self):
+    start = numpy.array([[0.0, -1.0, 0.0]] * 3)
+    end = numpy.array([[0.6, -0.8, 0.0], [0.0, 0.0, 1.0], [0.0, 1.0, 0.0]])
+    numpy.testing.assert_allclose(quaternion_rotate(quaternion_between(start, end), start), end, atol = 1e-12)
+
 
 class TestRod(unittest.TestCase):
 
@@ -43,6 +127,27 @@ class TestRod(unittest.TestCase):
     self.assertEqual(math.degrees(self.rod1.angle()), -90.0)
     self.assertEqual(math.degrees(self.rod2.angle()), 90.0)
 
+  def test_moving_tip_updates_length_and_angle(self):
+    self.rod2.tip = (0.0, -2.0, 0.0)
+    self.assertEqual(self.rod2.length(), 2.0)
+    self.assertEqual(self.rod2.angle(), 0.0)
+
+  def test_derived_geometry_is_cached_until_rod_moves(self):
+    self.assertEqual(self.rod1.direction(), (-1.0, 0.0, 0.0))
+    self.assertEqual(self.rod1.degrees(), -90.0)
+    self.assertFalse(self.rod1.buffer.any_stale)
+    self.rod1.position = (-1.0, 1.0, 0.0)
+    self.assertTrue(self.rod1.buffer.any_stale)
+    self.assertEqual(self.rod1.direction(), (0.0, -1.0, 0.0))
+    self.assertEqual(self.rod1.degrees(), 0.0)
+
+  def test_instance_tilt_method(self):
+    self.assertEqual(self.rod2.tilt(), 0.0)
+    self.assertAlmostEqual(self.rod.tilt(), math.asin(-3.0 / math.sqrt(14.0)))
+
+  def test_rod_is_a_slotted_view(self):
+    self.assertFalse(hasattr(self.rod, '__dict__'))
+
 
 
 class TestRodsChain(unittest.TestCase):
@@ -69,6 +174,923 @@ class TestRodsChain(unittest.TestCase):
     self.assertAlmostEqual(self.chain.rods[2].tip[0], 3.0)
     self.assertAlmostEqual(self.chain.rods[2].tip[1], 0.0)
 
+  def test_bulk_queries_read_buffers(self):
+    self.assertEqual(self.chain.tips().shape, (3, 3))
+    numpy.testing.assert_allclose(self.chain.positions()[1:], self.chain.tips()[:-1])
+    numpy.testing.assert_allclose(self.chain.lengths(), [math.sqrt(2), 1.0, 2.0])
+    numpy.testing.assert_allclose(self.chain.angles(), numpy.radians([45.0, 180.0, 90.0]))
+
+  def test_buffer_grows_and_pops(self):
+    for _ in range(40):
+      self.chain.push(1.0, 0.0)
+    self.assertEqual(len(self.chain.rods), 43)
+    self.assertAlmostEqual(self.chain.rods[-1].tip[1], -40.0)
+    rod = self.chain.pop()
+    self.assertEqual(len(self.chain.rods), 42)
+    self.assertAlmostEqual(rod.tip[1], -40.0)
+
+  def test_mesh_is_rebuilt_only_after_changes(self):
+    self.assertTrue(self.chain.mesh.update())
+    self.assertFalse(self.chain.mesh.update())
+    vertices = self.chain.mesh.vertices
+    self.assertEqual(vertices.shape, (3 * 16, 9))
+    # the far corners of the front face of the last rod surround its tip
+    tip = (vertices[16 * 2 + 2, :3] + vertices[16 * 2 + 3, :3]) / 2.0
+    numpy.testing.assert_allclose(tip, [3.0, 0.0, 0.03], atol = 1e-6)
+    self.chain.step(0.01)
+    self.chain.interpolate()
+    self.assertTrue(self.chain.mesh.update())
+
+  def test_rods_change_safely_while_simulating(self):
+    errors = []
+    def simulate():
+      try:
+        for _ in range(300):
+          self.chain.step(0.001)
+          self.chain.interpolate(0.5)
+      except Exception as exception:
+        errors.append(exception)
+    runner = threading.Thread(target = simulate)
+    runner.start()
+    for _ in range(100):
+      self.chain.push(1.0, 10.0)
+      self.chain.pop()
+    runner.join()
+    self.assertEqual(errors, [])
+    self.assertEqual(len(self.chain.rods), 3)
+
+  def test_release_forgets_objects_of_lost_contexts(self):
+    self.chain.mesh.vbo = object()
+    self.chain.instances.program, self.chain.instances.available = 3, True
+    self.chain.release(current = False)
+    self.assertIsNone(self.chain.mesh.vbo)
+    self.assertEqual((self.chain.instances.program, self.chain.instances.available), (None, None))
+
+  def test_instance_data_describes_every_rod(self):
+    self.assertTrue(self.chain.instances.update())
+    self.assertFalse(self.chain.instances.update())
+    instances = self.chain.instances.instances
+    self.assertEqual(instances.shape, (3, 9))
+    numpy.testing.assert_allclose(instances[1], [1.0, -1.0, 0.0, math.pi, 1.0, 1.0, 0.0, 0.0, 0.0], atol = 1e-6)
+
+  def test_springs_are_left_out_of_boxes(self):
+    self.chain.instances.update()
+    self.chain.push_spring(1.0, 0.0, 100.0)
+    self.assertTrue(self.chain.instances.update())
+    self.assertEqual(self.chain.instances.instances.shape, (3, 9))
+    self.assertEqual(self.chain.mesh.build().shape, (3 * 16, 9))
+    self.assertEqual(self.chain.buffer.rods().tolist(), [0, 1, 2])
+
+  def test_instances_gather_many_chains(self):
+    other = RodsChain((1.0, 0.0, 0.0))
+    other.push(1.0, 0.0)
+    instances = RodsInstances(self.chain.buffer, other.buffer)
+    instances.update()
+    self.assertEqual(instances.instances.shape, (4, 9))
+    numpy.testing.assert_allclose(instances.instances[3, :3], [1.0, 0.0, 0.0])
+
+  def test_interpolate_moves_rods_between_states(self):
+    self.chain.step(0.01)
+    self.chain.interpolate(0.0)
+    self.assertAlmostEqual(self.chain.rods[2].tip[0], 3.0)
+    self.chain.interpolate(1.0)
+    tips = self.chain.dynamics.tips()
+    self.assertAlmostEqual(self.chain.rods[1].position[0], tips[0][0])
+    self.assertAlmostEqual(self.chain.rods[2].tip[1], tips[2][1])
+    self.assertAlmostEqual(self.chain.rods[0].length(), math.sqrt(2))
+
+  def test_rods_out_of_plane_swing_in_three_dimensions(self):
+    chain = RodsChain()
+    chain.push(1.0, 30.0, azimuth = 90.0)
+    chain.push(1.0, 45.0)
+    numpy.testing.assert_allclose(chain.tips()[0], [0.0, -math.cos(math.radians(30.0)), -0.5], atol = 1e-12)
+    self.assertAlmostEqual(chain.rods[0].tilt(), math.radians(30.0))
+    # the tip of a tilted box lies on the rod
+    vertices = chain.mesh.build()
+    numpy.testing.assert_allclose((vertices[2, :3] + vertices[3, :3] + vertices[10, :3] + vertices[11, :3]) / 4.0,
+                                  chain.tips()[0], atol = 1e-6)
+    self.assertRaises(ValueError, chain.normal_modes)
+    chain.step(0.01)
+    self.assertIsInstance(chain.dynamics, SphericalChain)
+    chain.interpolate(0.5)
+    numpy.testing.assert_allclose(chain.lengths(), [1.0, 1.0])
+    self.assertTrue(chain.tips()[1, 2] < 0.0)
+
+
+class TestSphericalChain(unittest.TestCase):
+
+  def test_planar_states_match_chain_dynamics(self):
+    lengths, masses = [1.0, 0.7, 1.3], [1.0, 2.0, 0.5]
+    planar = ChainDynamics(lengths, [0.3, -0.5, 1.1], masses, [0.2, 0.7, -0.4])
+    spherical = SphericalChain.from_angles(lengths, [0.3, -0.5, 1.1], masses, [0.2, 0.7, -0.4])
+    numpy.testing.assert_allclose(spherical.accelerations()[:, 2], planar.accelerations())
+    numpy.testing.assert_allclose(spherical.tips(), planar.tips(), atol = 1e-12)
+    for _ in range(100):
+      planar.step(0.001)
+      spherical.step(0.001)
+    numpy.testing.assert_allclose(spherical.tips(), planar.tips(), atol = 1e-10)
+
+  def test_accelerations_broadcast_over_batches(self):
+    chain = SphericalChain.from_directions([1.0, 2.0], [[0.6, -0.8, 0.0], [0.0, -0.6, 0.8]],
+                                           velocities = [[0.0, 0.0, 1.0], [1.0, 0.0, 0.0]])
+    directions = numpy.array([chain.directions()] * 2)
+    batched = spherical_accelerations(directions, numpy.array([chain.omega] * 2), chain.lengths, chain.masses)
+    numpy.testing.assert_allclose(batched, [chain.accelerations()] * 2)
+
+  def test_conical_pendulum_keeps_circling(self):
+    # a mass circling at angle a from the vertical needs squared rate g / (l cos a)
+    rate = math.sqrt(GRAVITY / math.cos(0.5))
+    chain = SphericalChain.from_angles([1.0], [0.5])
+    # turning about the vertical, only the part across the rod is kept
+    chain.omega = rate * math.sin(0.5) * numpy.array([[math.cos(0.5), math.sin(0.5), 0.0]])
+    for _ in range(1000):
+      chain.step(0.001)
+    self.assertAlmostEqual(chain.tips()[0, 1], -math.cos(0.5), places = 8)
+    self.assertAlmostEqual(numpy.linalg.norm(chain.tips()[0, [0, 2]]), math.sin(0.5), places = 8)
+
+  def test_conserves_energy_and_lengths(self):
+    directions = numpy.random.RandomState(1).randn(5, 3)
+    directions /= numpy.sqrt(numpy.sum(directions * directions, axis = 1))[:, None]
+    chain = SphericalChain.from_directions(numpy.ones(5), directions, numpy.linspace(0.5, 1.5, 5))
+    energy = chain.energy()
+    for _ in range(1000):
+      chain.step(0.001)
+    self.assertAlmostEqual(chain.energy(), energy, 5)
+    numpy.testing.assert_allclose(numpy.sum(chain.omega * chain.directions(), axis = 1), 0.0, atol = 1e-12)
+    links = numpy.diff(numpy.vstack((numpy.zeros(3), chain.tips())), axis = 0)
+    numpy.testing.assert_allclose(numpy.sqrt(numpy.sum(links * links, axis = 1)), 1.0)
+
+  def test_takes_only_its_own_steps(self):
+    self.assertRaises(ValueError, SphericalChain.from_angles, [1.0], [0.0], integrator = ImplicitMidpoint())
+
+
+class TestSphericalTree(unittest.TestCase):
+
+  def dense_accelerations(self, tips, velocities, lengths, masses, parents):
+    # masses constrained by rod lengths: M a = weights + J^T tensions, J a = -|relative velocity|^2
+    count = len(lengths)
+    starts = numpy.array([tips[parent] if parent >= 0 else numpy.zeros(3) for parent in parents])
+    hinges = numpy.array([velocities[parent] if parent >= 0 else numpy.zeros(3) for parent in parents])
+    system = numpy.zeros((4 * count, 4 * count))
+    values = numpy.zeros(4 * count)
+    for k, parent in enumerate(parents):
+      system[3 * k:3 * k + 3, 3 * k:3 * k + 3] = masses[k] * numpy.eye(3)
+      values[3 * k + 1] = -masses[k] * GRAVITY
+      rod = tips[k] - starts[k]
+      system[3 * count + k, 3 * k:3 * k + 3] = rod
+      system[3 * k:3 * k + 3, 3 * count + k] = -rod
+      if parent >= 0:
+        system[3 * count + k, 3 * parent:3 * parent + 3] = -rod
+        system[3 * parent:3 * parent + 3, 3 * count + k] = rod
+      relative = velocities[k] - hinges[k]
+      values[3 * count + k] = -numpy.dot(relative, relative)
+    accelerations = numpy.linalg.solve(system, values)[:3 * count].reshape(count, 3)
+    pivots = numpy.array([accelerations[parent] if parent >= 0 else numpy.zeros(3) for parent in parents])
+    return numpy.cross(tips - starts, accelerations - pivots) / (lengths * lengths)[:, None]
+
+  def random_tree(self, count, seed):
+    generator = numpy.random.RandomState(seed)
+    parents = [-1] + [generator.randint(-1, k) for k in range(1, count)]
+    directions = generator.randn(count, 3)
+    directions /= numpy.sqrt(numpy.sum(directions * directions, axis = 1))[:, None]
+    velocities = numpy.cross(directions, generator.randn(count, 3))
+    return SphericalTree.from_directions(generator.uniform(0.5, 1.5, count), directions,
+                                         generator.uniform(0.5, 2.0, count), velocities, parents = parents)
+
+  def test_accelerations_match_dense_constraints(self):
+    tree = self.random_tree(12, 5)
+    dense = self.dense_accelerations(tree.tips(), tree.velocities(), tree.lengths, tree.masses, tree.parents)
+    numpy.testing.assert_allclose(tree.accelerations(), dense, atol = 1e-9)
+
+  def test_single_branch_is_a_chain(self):
+    tree = SphericalTree.from_angles([1.0, 0.7, 1.3], [0.3, -0.5, 1.1], velocities = [0.2, 0.7, -0.4])
+    chain = SphericalChain.from_angles([1.0, 0.7, 1.3], [0.3, -0.5, 1.1], velocities = [0.2, 0.7, -0.4])
+    numpy.testing.assert_array_equal(tree.parents, [-1, 0, 1])
+    numpy.testing.assert_allclose(tree.accelerations(), chain.accelerations())
+    numpy.testing.assert_allclose(tree.tips(), chain.tips())
+
+  def test_conserves_energy_of_large_mobiles(self):
+    tree = self.random_tree(300, 7)
+    self.assertEqual(len(tree.levels[0]), len(tree.children(-1)))
+    energy = tree.energy()
+    for _ in range(20):
+      tree.step(0.0005)
+    self.assertAlmostEqual(tree.energy() / energy, 1.0, 6)
+    links = tree.tips() - numpy.where(tree.parents[:, None] < 0, 0.0, tree.tips()[tree.parents])
+    numpy.testing.assert_allclose(numpy.sqrt(numpy.sum(links * links, axis = 1)), tree.lengths)
+
+  def test_rejects_parents_after_children(self):
+    self.assertRaises(ValueError, SphericalTree.from_angles, [1.0, 1.0], [0.0, 0.0], parents = [1, -1])
+
+
+class TestRodsTree(unittest.TestCase):
+
+  def setUp(self):
+    self.tree = RodsTree()
+    self.tree.push(1.0, 0.0)
+    self.tree.push(1.0, 45.0, parent = 0)
+    self.tree.push(1.0, -45.0, parent = 0)
+    self.tree.push(0.5, 0.0, azimuth = 90.0, parent = 2)
+
+  def test_rods_hang_from_their_parents(self):
+    self.assertEqual(self.tree.parents, [-1, 0, 0, 2])
+    self.assertEqual(self.tree.children(0), [1, 2])
+    numpy.testing.assert_allclose(self.tree.positions()[1], self.tree.tips()[0])
+    numpy.testing.assert_allclose(self.tree.positions()[3], self.tree.tips()[2])
+    self.assertRaises(IndexError, self.tree.push, 1.0, 0.0, parent = 4)
+    self.assertRaises(ValueError, self.tree.push, 1.0, 0.0, physical = True)
+    index = self.tree.push(1.0, 30.0, 2.0)
+    self.assertEqual((self.tree.masses()[index], self.tree.parents[index]), (2.0, -1))
+    self.assertRaises(ValueError, self.tree.push_spring, 1.0, 0.0, 100.0)
+
+  def test_symmetric_arms_swing_as_mirror_images(self):
+    tree = RodsTree()
+    tree.push(1.0, 0.0)
+    tree.push(1.0, 60.0, parent = 0)
+    tree.push(1.0, -60.0, parent = 0)
+    for _ in range(100):
+      tree.step(0.005)
+    tree.interpolate()
+    tips = tree.tips()
+    self.assertAlmostEqual(tips[0, 0], 0.0)
+    numpy.testing.assert_allclose(tips[1] * [-1.0, 1.0, 1.0], tips[2], atol = 1e-12)
+
+  def test_interpolate_keeps_rods_on_their_parents(self):
+    self.tree.step(0.01)
+    self.assertIsInstance(self.tree.dynamics, SphericalTree)
+    self.tree.interpolate(0.5)
+    numpy.testing.assert_allclose(self.tree.positions()[3], self.tree.tips()[2])
+    numpy.testing.assert_allclose(self.tree.lengths(), [1.0, 1.0, 1.0, 0.5])
+    rod = self.tree.pop()
+    self.assertEqual(self.tree.parents, [-1, 0, 0])
+    self.assertAlmostEqual(rod.length(), 0.5)
+
+
+class TestChainDynamics(unittest.TestCase):
+
+  def dense_accelerations(self, theta, omega, lengths, masses):
+    below = numpy.cumsum(masses[::-1])[::-1]
+    outer = numpy.outer(lengths, lengths) * below[numpy.maximum.outer(range(len(theta)), range(len(theta)))]
+    difference = numpy.subtract.outer(theta, theta)
+    rhs = -numpy.dot(outer * numpy.sin(difference), omega * omega) - GRAVITY * lengths * below * numpy.sin(theta)
+    return numpy.linalg.solve(outer * numpy.cos(difference), rhs)
+
+  def test_accelerations_match_dense_mass_matrix(self):
+    random = numpy.random.RandomState(0)
+    theta, omega = random.randn(6), random.randn(6)
+    lengths, masses = random.rand(6) + 0.5, random.rand(6) + 0.5
+    expected = self.dense_accelerations(theta, omega, lengths, masses)
+    numpy.testing.assert_allclose(chain_accelerations(theta, omega, lengths, masses), expected)
+
+  def test_accelerations_broadcast_over_batches(self):
+    theta = numpy.array([[0.1, 0.2], [0.3, -0.4]])
+    omega = numpy.array([[0.0, 1.0], [2.0, 0.5]])
+    lengths, masses = numpy.array([1.0, 2.0]), numpy.array([1.0, 0.5])
+    batch = chain_accelerations(theta, omega, lengths, masses)
+    for i in range(2):
+      numpy.testing.assert_allclose(batch[i], chain_accelerations(theta[i], omega[i], lengths, masses))
+
+  def test_single_pendulum_swings_with_harmonic_period(self):
+    dynamics = ChainDynamics([1.0], [0.01])
+    period = 2.0 * math.pi * math.sqrt(1.0 / GRAVITY)
+    for _ in range(1000):
+      dynamics.step(period / 1000)
+    self.assertAlmostEqual(dynamics.theta[0], 0.01, 6)
+
+  def test_energy_is_conserved(self):
+    dynamics = ChainDynamics([1.0, 0.5, 1.5], [2.0, -1.0, 0.5], [1.0, 2.0, 0.5])
+    energy = dynamics.energy()
+    for _ in range(1000):
+      dynamics.step(0.001)
+    self.assertAlmostEqual(dynamics.energy(), energy, 5)
+
+  def test_rejects_massless_links(self):
+    self.assertRaises(ValueError, ChainDynamics, [1.0], [0.0], [0.0])
+
+
+class TestPhysicalPendulum(unittest.TestCase):
+
+  def setUp(self):
+    self.dynamics = ChainDynamics([1.0, 0.8, 1.2], [0.4, 1.5, -0.7], [1.0, 2.0, 0.5], [0.3, -0.2, 0.5],
+                                  offsets = [0.5, 0.2, 1.2], inertias = [0.1, 0.3, 0.0])
+
+  def test_momenta_change_with_forces(self):
+    dynamics, dt = self.dynamics, 1e-6
+    theta, omega, alpha = dynamics.theta, dynamics.omega, dynamics.accelerations()
+    change = (dynamics.momenta(theta + omega * dt, omega + alpha * dt) -
+              dynamics.momenta(theta - omega * dt, omega - alpha * dt)) / (2.0 * dt)
+    numpy.testing.assert_allclose(change, dynamics.forces(theta, omega), atol = 1e-6)
+    numpy.testing.assert_allclose(dynamics.velocities(theta, dynamics.momenta(theta, omega)), omega)
+
+  def test_conserves_energy(self):
+    energy = self.dynamics.energy()
+    for _ in range(500):
+      self.dynamics.step(0.002)
+    self.assertAlmostEqual(self.dynamics.energy(), energy, places = 6)
+
+  def test_period_of_uniform_bar(self):
+    chain = RodsChain()
+    chain.push(2.0, 0.0, 3.0, physical = True)
+    bar = chain.rods[0]
+    self.assertTrue(bar.physical)
+    self.assertAlmostEqual(bar.offset(), 1.0)
+    self.assertAlmostEqual(bar.inertia(), 3.0 * (4.0 + 4.0 * bar.thickness ** 2) / 12.0)
+    # T = 2 pi sqrt(I / (m g d)) about the pivot
+    pivot = bar.inertia() + 3.0 * 1.0 ** 2
+    period = 2.0 * math.pi / chain.normal_modes().frequencies[0]
+    self.assertAlmostEqual(period, 2.0 * math.pi * math.sqrt(pivot / (3.0 * 9.81 * 1.0)))
+    chain.step(0.01)
+    numpy.testing.assert_allclose(chain.dynamics.offsets, [1.0])
+    self.assertRaises(ValueError, chain.dynamics.cartesian, chain.dynamics.theta, chain.dynamics.omega)
+    self.assertTrue(chain.pop().physical)
+
+  def test_point_masses_by_default(self):
+    rigid = ChainDynamics([1.0, 0.8, 1.2], [0.4, 1.5, -0.7], [1.0, 2.0, 0.5], [0.3, -0.2, 0.5])
+    self.assertTrue(rigid.point_masses)
+    numpy.testing.assert_allclose(rigid.accelerations(),
+                                  chain_accelerations(rigid.theta, rigid.omega, rigid.lengths, rigid.masses))
+    self.assertFalse(self.dynamics.point_masses)
+
+
+class TestDormandPrince(unittest.TestCase):
+
+  def test_matches_fine_fixed_steps(self):
+    reference = ChainDynamics([1.0, 1.0], [2.0, 2.5])
+    for _ in range(2000):
+      reference.step(0.0005)
+    adaptive = ChainDynamics([1.0, 1.0], [2.0, 2.5], integrator = DormandPrince(rtol = 1e-9, atol = 1e-12))
+    for _ in range(10):
+      adaptive.step(0.1)
+    self.assertAlmostEqual(adaptive.time, reference.time)
+    numpy.testing.assert_allclose(adaptive.theta, reference.theta, atol = 1e-6)
+
+  def test_adapts_internal_steps(self):
+    integrator = DormandPrince(rtol = 1e-8, atol = 1e-10, initial_step = 1.0)
+    dynamics = ChainDynamics([1.0, 0.5], [3.0, -3.0], integrator = integrator)
+    energy = dynamics.energy()
+    dynamics.step(1.0)
+    self.assertTrue(integrator.accepted > 10)
+    self.assertTrue(integrator.rejected > 0)
+    self.assertAlmostEqual(dynamics.energy(), energy, 5)
+
+  def test_reuses_last_stage_of_accepted_steps(self):
+    integrator = DormandPrince(rtol = 1e-8, atol = 1e-10)
+    dynamics = ChainDynamics([1.0, 0.5], [3.0, -3.0], integrator = integrator)
+    accelerations, calls = dynamics.accelerations, []
+    dynamics.accelerations = lambda theta, omega: calls.append(None) or accelerations(theta, omega)
+    for _ in range(10):
+      dynamics.step(0.1)
+    self.assertEqual(len(calls), 1 + 6 * (integrator.accepted + integrator.rejected))
+
+
+class TestImplicitMidpoint(unittest.TestCase):
+
+  def test_momenta_and_velocities_are_inverse(self):
+    random = numpy.random.RandomState(1)
+    theta, omega = random.randn(5), random.randn(5)
+    lengths, masses = random.rand(5) + 0.5, random.rand(5) + 0.5
+    momenta = chain_momenta(theta, omega, lengths, masses)
+    numpy.testing.assert_allclose(chain_velocities(theta, momenta, lengths, masses), omega)
+
+  def test_is_time_reversible(self):
+    dynamics = ChainDynamics([1.0, 0.5, 1.0], [1.5, -0.5, 2.0], integrator = ImplicitMidpoint())
+    for dt in [0.02] * 50 + [-0.02] * 50:
+      dynamics.step(dt)
+    numpy.testing.assert_allclose(dynamics.theta, [1.5, -0.5, 2.0], atol = 1e-9)
+    numpy.testing.assert_allclose(dynamics.omega, [0.0, 0.0, 0.0], atol = 1e-9)
+
+  def test_energy_stays_bounded_at_large_steps(self):
+    dynamics = ChainDynamics([1.0, 1.0], [1.0, 0.5], integrator = ImplicitMidpoint())
+    energy = dynamics.energy()
+    worst = 0.0
+    for _ in range(2000):
+      dynamics.step(0.05)
+      worst = max(worst, abs(dynamics.energy() - energy))
+    self.assertTrue(worst < 0.05)
+
+
+class TestElasticChain(unittest.TestCase):
+
+  def setUp(self):
+    self.dynamics = ElasticChainDynamics([1.0, 0.8, 1.2], [0.4, 1.5, -0.7], [1.0, 2.0, 0.5], [0.3, -0.2, 0.5],
+                                         springs = [1], stiffness = [60.0], rest_lengths = [0.7], rates = [0.4])
+
+  def test_matches_rigid_chain_without_springs(self):
+    rigid = ChainDynamics([1.0, 0.8, 1.2], [0.4, 1.5, -0.7], [1.0, 2.0, 0.5], [0.3, -0.2, 0.5])
+    elastic = ElasticChainDynamics([1.0, 0.8, 1.2], [0.4, 1.5, -0.7], [1.0, 2.0, 0.5], [0.3, -0.2, 0.5])
+    numpy.testing.assert_allclose(elastic.accelerations(), rigid.accelerations(), atol = 1e-12)
+
+  def test_armature_solves_shifted_mass_matrix(self):
+    theta = self.dynamics.theta
+    armature, forces = numpy.array([0.5, 0.0, 2.0, 3.0]), numpy.array([1.0, -2.0, 0.5, 4.0])
+    solution = elastic_accelerations(theta, numpy.zeros(4), self.dynamics.lengths, self.dynamics.masses, [1], 0.0,
+                                     forces, armature)
+    numpy.testing.assert_allclose(self.dynamics.momenta(theta, solution) + armature * solution, forces)
+
+  def test_conserves_energy(self):
+    energy = self.dynamics.energy()
+    for _ in range(500):
+      self.dynamics.step(0.002)
+    self.assertAlmostEqual(self.dynamics.energy(), energy, places = 6)
+    self.assertEqual(self.dynamics.theta.shape, (4,))
+
+  def test_implicit_euler_takes_stiff_springs_at_large_steps(self):
+    dynamics = ElasticChainDynamics([1.0, 1.0], [0.5, 0.0], springs = [1], stiffness = [1e6], damping = [10.0],
+                                    integrator = ImplicitEuler())
+    for _ in range(100):
+      dynamics.step(0.01)
+    self.assertTrue(numpy.all(numpy.isfinite(dynamics.theta)))
+    # the spring only sags under the weight it carries
+    self.assertTrue(abs(dynamics.theta[2] - 1.0) < 1e-4)
+
+  def test_rods_chain_mixes_springs(self):
+    chain = RodsChain()
+    chain.push(1.0, 30.0)
+    chain.push_spring(1.0, 60.0, 100.0, 0.5, 0.8)
+    self.assertTrue(isinstance(chain.rods[1], Spring))
+    self.assertFalse(isinstance(chain.rods[0], Spring))
+    chain.step(0.01)
+    self.assertEqual(chain.dynamics.springs, [1])
+    chain.interpolate()
+    # the stretched spring contracts
+    self.assertTrue(chain.lengths()[1] < 1.0)
+    spring = chain.pop()
+    self.assertEqual((spring.stiffness, spring.damping, spring.rest_length), (100.0, 0.5, 0.8))
+    chain.push(1.0, 0.0)
+    self.assertFalse(isinstance(chain.rods[1], Spring))
+
+
+class TestMultirate(unittest.TestCase):
+
+  def chain(self, integrator):
+    return ElasticChainDynamics([1.0, 1.0, 0.8, 1.0], numpy.radians([40.0, 90.0, -30.0, 20.0]), springs = [1, 3],
+                                stiffness = [1e4, 5e3], rest_lengths = [0.999, 0.8], integrator = integrator)
+
+  def test_coupling_is_spring_block_of_inverse_mass_matrix(self):
+    dynamics = ElasticChainDynamics([1.0] * 6, [0.7, 1.5, -0.5, 0.3, 1.0, 0.2], springs = [0, 1, 2, 4, 5],
+                                    stiffness = [10.0] * 5)
+    lower, diagonal, upper = Multirate().coupling(dynamics, dynamics.theta)
+    inverse = numpy.array([dynamics.velocities(dynamics.theta, unit) for unit in numpy.eye(11)])[6:, 6:]
+    numpy.testing.assert_allclose(numpy.diag(diagonal) + numpy.diag(lower[1:], -1) + numpy.diag(upper[:-1], 1),
+                                  inverse, atol = 1e-14)
+
+  def test_substeps_springs_within_slow_steps(self):
+    reference = self.chain(RungeKutta4())
+    for _ in range(1000):
+      reference.step(1e-4)
+    dynamics = self.chain(Multirate(10))
+    for _ in range(50):
+      dynamics.step(2e-3)
+    numpy.testing.assert_allclose(dynamics.theta, reference.theta, atol = 1e-3)
+    self.assertAlmostEqual(dynamics.time, reference.time)
+
+  def test_rigid_chain_keeps_energy(self):
+    dynamics = ChainDynamics([1.0, 1.0], [1.0, 0.5], integrator = Multirate())
+    energy = dynamics.energy()
+    for _ in range(100):
+      dynamics.step(0.01)
+    self.assertAlmostEqual(dynamics.energy(), energy, places = 2)
+
+
+class TestRattle(unittest.TestCase):
+
+  def test_solves_tridiagonal_systems(self):
+    random = numpy.random.RandomState(2)
+    lower, diagonal, upper, values = random.rand(4, 7)
+    matrix = numpy.diag(diagonal + 2.0) + numpy.diag(lower[1:], -1) + numpy.diag(upper[:-1], 1)
+    numpy.testing.assert_allclose(_solve_tridiagonal(lower, diagonal + 2.0, upper, values),
+                                  numpy.linalg.solve(matrix, values))
+
+  def test_coordinates_invert_cartesian(self):
+    dynamics = ElasticChainDynamics([1.0, 0.8, 1.2], [0.4, 3.5, -0.7], [1.0, 2.0, 0.5], [0.3, -0.2, 0.5],
+                                    springs = [1], stiffness = [60.0], rates = [0.4])
+    theta, omega = dynamics.coordinates(*dynamics.cartesian(dynamics.theta, dynamics.omega), theta = dynamics.theta)
+    numpy.testing.assert_allclose(theta, dynamics.theta)
+    numpy.testing.assert_allclose(omega, dynamics.omega)
+
+  def test_matches_reduced_coordinates(self):
+    for make in (lambda integrator: ChainDynamics([1.0, 0.5, 1.0], [0.5, 1.0, -0.3], integrator = integrator),
+                 lambda integrator: ElasticChainDynamics([1.0, 1.0, 1.0], [0.5, 1.0, -0.3], springs = [1],
+                                                         stiffness = [200.0], integrator = integrator)):
+      reference, dynamics = make(RungeKutta4()), make(Rattle())
+      energy = dynamics.energy()
+      for _ in range(500):
+        reference.step(0.001)
+        dynamics.step(0.001)
+      numpy.testing.assert_allclose(dynamics.theta, reference.theta, atol = 1e-4)
+      self.assertAlmostEqual(dynamics.energy(), energy, places = 3)
+
+  def test_keeps_lengths_of_long_chains(self):
+    dynamics = ChainDynamics([0.005] * 200, [0.3] * 200, integrator = Rattle())
+    energy = dynamics.energy()
+    for _ in range(100):
+      dynamics.step(0.001)
+    x, y, vx, vy = dynamics.cartesian(dynamics.theta, dynamics.omega)
+    numpy.testing.assert_allclose(numpy.hypot(numpy.diff(x), numpy.diff(y)), 0.005)
+    self.assertTrue(abs(dynamics.energy() - energy) < 1e-3)
+    self.assertTrue(dynamics.integrator.iterations <= 400)
+
+  def test_implicit_euler_steps_long_chains(self):
+    dynamics = ChainDynamics([0.001] * 1000, [0.3] * 1000, integrator = ImplicitEuler())
+    for _ in range(10):
+      dynamics.step(0.01)
+    self.assertTrue(numpy.all(numpy.isfinite(dynamics.theta)))
+    self.assertTrue(dynamics.integrator.iterations <= 100)
+
+
+class TestNormalModes(unittest.TestCase):
+
+  def test_double_pendulum_frequencies(self):
+    modes = NormalModes([1.0, 1.0], [1.0, 1.0], 9.81)
+    numpy.testing.assert_allclose(modes.frequencies ** 2, [9.81 * (2.0 - math.sqrt(2.0)), 9.81 * (2.0 + math.sqrt(2.0))])
+    # the slow mode swings both rods the same way
+    self.assertTrue(modes.shapes[0, 0] * modes.shapes[1, 0] > 0.0)
+
+  def test_starts_from_given_state(self):
+    modes = NormalModes([1.0, 0.5, 0.8], [1.0, 2.0, 0.5])
+    modes.start([0.01, -0.02, 0.005], [0.1, 0.0, -0.05], time = 2.0)
+    theta, omega = modes.state(2.0)
+    numpy.testing.assert_allclose(theta, [0.01, -0.02, 0.005], atol = 1e-15)
+    numpy.testing.assert_allclose(omega, [0.1, 0.0, -0.05], atol = 1e-15)
+
+  def test_matches_small_oscillations(self):
+    dynamics = ChainDynamics([1.0, 0.5, 0.8], [0.0002, -0.0003, 0.0001], [1.0, 2.0, 0.5], [0.0, 0.001, 0.0])
+    modes = NormalModes.from_dynamics(dynamics)
+    for _ in range(1000):
+      dynamics.step(0.002)
+    theta, omega = modes.state(dynamics.time)
+    numpy.testing.assert_allclose(theta, dynamics.theta, atol = 1e-8)
+    numpy.testing.assert_allclose(omega, dynamics.omega, atol = 1e-7)
+    theta, omega = modes.state(numpy.array([0.0, dynamics.time]))
+    self.assertEqual(theta.shape, (2, 3))
+    numpy.testing.assert_allclose(theta[1], dynamics.theta, atol = 1e-8)
+
+  def test_rods_chain_modes(self):
+    chain = RodsChain()
+    chain.push(1.0, 1.0)
+    chain.push(1.0, -1.0)
+    theta, omega = chain.normal_modes().state(0.0)
+    numpy.testing.assert_allclose(theta, numpy.radians([1.0, -1.0]))
+    chain.push_spring(1.0, 0.0, 100.0)
+    self.assertRaises(ValueError, chain.normal_modes)
+
+
+class TestFoucaultPendulum(unittest.TestCase):
+
+  def test_swing_period_of_large_amplitudes(self):
+    self.assertAlmostEqual(swing_period(1.0, 1e-9, 9.81), 2.0 * math.pi * math.sqrt(1.0 / 9.81))
+    # 4 K(sin 45 degrees) for a swing up to the horizontal
+    self.assertAlmostEqual(swing_period(1.0, 0.5 * math.pi, 9.81), 4.0 * 1.854074677301372 / math.sqrt(9.81))
+
+  def test_places_a_rod_of_its_length(self):
+    pendulum = FoucaultPendulum(2.0, math.radians(50.0), 0.3, position = (0.0, 1.0, 0.0))
+    chain = RodsChain((0.0, 1.0, 0.0))
+    pendulum.advance(60.0)
+    chain.place(pendulum.tips())
+    self.assertEqual(len(chain.buffer), 1)
+    numpy.testing.assert_allclose(chain.tips(), pendulum.tips())
+    self.assertAlmostEqual(chain.lengths()[0], 2.0)
+
+  def test_steps_keep_length_and_energy(self):
+    pendulum = FoucaultPendulum(2.0, math.radians(50.0), 0.8, rate = 0.05)
+    energy = pendulum.energy()
+    for _ in range(2000):
+      pendulum.step(0.01)
+    self.assertAlmostEqual(numpy.linalg.norm(pendulum.r), 2.0, places = 12)
+    self.assertAlmostEqual(pendulum.energy(), energy, places = 5)
+    self.assertTrue(abs(pendulum.r[2]) > 0.01)
+
+  def test_averaging_follows_steps(self):
+    averaged = FoucaultPendulum(10.0, math.radians(45.0), 0.1, rate = 0.01)
+    stepped = FoucaultPendulum(10.0, math.radians(45.0), 0.1, rate = 0.01)
+    duration = 50.0 * averaged.period() + 1.0
+    averaged.advance(duration, periods = 10)
+    for _ in range(5000):
+      stepped.step(duration / 5000)
+    self.assertAlmostEqual(averaged.time, stepped.time)
+    numpy.testing.assert_allclose(averaged.tips(), stepped.tips(), atol = 2e-3)
+
+  def test_plane_turns_with_the_earth(self):
+    pendulum = FoucaultPendulum(10.0, math.radians(45.0), 0.05)
+    energy = pendulum.energy()
+    pendulum.advance(pendulum.precession_period() / 8.0)
+    # clockwise seen from above in the northern hemisphere
+    self.assertAlmostEqual(pendulum.azimuth(), -0.25 * math.pi, places = 2)
+    self.assertAlmostEqual(pendulum.energy(), energy, places = 4)
+    self.assertEqual(FoucaultPendulum(1.0, 0.0, 0.1).precession_period(), float("inf"))
+
+
+class TestChainEnsemble(unittest.TestCase):
+
+  def setUp(self):
+    self.chains = [ChainDynamics([1.0, 0.5], [0.5, 1.0]),
+                   ChainDynamics([2.0, 1.0], [3.0, -1.0], [1.0, 3.0]),
+                   ChainDynamics([0.5, 0.5], [0.0, 0.1], velocities = [1.0, 0.0])]
+    self.ensemble = ChainEnsemble.from_chains(self.chains)
+
+  def test_stacks_states(self):
+    self.assertEqual(len(self.ensemble), 3)
+    self.assertEqual(self.ensemble.links(), 2)
+    self.assertEqual(self.ensemble.theta.shape, (3, 2))
+    self.assertEqual(self.ensemble.tips().shape, (3, 2, 3))
+
+  def test_advances_like_separate_chains(self):
+    for _ in range(100):
+      self.ensemble.step(0.01)
+      for chain in self.chains:
+        chain.step(0.01)
+    for index, chain in enumerate(self.chains):
+      numpy.testing.assert_allclose(self.ensemble.theta[index], chain.theta)
+      numpy.testing.assert_allclose(self.ensemble.energy()[index], chain.energy())
+      numpy.testing.assert_allclose(self.ensemble.chain(index).omega, chain.omega)
+
+  def test_select_drops_members(self):
+    self.ensemble.select(numpy.array([True, False, True]))
+    self.assertEqual(len(self.ensemble), 2)
+    self.assertEqual(self.ensemble.lengths[1].tolist(), [0.5, 0.5])
+    self.ensemble.step(0.01)
+
+  def test_broadcasts_shared_lengths(self):
+    ensemble = ChainEnsemble([1.0, 2.0], [[0.1, 0.2], [0.3, 0.4]])
+    self.assertEqual(ensemble.lengths.shape, (2, 2))
+    self.assertRaises(ValueError, ChainEnsemble, [1.0], [0.1])
+
+
+class TestSweep(unittest.TestCase):
+
+  def setUp(self):
+    handle, self.path = tempfile.mkstemp(suffix = ".csv")
+    os.close(handle)
+
+  def tearDown(self):
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+  def sweep(self):
+    cases = grid([("angle0", [30.0, 90.0, 150.0]), ("length1", [0.5, 1.0])])
+    return Sweep([(1.0, 0.0), (1.0, 0.0)], ["angle0", "length1"], cases, 0.5, 0.01, shard_size = 2, workers = 2)
+
+  def test_configure_overrides_base_rods(self):
+    self.assertEqual(configure([(1.0, 0.0), (2.0, 5.0, 3.0)], {"angle1": 9.0, "mass0": 2.0}),
+                     [[1.0, 0.0, 2.0], [2.0, 9.0, 3.0]])
+    self.assertRaises(ValueError, parameter, "angle")
+
+  def test_shard_metrics(self):
+    rows = run_shard([(1.0, 90.0), (1.0, 90.0)], [(0, {}), (1, {"angle0": 100.0, "angle1": -170.0})], 1.0, 0.01, "rk4")
+    index, values, (excursion, drift, flip) = rows[0]
+    self.assertAlmostEqual(excursion, math.sqrt(8.0), 2)
+    self.assertTrue(drift < 1e-4)
+    self.assertTrue(math.isnan(flip))
+    self.assertTrue(0.0 < rows[1][2][2] < 1.0)
+
+  def test_runs_and_resumes(self):
+    self.sweep().run(self.path)
+    results = load_results(self.path)
+    self.assertEqual(sorted(results["index"].tolist()), range(6))
+    lines = open(self.path).readlines()
+    open(self.path, "w").write("".join(lines[:3]) + lines[3][:5])
+    self.sweep().run(self.path)
+    resumed = load_results(self.path)
+    self.assertEqual(sorted(resumed["index"].tolist()), range(6))
+    self.assertEqual(sorted(resumed["max_excursion"].tolist()), sorted(results["max_excursion"].tolist()))
+
+
+class TestFlipMap(unittest.TestCase):
+
+  def test_flip_times_match_single_runs(self):
+    angles = [-170.0, -90.0, 10.0, 100.0]
+    times = flip_map(angles, angles, duration = 2.0, time_step = 0.01)
+    self.assertEqual(times.shape, (4, 4))
+    for i, j in ((0, 3), (3, 0), (2, 2)):
+      dynamics = ChainDynamics([1.0, 1.0], numpy.radians([angles[i], angles[j]]))
+      flipped = numpy.nan
+      while dynamics.time < 2.0 - 1e-9:
+        dynamics.step(0.01)
+        if numpy.any(abs(dynamics.theta) > math.pi):
+          flipped = dynamics.time
+          break
+      if math.isnan(flipped):
+        self.assertTrue(math.isnan(times[i, j]))
+      else:
+        self.assertAlmostEqual(times[i, j], flipped)
+
+  def test_small_swings_never_flip(self):
+    self.assertTrue(numpy.isnan(flip_map([10.0], [-10.0], duration = 1.0)).all())
+
+
+class TestTrajectoryRecorder(unittest.TestCase):
+
+  def setUp(self):
+    handle, self.path = tempfile.mkstemp(suffix = ".traj")
+    os.close(handle)
+
+  def tearDown(self):
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+  def test_streams_every_nth_state_across_chunks(self):
+    runner = BatchRunner(build_chain([(1.0, 30.0), (0.5, 60.0)]), 0.01, steps = 50, every = 5)
+    time, theta, omega = BatchRunner(build_chain([(1.0, 30.0), (0.5, 60.0)]), 0.01, steps = 50, every = 5).run()
+    with TrajectoryRecorder(self.path, 2, 0.01, every = 5, chunk = 4) as recorder:
+      runner.stream(recorder)
+    trajectory = TrajectoryFile(self.path)
+    self.assertEqual((trajectory.links, trajectory.every, trajectory.time_step), (2, 5, 0.01))
+    self.assertEqual(len(trajectory), 11)
+    self.assertEqual(os.path.getsize(self.path), HEADER_SIZE + 11 * record_dtype(2).itemsize)
+    numpy.testing.assert_allclose(trajectory.time, time)
+    numpy.testing.assert_allclose(trajectory.theta, theta)
+    numpy.testing.assert_allclose(trajectory.omega, omega)
+    numpy.testing.assert_allclose(trajectory.tips[-1], runner.dynamics.tips())
+
+  def test_reads_records_flushed_before_interruption(self):
+    recorder = TrajectoryRecorder(self.path, 1, 0.1, dtype = "<f4", chunk = 3)
+    for i in range(5):
+      recorder.write(i * 0.1, [i], [0.0], [[0.0, 0.0, 0.0]])
+    # the second chunk was mapped after flushing three records
+    trajectory = TrajectoryFile(self.path)
+    self.assertEqual(len(trajectory), 3)
+    self.assertEqual(trajectory.dtype, "<f4")
+    recorder.close()
+    self.assertEqual(TrajectoryFile(self.path).theta[:, 0].tolist(), [0.0, 1.0, 2.0, 3.0, 4.0])
+
+  def test_reads_files_of_the_first_version(self):
+    layout = record_dtype(1)
+    records = numpy.zeros(2, dtype = layout)
+    records["time"], records["theta"][:, 0] = [0.0, 0.1], [0.5, 0.4]
+    header = struct.pack("<8sIIdI8sQ", MAGIC, 1, 1, 0.1, 1, b"<f8", 2)
+    with open(self.path, "wb") as output:
+      output.write(header + b"\0" * (64 - len(header)) + records.tobytes())
+    trajectory = TrajectoryFile(self.path)
+    self.assertEqual(trajectory.position, (0.0, 0.0, 0.0))
+    self.assertEqual(trajectory.theta[:, 0].tolist(), [0.5, 0.4])
+    header = struct.pack("<8sI", MAGIC, 99)
+    with open(self.path, "wb") as output:
+      output.write(header + b"\0" * (HEADER_SIZE - len(header)))
+    self.assertRaises(ValueError, TrajectoryFile, self.path)
+
+
+class TestTrajectoryPlayer(unittest.TestCase):
+
+  def setUp(self):
+    handle, self.path = tempfile.mkstemp(suffix = ".traj")
+    os.close(handle)
+    self.dynamics = build_chain([(1.0, 30.0), (0.5, 60.0)], position = (0.5, 1.0, 0.0))
+    with TrajectoryRecorder(self.path, 2, 0.01, every = 2, position = self.dynamics.position) as recorder:
+      BatchRunner(self.dynamics, 0.01, steps = 40, every = 2).stream(recorder)
+    self.player = TrajectoryPlayer(TrajectoryFile(self.path), keyframe_interval = 4)
+
+  def tearDown(self):
+    self.player = None
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+  def test_locates_records_by_time(self):
+    self.assertEqual(self.player.locate(0.0), 0)
+    self.assertEqual(self.player.locate(0.05), 2)
+    self.assertEqual(self.player.locate(self.player.end), 20)
+    # uneven times fall back to the keyframe index
+    self.player.spacing = 0.003
+    self.assertEqual(self.player.locate(0.05), 2)
+    self.assertEqual(self.player.locate(0.33), 16)
+
+  def test_interpolates_between_records(self):
+    trajectory = self.player.trajectory
+    theta, tips = self.player.state(0.39)
+    numpy.testing.assert_allclose(theta, (trajectory.theta[19] + trajectory.theta[20]) / 2.0)
+    theta, tips = self.player.state(self.player.end)
+    numpy.testing.assert_allclose(tips, self.dynamics.tips())
+
+  def test_plays_at_given_speed_and_stops_at_the_end(self):
+    self.player.advance(0.1)
+    self.assertEqual(self.player.time, 0.0)
+    self.player.play()
+    self.player.speed = 2.0
+    self.assertAlmostEqual(self.player.advance(0.1), 0.2)
+    self.assertEqual(self.player.advance(1.0), self.player.end)
+    self.assertFalse(self.player.playing)
+    self.player.play()
+    self.assertEqual(self.player.time, 0.0)
+
+  def test_places_chain_on_tips(self):
+    chain = RodsChain((0.5, 1.0, 0.0))
+    chain.push(2.0, 0.0)
+    chain.place(self.player.state(0.2)[1])
+    self.assertEqual(len(chain.rods), 2)
+    numpy.testing.assert_allclose(chain.lengths(), [1.0, 0.5])
+    numpy.testing.assert_allclose(chain.positions()[0], [0.5, 1.0, 0.0])
+
+
+class TestCheckpoint(unittest.TestCase):
+
+  def setUp(self):
+    handle, self.path = tempfile.mkstemp(suffix = ".npz")
+    os.close(handle)
+
+  def tearDown(self):
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+  def assertContinuesIdentically(self, dynamics, steps = 30):
+    save_checkpoint(self.path, dynamics)
+    restored = load_checkpoint(self.path)
+    self.assertEqual(type(restored), type(dynamics))
+    public = lambda integrator: dict(item for item in vars(integrator).items() if not item[0].startswith("_"))
+    self.assertEqual(public(restored.integrator), public(dynamics.integrator))
+    for _ in range(steps):
+      dynamics.step(0.01)
+      restored.step(0.01)
+    self.assertTrue(numpy.array_equal(restored.theta, dynamics.theta))
+    self.assertTrue(numpy.array_equal(restored.omega, dynamics.omega))
+    self.assertEqual((restored.time, restored.steps), (dynamics.time, dynamics.steps))
+
+  def test_continues_bit_for_bit(self):
+    for integrator in INTEGRATORS.values():
+      dynamics = build_chain([(1.0, 120.0, 2.0), (0.5, -60.0)], (0.0, 1.0, 0.0), integrator())
+      BatchRunner(dynamics, 0.01, steps = 17).run()
+      self.assertContinuesIdentically(dynamics)
+
+  def test_restores_elastic_chains(self):
+    dynamics = ElasticChainDynamics([1.0, 1.0], [0.5, 1.0], springs = [0], stiffness = [500.0], damping = [1.0],
+                                    integrator = ImplicitEuler())
+    dynamics.step(0.01)
+    self.assertContinuesIdentically(dynamics)
+    self.assertEqual(load_checkpoint(self.path).springs, [0])
+
+  def test_restores_physical_rods(self):
+    dynamics = ChainDynamics([1.0, 1.0], [0.5, 1.0], offsets = [0.5, 0.5], inertias = [0.1, 0.1])
+    dynamics.step(0.01)
+    self.assertContinuesIdentically(dynamics)
+    chain = RodsChain()
+    chain.resume(load_checkpoint(self.path))
+    self.assertTrue(chain.rods[1].physical)
+    self.assertAlmostEqual(chain.rods[1].inertia(), 0.1)
+
+  def test_restores_ensembles_and_random_generators(self):
+    ensemble = ChainEnsemble([1.0, 0.5], numpy.radians([[30.0, 60.0], [90.0, -45.0]]))
+    ensemble.step(0.01)
+    self.assertContinuesIdentically(ensemble)
+    python, numpy_random = random.Random(3), numpy.random.RandomState(3)
+    for generator, draw in ((python, lambda: python.gauss(0.0, 1.0)), (numpy_random, numpy_random.normal)):
+      draw()
+      save_checkpoint(self.path, ensemble, generator)
+      expected = [draw() for _ in range(3)]
+      load_checkpoint(self.path, generator)
+      self.assertEqual([draw() for _ in range(3)], expected)
+
+  def test_resumes_rods_chain(self):
+    chain = RodsChain()
+    chain.push(1.0, 45.0, 2.0)
+    chain.push(1.0, 90.0)
+    chain.step(0.01)
+    save_checkpoint(self.path, chain.dynamics)
+    restored = RodsChain()
+    restored.resume(load_checkpoint(self.path))
+    chain.step(0.01)
+    restored.step(0.01)
+    chain.interpolate()
+    restored.interpolate()
+    numpy.testing.assert_array_equal(restored.tips(), chain.tips())
+    numpy.testing.assert_array_equal(restored.masses(), [2.0, 1.0])
+
+
+class TestFixedTimestep(unittest.TestCase):
+
+  def setUp(self):
+    self.timestep = FixedTimestep(0.01)
+
+  def test_accumulates_frames_into_whole_steps(self):
+    self.assertEqual(self.timestep.advance(0.025), 2)
+    self.assertAlmostEqual(self.timestep.alpha(), 0.5)
+    self.assertEqual(self.timestep.advance(0.006), 1)
+    self.assertAlmostEqual(self.timestep.alpha(), 0.1)
+
+  def test_clamps_long_frames(self):
+    self.assertEqual(self.timestep.advance(10.0), 25)
+
+
+class TestBatchRunner(unittest.TestCase):
+
+  def test_build_chain_follows_push_conventions(self):
+    dynamics = build_chain([(math.sqrt(2), 45.0), (1.0, 180.0, 2.0)])
+    self.assertAlmostEqual(dynamics.tips()[1][0], 1.0)
+    self.assertAlmostEqual(dynamics.tips()[1][1], 0.0)
+    self.assertEqual(dynamics.masses.tolist(), [1.0, 2.0])
+
+  def test_run_samples_every_nth_state(self):
+    runner = BatchRunner(build_chain([(1.0, 30.0)]), 0.01, duration = 1.0, every = 10)
+    time, theta, omega = runner.run()
+    self.assertEqual(theta.shape, (11, 1))
+    self.assertAlmostEqual(time[-1], 1.0)
+    self.assertAlmostEqual(theta[0][0], math.radians(30.0))
+
+  def test_runs_ensembles(self):
+    ensemble = ChainEnsemble([1.0], [[0.1], [0.2]])
+    time, theta, omega = BatchRunner(ensemble, 0.01, steps = 4).run()
+    self.assertEqual(theta.shape, (5, 2, 1))
+
+  def test_requires_steps_or_duration(self):
+    self.assertRaises(ValueError, BatchRunner, build_chain([(1.0, 30.0)]))
+
 
 if __name__ == '__main__':
   unittest.main()